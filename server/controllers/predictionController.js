@@ -1,7 +1,27 @@
-const { spawn } = require('child_process');
-const path = require('path');
+const { pool } = require('../services/predictionWorkerPool');
+
+// Format the predictions for the API response
+const formatPredictions = (predictions) => {
+    const formattedPredictions = {
+        ensemble: predictions.ensemble,
+        modelPredictions: {}
+    };
+
+    if (predictions.timings) {
+        formattedPredictions.timings = predictions.timings;
+    }
+
+    // Add individual model predictions
+    Object.entries(predictions).forEach(([modelName, prediction]) => {
+        if (modelName !== 'ensemble' && modelName !== 'timings') {
+            formattedPredictions.modelPredictions[modelName] = prediction;
+        }
+    });
 
-const makePrediction = async (predictionData) => {
+    return formattedPredictions;
+};
+
+const makePrediction = async (predictionData, userId) => {
     return new Promise((resolve, reject) => {
         try {
             // console.log('Prediction Input Data:', predictionData);
@@ -25,67 +45,19 @@ const makePrediction = async (predictionData) => {
             // Remove NumMajorVessels from the prediction data
             const { NumMajorVessels, ...cleanedData } = predictionData;
 
-            const pythonScript = path.join(__dirname, '../ml/predict.py');
-            const pythonProcess = spawn('python', [pythonScript]);
-
-            let result = '';
-            let error = '';
-
-            // Send the cleaned data to Python script
-            const jsonInput = JSON.stringify(cleanedData) + '\n';
-            pythonProcess.stdin.write(jsonInput);
-            pythonProcess.stdin.end();
-
-            pythonProcess.stdout.on('data', (data) => {
-                result += data.toString();
-            });
-
-            pythonProcess.stderr.on('data', (data) => {
-                error += data.toString();
-                console.error('Python Error:', data.toString());
-            });
-
-            pythonProcess.on('error', (err) => {
-                console.error('Process Spawn Error:', err);
-                reject(new Error(`Failed to spawn Python process: ${err.message}`));
-            });
-
-            pythonProcess.on('close', (code) => {
-                // console.log('Python Process Exit Code:', code);
-                // console.log('Raw Result:', result);
-                // console.log('Raw Error:', error);
-
-                if (code !== 0) {
-                    reject(new Error(`Prediction failed: ${error || 'Unknown error'}`));
-                    return;
-                }
-
-                try {
-                    const predictions = JSON.parse(result.trim());
-                    
+            // Score on a warm worker instead of spawning predict.py per request
+            pool.predict(cleanedData, 'heart_disease', userId)
+                .then((predictions) => {
                     if (predictions.error) {
                         reject(new Error(predictions.error));
                         return;
                     }
 
-                    // Format the predictions for the API response
-                    const formattedPredictions = {
-                        ensemble: predictions.ensemble,
-                        modelPredictions: {}
-                    };
-
-                    // Add individual model predictions
-                    Object.entries(predictions).forEach(([modelName, prediction]) => {
-                        if (modelName !== 'ensemble') {
-                            formattedPredictions.modelPredictions[modelName] = prediction;
-                        }
-                    });
-
-                    resolve(formattedPredictions);
-                } catch (e) {
-                    reject(new Error(`Failed to process prediction: ${e.message}`));
-                }
-            });
+                    resolve(formatPredictions(predictions));
+                })
+                .catch((err) => {
+                    reject(new Error(`Prediction failed: ${err.message}`));
+                });
 
         } catch (err) {
             console.error('Prediction Controller Error:', err);
@@ -94,11 +66,67 @@ const makePrediction = async (predictionData) => {
     });
 };
 
-const getPredictionHistory = async (userId) => {
-    return [];
+const makeBatchPrediction = async (records, conditionType = 'heart_disease', userId) => {
+    if (!Array.isArray(records) || records.length === 0) {
+        throw new Error('records must be a non-empty array');
+    }
+
+    // Drop NumMajorVessels from every record as it's not used in our model
+    const cleanedRecords = records.map((record) => {
+        if (record === null || typeof record !== 'object') {
+            return record;
+        }
+        const { NumMajorVessels, ...cleanedData } = record;
+        return cleanedData;
+    });
+
+    let predictions;
+    try {
+        const payload = { records: cleanedRecords, condition_type: conditionType };
+        if (userId !== undefined && userId !== null) {
+            payload.user_id = String(userId);
+        }
+        predictions = await pool.request(payload);
+    } catch (err) {
+        throw new Error(`Batch prediction failed: ${err.message}`);
+    }
+
+    if (predictions.error) {
+        throw new Error(predictions.error);
+    }
+
+    // Keep per-record errors in place so results stay aligned with the input
+    return predictions.results.map((prediction) =>
+        prediction.error ? { error: prediction.error } : formatPredictions(prediction)
+    );
+};
+
+// Page through a user's past predictions, newest first
+const getPredictionHistory = async (userId, limit = 50, cursor = null) => {
+    let history;
+    try {
+        history = await pool.history(userId, limit, cursor);
+    } catch (err) {
+        throw new Error(`Prediction history failed: ${err.message}`);
+    }
+
+    if (history.error) {
+        throw new Error(history.error);
+    }
+
+    return {
+        predictions: history.entries.map((entry) => ({
+            timestamp: new Date(entry.timestamp * 1000).toISOString(),
+            conditionType: entry.condition_type,
+            input: entry.record,
+            prediction: formatPredictions(entry.result)
+        })),
+        nextCursor: history.next_cursor
+    };
 };
 
 module.exports = {
     makePrediction,
+    makeBatchPrediction,
     getPredictionHistory
 };
\ No newline at end of file
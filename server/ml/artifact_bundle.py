@@ -0,0 +1,529 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from tree_compiler import compile_model, load_compiled, save_compiled
+
+# Bump when the on-disk layout changes in a way older loaders cannot read
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+# save_bundle moves the live bundle here while it swaps the new one in
+SWAP_SUFFIX = '.old'
+
+
+class BundleSchemaError(ValueError):
+    """Raised when a bundle does not match the schema it claims or the loader expects"""
+
+
+def schema_hash(feature_names, encoded_feature_names):
+    """Stable hash of the input schema a bundle was trained on"""
+    schema = json.dumps({
+        'feature_names': list(feature_names),
+        'encoded_feature_names': list(encoded_feature_names)
+    }, sort_keys=True)
+    return hashlib.sha256(schema.encode('utf-8')).hexdigest()
+
+
+def member_slug(name):
+    """Directory name for an ensemble member"""
+    return name.lower().replace(' ', '_')
+
+
+def _json_value(value):
+    """Convert NumPy scalars in metadata to plain JSON values"""
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Value of type {type(value).__name__} cannot be stored in the manifest")
+
+
+def _json_params(model):
+    """Constructor parameters that can be stored as JSON"""
+    return {
+        key: value for key, value in model.get_params(deep=False).items()
+        if value is None or isinstance(value, (bool, int, float, str))
+    }
+
+
+_accepted_params = {}
+
+
+def _construct(cls, params):
+    """Instantiate an estimator, ignoring parameters this library version no longer accepts"""
+    if cls not in _accepted_params:
+        _accepted_params[cls] = set(cls().get_params(deep=False))
+    accepted = _accepted_params[cls]
+    return cls(**{key: value for key, value in params.items() if key in accepted})
+
+
+def _save_array(directory, name, array):
+    np.save(os.path.join(directory, name + '.npy'), np.ascontiguousarray(array), allow_pickle=False)
+    return name + '.npy'
+
+
+def _load_array(directory, filename, mmap=True):
+    return np.load(os.path.join(directory, filename), mmap_mode='r' if mmap else None, allow_pickle=False)
+
+
+# Per-estimator serializers. Each save_* writes arrays into the member directory and
+# returns the JSON spec recorded in the manifest; each load_* rebuilds the estimator.
+
+def _save_logistic_regression(model, directory):
+    files = {attr: _save_array(directory, attr, getattr(model, attr))
+             for attr in ('classes_', 'coef_', 'intercept_', 'n_iter_')}
+    return {'params': _json_params(model), 'files': files}
+
+
+def _load_logistic_regression(spec, directory, mmap):
+    from sklearn.linear_model import LogisticRegression
+
+    model = _construct(LogisticRegression, spec['params'])
+    for attr, filename in spec['files'].items():
+        setattr(model, attr, _load_array(directory, filename, mmap=False))
+    model.n_features_in_ = model.coef_.shape[1]
+    return model
+
+
+def _save_gaussian_nb(model, directory):
+    files = {attr: _save_array(directory, attr, getattr(model, attr))
+             for attr in ('classes_', 'theta_', 'var_', 'class_count_', 'class_prior_')}
+    return {'params': _json_params(model), 'files': files, 'epsilon_': float(model.epsilon_)}
+
+
+def _load_gaussian_nb(spec, directory, mmap):
+    from sklearn.naive_bayes import GaussianNB
+
+    model = _construct(GaussianNB, spec['params'])
+    for attr, filename in spec['files'].items():
+        setattr(model, attr, _load_array(directory, filename, mmap=False))
+    model.epsilon_ = spec['epsilon_']
+    model.n_features_in_ = model.theta_.shape[1]
+    return model
+
+
+def _save_knn(model, directory):
+    from neighbor_index import NeighborIndex, save_index
+
+    y = model.classes_[model._y]
+    files = {
+        'fit_X': _save_array(directory, 'fit_X', model._fit_X),
+        'y': _save_array(directory, 'y', y),
+    }
+    # Prebuilt neighbour index, so serving needs no tree build and can search approximately
+    index = NeighborIndex.build(model._fit_X, y, model.n_neighbors)
+    return {'params': _json_params(model), 'files': files,
+            'index': save_index(index, os.path.join(directory, 'index'))}
+
+
+def _save_indexed_knn(model, directory):
+    from neighbor_index import save_index
+
+    # An index updated in place (incremental training) is stored as it is, not rebuilt
+    fit_X, y = model.index.rows()
+    files = {
+        'fit_X': _save_array(directory, 'fit_X', fit_X),
+        'y': _save_array(directory, 'y', y),
+    }
+    return {'params': {'n_neighbors': model.n_neighbors, 'weights': 'uniform', 'metric': 'minkowski', 'p': 2},
+            'files': files, 'index': save_index(model.index, os.path.join(directory, 'index'))}
+
+
+def _load_knn(spec, directory, mmap):
+    from sklearn.neighbors import KNeighborsClassifier
+
+    model = _construct(KNeighborsClassifier, spec['params'])
+    # Fitting a KNN only rebuilds its search structure over the stored training rows
+    model.fit(_load_array(directory, spec['files']['fit_X'], mmap),
+              _load_array(directory, spec['files']['y'], mmap=False))
+    return model
+
+
+def _save_trees(directory, trees):
+    """Store fitted sklearn trees as concatenated node and value arrays"""
+    states = [tree.tree_.__getstate__() for tree in trees]
+    return {
+        'nodes': _save_array(directory, 'nodes', np.concatenate([s['nodes'] for s in states])),
+        'values': _save_array(directory, 'values', np.concatenate([s['values'] for s in states])),
+        'node_counts': _save_array(directory, 'node_counts', np.array([s['node_count'] for s in states])),
+        'max_depths': _save_array(directory, 'max_depths', np.array([s['max_depth'] for s in states])),
+        'tree_classes': _save_array(directory, 'tree_classes', trees[0].classes_),
+    }
+
+
+def _load_trees(files, directory, params, n_features):
+    from sklearn.tree import DecisionTreeClassifier
+    from sklearn.tree._tree import Tree
+
+    nodes = _load_array(directory, files['nodes'], mmap=False)
+    values = _load_array(directory, files['values'], mmap=False)
+    node_counts = _load_array(directory, files['node_counts'], mmap=False)
+    max_depths = _load_array(directory, files['max_depths'], mmap=False)
+    classes = _load_array(directory, files['tree_classes'], mmap=False)
+
+    trees = []
+    start = 0
+    for node_count, max_depth in zip(node_counts.tolist(), max_depths.tolist()):
+        tree = Tree(n_features, np.array([len(classes)], dtype=np.intp), 1)
+        try:
+            tree.__setstate__({
+                'max_depth': max_depth,
+                'node_count': node_count,
+                'nodes': np.ascontiguousarray(nodes[start:start + node_count]),
+                'values': np.ascontiguousarray(values[start:start + node_count])
+            })
+        except ValueError as e:
+            raise BundleSchemaError(f"Tree node layout is not readable by this scikit-learn: {str(e)}")
+        start += node_count
+
+        model = _construct(DecisionTreeClassifier, params)
+        model.tree_ = tree
+        model.classes_ = classes
+        model.n_classes_ = len(classes)
+        model.n_outputs_ = 1
+        model.n_features_in_ = n_features
+        model.max_features_ = n_features
+        trees.append(model)
+
+    return trees
+
+
+def _save_decision_tree(model, directory):
+    return {'params': _json_params(model), 'files': _save_trees(directory, [model]),
+            'n_features': int(model.n_features_in_)}
+
+
+def _load_decision_tree(spec, directory, mmap):
+    return _load_trees(spec['files'], directory, spec['params'], spec['n_features'])[0]
+
+
+def _save_random_forest(model, directory):
+    files = _save_trees(directory, model.estimators_)
+    files['classes_'] = _save_array(directory, 'classes_', model.classes_)
+    return {'params': _json_params(model), 'files': files,
+            'tree_params': _json_params(model.estimators_[0]),
+            'n_features': int(model.n_features_in_)}
+
+
+def _load_random_forest(spec, directory, mmap):
+    from sklearn.ensemble import RandomForestClassifier
+
+    model = _construct(RandomForestClassifier, spec['params'])
+    model.estimators_ = _load_trees(spec['files'], directory, spec['tree_params'], spec['n_features'])
+    model.classes_ = _load_array(directory, spec['files']['classes_'], mmap=False)
+    model.n_classes_ = len(model.classes_)
+    model.n_outputs_ = 1
+    model.n_features_in_ = spec['n_features']
+    return model
+
+
+def _save_xgboost(model, directory):
+    # XGBoost's own format: portable across versions and never unpickled
+    model.save_model(os.path.join(directory, 'model.ubj'))
+    return {'files': {'model': 'model.ubj'}}
+
+
+def _load_xgboost(spec, directory, mmap):
+    from xgboost import XGBClassifier
+
+    model = XGBClassifier()
+    model.load_model(os.path.join(directory, spec['files']['model']))
+    return model
+
+
+# NumPy-only loaders used with compiled=True: the same stored arrays, no sklearn import
+
+def _load_numpy_logistic_regression(spec, directory, mmap):
+    from numpy_models import NumpyLogisticRegression
+
+    arrays = {attr: _load_array(directory, filename, mmap=False) for attr, filename in spec['files'].items()}
+    return NumpyLogisticRegression(arrays['classes_'], arrays['coef_'], arrays['intercept_'])
+
+
+def _load_numpy_gaussian_nb(spec, directory, mmap):
+    from numpy_models import NumpyGaussianNB
+
+    arrays = {attr: _load_array(directory, filename, mmap=False) for attr, filename in spec['files'].items()}
+    return NumpyGaussianNB(arrays['classes_'], arrays['theta_'], arrays['var_'], arrays['class_prior_'])
+
+
+def _load_numpy_knn(spec, directory, mmap):
+    from neighbor_index import IndexedKNeighbors, NeighborIndex, load_index
+
+    params = spec['params']
+    metric = params.get('metric', 'minkowski')
+    euclidean = metric == 'euclidean' or (metric == 'minkowski' and params.get('p', 2) == 2)
+    if params.get('weights', 'uniform') != 'uniform' or not euclidean:
+        # Other configurations keep the sklearn estimator
+        return _load_knn(spec, directory, mmap)
+    if 'index' in spec:
+        index = load_index(spec['index'], os.path.join(directory, 'index'), mmap)
+    else:
+        # Bundles written before indexes were stored: one list, exact search only
+        index = NeighborIndex.build(_load_array(directory, spec['files']['fit_X'], mmap=False),
+                                    _load_array(directory, spec['files']['y'], mmap=False),
+                                    params.get('n_neighbors', 5), n_lists=1)
+    return IndexedKNeighbors(index)
+
+
+SERIALIZERS = {
+    'LogisticRegression': ('logistic_regression', _save_logistic_regression),
+    'GaussianNB': ('gaussian_nb', _save_gaussian_nb),
+    'KNeighborsClassifier': ('knn', _save_knn),
+    'IndexedKNeighbors': ('knn', _save_indexed_knn),
+    'DecisionTreeClassifier': ('decision_tree', _save_decision_tree),
+    'RandomForestClassifier': ('random_forest', _save_random_forest),
+    'XGBClassifier': ('xgboost', _save_xgboost),
+}
+
+LOADERS = {
+    'logistic_regression': _load_logistic_regression,
+    'gaussian_nb': _load_gaussian_nb,
+    'knn': _load_knn,
+    'decision_tree': _load_decision_tree,
+    'random_forest': _load_random_forest,
+    'xgboost': _load_xgboost,
+}
+
+NUMPY_LOADERS = {
+    'logistic_regression': _load_numpy_logistic_regression,
+    'gaussian_nb': _load_numpy_gaussian_nb,
+    'knn': _load_numpy_knn,
+}
+
+
+def save_bundle(model_dict, bundle_dir):
+    """
+    Write a trained model dictionary as a versioned artifact bundle
+
+    Args:
+        model_dict: Dictionary with models, scaler, feature_names,
+            encoded_feature_names and model_performance, as saved by the training scripts
+        bundle_dir: Directory to create; an existing bundle there is replaced
+
+    Returns:
+        The manifest written to bundle_dir
+    """
+    # Build next to the target and swap it in, so readers never see a half-written bundle
+    staging_dir = bundle_dir.rstrip(os.sep) + '.tmp'
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    os.makedirs(staging_dir)
+
+    feature_names = list(model_dict['feature_names'])
+    encoded_feature_names = list(model_dict['encoded_feature_names'])
+    scaler = model_dict['scaler']
+
+    preprocessing = {
+        'mean': _save_array(staging_dir, 'scaler_mean', scaler.mean_),
+        'scale': _save_array(staging_dir, 'scaler_scale', scaler.scale_),
+        'var': _save_array(staging_dir, 'scaler_var', scaler.var_),
+        'n_samples_seen': int(np.max(scaler.n_samples_seen_)),
+        # Sparse training pipelines scale without centring
+        'with_mean': bool(scaler.with_mean),
+    }
+
+    members = {}
+    for name, model in model_dict['models'].items():
+        # Members left in an earlier feature space store the mapping onto it
+        input_transform = None
+        if type(model).__name__ == 'RescaledInput':
+            input_transform = (model.scale, model.offset)
+            model = model.model
+        class_name = type(model).__name__
+        if class_name not in SERIALIZERS:
+            raise BundleSchemaError(f"No bundle serializer for {name} ({class_name})")
+        kind, save = SERIALIZERS[class_name]
+
+        member_dir = os.path.join(staging_dir, 'members', member_slug(name))
+        os.makedirs(member_dir)
+        spec = save(model, member_dir)
+        spec['type'] = kind
+        if input_transform is not None:
+            spec['input_transform'] = {'scale': _save_array(member_dir, 'input_scale', input_transform[0]),
+                                       'offset': _save_array(member_dir, 'input_offset', input_transform[1])}
+        # Tree members also get flat node arrays, so loaders can skip sklearn/xgboost for them
+        try:
+            compiled = compile_model(model)
+        except ValueError:
+            compiled = None
+        if compiled is not None:
+            spec['compiled'] = save_compiled(compiled, os.path.join(member_dir, 'compiled'))
+        spec['path'] = os.path.join('members', member_slug(name))
+        members[name] = spec
+
+    # Anything else in the dictionary (e.g. target_column) is kept as metadata
+    reserved = {'models', 'scaler', 'feature_names', 'encoded_feature_names',
+                'model_performance', 'encoder', 'feature_encoder', 'ensemble_combiner', 'artifact_version'}
+    metadata = {key: value for key, value in model_dict.items() if key not in reserved}
+
+    manifest = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'feature_names': feature_names,
+        'encoded_feature_names': encoded_feature_names,
+        'schema_hash': schema_hash(feature_names, encoded_feature_names),
+        'model_performance': model_dict['model_performance'],
+        'preprocessing': preprocessing,
+        'members': members,
+        'metadata': metadata,
+    }
+    with open(os.path.join(staging_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, default=_json_value)
+
+    # Move the live bundle aside, rename the new one into place, then delete the old
+    # one; bundle_exists waits out the moment between the two renames
+    old_dir = bundle_dir.rstrip(os.sep) + SWAP_SUFFIX
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(bundle_dir):
+        os.rename(bundle_dir, old_dir)
+    os.rename(staging_dir, bundle_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+def bundle_exists(bundle_dir, timeout=1.0):
+    """
+    Whether a bundle is at bundle_dir, waiting (up to timeout seconds) for a
+    save_bundle swap in progress to put the new one in place
+    """
+    old_dir = bundle_dir.rstrip(os.sep) + SWAP_SUFFIX
+    deadline = time.monotonic() + timeout
+    while not os.path.isdir(bundle_dir):
+        if not os.path.isdir(old_dir):
+            # No swap under way, or it finished since the first check
+            return os.path.isdir(bundle_dir)
+        if time.monotonic() > deadline:
+            raise BundleSchemaError(f"{bundle_dir} was moved aside by an interrupted save; "
+                                    f"restore it from {old_dir}")
+        time.sleep(0.001)
+    return True
+
+
+def read_manifest(bundle_dir):
+    """Read and check a bundle's manifest without loading any member"""
+    with open(os.path.join(bundle_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+
+    if manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+        raise BundleSchemaError(
+            f"Bundle format version {manifest.get('format_version')} is not supported "
+            f"(expected {BUNDLE_FORMAT_VERSION})"
+        )
+
+    expected = schema_hash(manifest['feature_names'], manifest['encoded_feature_names'])
+    if manifest.get('schema_hash') != expected:
+        raise BundleSchemaError(
+            f"Bundle schema hash {manifest.get('schema_hash')} does not match its features ({expected})"
+        )
+
+    return manifest
+
+
+def load_bundle(bundle_dir, members=None, expected_schema_hash=None, mmap=True, compiled=False):
+    """
+    Load a bundle into the model dictionary layout predict.py uses
+
+    Args:
+        bundle_dir: Bundle directory written by save_bundle
+        members: Names of the ensemble members to load, or None for all of them
+        expected_schema_hash: Fail unless the bundle was trained on this schema
+        mmap: Memory-map large arrays instead of reading them into memory
+        compiled: Load members as NumPy predictors (tree_compiler.CompiledTrees for
+            trees, numpy_models for the rest) so neither sklearn nor xgboost is
+            imported; the returned 'scaler' is then None
+
+    Returns:
+        Dictionary with models, scaler, feature_names, encoded_feature_names,
+        model_performance, encoder, schema_hash and the bundle's metadata keys
+    """
+    manifest = read_manifest(bundle_dir)
+    if expected_schema_hash is not None and manifest['schema_hash'] != expected_schema_hash:
+        raise BundleSchemaError(
+            f"Bundle schema {manifest['schema_hash']} does not match expected {expected_schema_hash}"
+        )
+
+    n_features = len(manifest['encoded_feature_names'])
+    preprocessing = manifest['preprocessing']
+    mean = _load_array(bundle_dir, preprocessing['mean'], mmap=False)
+    scale = _load_array(bundle_dir, preprocessing['scale'], mmap=False)
+    with_mean = preprocessing.get('with_mean', True)
+    if mean.shape != (n_features,) or scale.shape != (n_features,):
+        raise BundleSchemaError(
+            f"Scaler statistics have shape {mean.shape}, expected ({n_features},)"
+        )
+
+    scaler = None
+    if not compiled:
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler(with_mean=with_mean)
+        scaler.mean_ = mean
+        scaler.scale_ = scale
+        scaler.var_ = _load_array(bundle_dir, preprocessing['var'], mmap=False)
+        scaler.n_samples_seen_ = np.int64(preprocessing['n_samples_seen'])
+        scaler.n_features_in_ = n_features
+
+    selected = list(manifest['members']) if members is None else list(members)
+    models = {}
+    for name in selected:
+        if name not in manifest['members']:
+            raise BundleSchemaError(f"Bundle has no member named {name}")
+        spec = manifest['members'][name]
+        if spec['type'] not in LOADERS:
+            raise BundleSchemaError(f"Unknown member type {spec['type']} for {name}")
+
+        member_dir = os.path.join(bundle_dir, spec['path'])
+        if compiled and 'compiled' in spec:
+            model = load_compiled(spec['compiled'], os.path.join(member_dir, 'compiled'), mmap)
+        elif compiled and spec['type'] in NUMPY_LOADERS:
+            model = NUMPY_LOADERS[spec['type']](spec, member_dir, mmap)
+        else:
+            model = LOADERS[spec['type']](spec, member_dir, mmap)
+        if 'input_transform' in spec:
+            from numpy_models import RescaledInput
+
+            model = RescaledInput(model,
+                                  _load_array(member_dir, spec['input_transform']['scale'], mmap=False),
+                                  _load_array(member_dir, spec['input_transform']['offset'], mmap=False))
+        if getattr(model, 'n_features_in_', n_features) != n_features:
+            raise BundleSchemaError(
+                f"{name} expects {model.n_features_in_} features, bundle schema has {n_features}"
+            )
+        models[name] = model
+
+    model_dict = dict(manifest['metadata'])
+    model_dict.update({
+        'models': models,
+        'scaler': scaler,
+        'feature_names': manifest['feature_names'],
+        'encoded_feature_names': manifest['encoded_feature_names'],
+        'model_performance': manifest['model_performance'],
+        'encoder': {
+            'feature_names': manifest['feature_names'],
+            'encoded_feature_names': manifest['encoded_feature_names'],
+            'mean': mean if with_mean else np.zeros_like(mean),
+            'scale': scale
+        },
+        'schema_hash': manifest['schema_hash'],
+    })
+    return model_dict
+
+
+if __name__ == "__main__":
+    import pickle
+    import sys
+
+    # Convert an existing pickled artifact: python artifact_bundle.py model.pkl bundle_dir
+    if len(sys.argv) != 3:
+        print("Usage: python artifact_bundle.py <model.pkl> <bundle_dir>")
+        sys.exit(1)
+
+    with open(sys.argv[1], 'rb') as f:
+        model_dict = pickle.load(f)
+
+    manifest = save_bundle(model_dict, sys.argv[2])
+    print(f"Wrote bundle {sys.argv[2]} with members: {', '.join(manifest['members'])}")
+    print(f"Schema hash: {manifest['schema_hash']}")
@@ -0,0 +1,271 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_PATH = os.path.join(CURRENT_DIR, "heart.csv")
+TARGET_COLUMN = "HeartDisease"
+
+
+def parse_value(value):
+    """CSV cell to the JSON type the web form would send"""
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            continue
+    return value
+
+
+def load_rows(data_path, limit=None):
+    """Read patient records from a CSV file, without the target column"""
+    with open(data_path, newline='') as f:
+        rows = [
+            {key: parse_value(value) for key, value in row.items() if key != TARGET_COLUMN}
+            for row in csv.DictReader(f)
+        ]
+    return rows[:limit] if limit else rows
+
+
+def summarize(samples, rows_per_sample=1):
+    """Latency percentiles (ms) and throughput for a list of durations in seconds"""
+    import numpy as np
+
+    samples = np.asarray(samples, dtype=np.float64)
+    total = float(samples.sum())
+    return {
+        'count': int(samples.size),
+        'mean_ms': float(samples.mean() * 1000),
+        'p50_ms': float(np.percentile(samples, 50) * 1000),
+        'p95_ms': float(np.percentile(samples, 95) * 1000),
+        'p99_ms': float(np.percentile(samples, 99) * 1000),
+        'rows_per_sec': float(samples.size * rows_per_sample / total) if total > 0 else None
+    }
+
+
+class StageTimer:
+    """Collects duration samples per named stage"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def time(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.add(stage, time.perf_counter() - start)
+        return result
+
+    def summary(self, rows_per_sample=1):
+        return {stage: summarize(samples, rows_per_sample) for stage, samples in self.samples.items()}
+
+
+def time_models(timer, model_dict, input_scaled, prefix='model'):
+    """Time each ensemble member's inference call on a prepared matrix"""
+    from feature_encoder import member_input
+
+    for name, model in model_dict['models'].items():
+        call = model.predict_proba if hasattr(model, 'predict_proba') else model.predict
+        # Densifying sparse rows for dense-only members is part of the call, as in run_member
+        timer.time(f"{prefix}:{name}", lambda X, call=call, model=model: call(member_input(model, X)), input_scaled)
+
+
+def bench_warm(rows, condition_type, repeat):
+    """Single-row predictions against a warm predictor"""
+    from predict import DualConditionPredictor
+
+    predictor = DualConditionPredictor()
+    predictor.predict(dict(rows[0]), condition_type)
+    model_dict = predictor.models[condition_type]
+
+    timer = StageTimer()
+    for _ in range(repeat):
+        for row in rows:
+            timer.time('predict', predictor.predict, dict(row), condition_type)
+
+            validated = timer.time('validate_input', predictor.validate_input, dict(row), condition_type)
+            input_scaled = timer.time('prepare_input', predictor.prepare_input, validated, condition_type)
+            time_models(timer, model_dict, input_scaled)
+            timer.time('score', predictor.score, input_scaled, condition_type)
+
+    return timer.summary()
+
+
+def bench_batch(rows, condition_type, batch_size, repeat):
+    """predict_batch over consecutive fixed-size batches"""
+    from predict import DualConditionPredictor
+
+    predictor = DualConditionPredictor()
+    predictor.predict_batch(rows[:batch_size], condition_type)
+    model_dict = predictor.models[condition_type]
+
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+    # Percentiles are per batch; throughput counts rows
+    batches = [batch for batch in batches if len(batch) == batch_size] or batches[:1]
+
+    timer = StageTimer()
+    for _ in range(repeat):
+        for batch in batches:
+            timer.time('predict_batch', predictor.predict_batch, batch, condition_type)
+
+            validated = timer.time(
+                'validate_input', lambda: [predictor.validate_input(dict(r), condition_type) for r in batch]
+            )
+            input_scaled = timer.time('prepare_input', predictor.prepare_input, validated, condition_type)
+            time_models(timer, model_dict, input_scaled)
+            timer.time('score', predictor.score, input_scaled, condition_type)
+
+    summary = timer.summary(rows_per_sample=len(batches[0]))
+    summary['batch_size'] = len(batches[0])
+    return summary
+
+
+def cold_child(condition_type):
+    """Run inside a fresh interpreter: time each start-up stage of one prediction"""
+    stages = {}
+    start = time.perf_counter()
+
+    import numpy  # noqa: F401
+    stages['import_numpy'] = time.perf_counter() - start
+
+    mark = time.perf_counter()
+    import predict
+    stages['import_predict'] = time.perf_counter() - mark
+
+    row = json.loads(sys.stdin.read())
+    predictor = predict.DualConditionPredictor()
+
+    mark = time.perf_counter()
+    model_dict = predictor.get_model(condition_type)
+    stages['load_artifact'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    validated = predictor.validate_input(row, condition_type)
+    stages['validate_input'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    input_scaled = predictor.prepare_input(validated, condition_type)
+    stages['prepare_input'] = time.perf_counter() - mark
+
+    from feature_encoder import member_input
+
+    for name, model in model_dict['models'].items():
+        call = model.predict_proba if hasattr(model, 'predict_proba') else model.predict
+        mark = time.perf_counter()
+        call(member_input(model, input_scaled))
+        stages[f"model:{name}"] = time.perf_counter() - mark
+
+    stages['total_in_process'] = time.perf_counter() - start
+    print(json.dumps(stages))
+
+
+def bench_cold(rows, condition_type, runs):
+    """One new Python process per prediction, as the spawn-per-request design paid"""
+    timer = StageTimer()
+    env = dict(os.environ, PYTHONWARNINGS='ignore')
+
+    for row in rows[:runs]:
+        payload = json.dumps(dict(row, condition_type=condition_type))
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(CURRENT_DIR, 'predict.py')],
+                       input=payload, capture_output=True, text=True, env=env, check=True)
+        timer.add('process_predict', time.perf_counter() - start)
+
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--cold-child',
+                                '--condition-type', condition_type],
+                               input=json.dumps(row), capture_output=True, text=True,
+                               env=env, cwd=CURRENT_DIR, check=True)
+        for stage, seconds in json.loads(child.stdout).items():
+            timer.add(stage, seconds)
+
+    return timer.summary()
+
+
+def compare(results, baseline):
+    """Print p50 changes against an earlier results file"""
+    print(f"\nComparison with baseline ({baseline.get('meta', {}).get('created', 'unknown')}):")
+    for mode, stages in results['modes'].items():
+        for stage, stats in stages.items():
+            old = baseline.get('modes', {}).get(mode, {}).get(stage)
+            if not isinstance(stats, dict) or not isinstance(old, dict):
+                continue
+            change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0.0
+            print(f"  {mode:<6} {stage:<32} p50 {old['p50_ms']:9.3f} -> {stats['p50_ms']:9.3f} ms ({change:+.1f}%)")
+
+
+def print_summary(results):
+    for mode, stages in results['modes'].items():
+        print(f"\n[{mode}]")
+        for stage, stats in stages.items():
+            if not isinstance(stats, dict):
+                print(f"  {stage}: {stats}")
+                continue
+            print(f"  {stage:<32} p50 {stats['p50_ms']:9.3f}  p95 {stats['p95_ms']:9.3f}  "
+                  f"p99 {stats['p99_ms']:9.3f} ms  {stats['rows_per_sec'] or 0:12.1f} rows/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay heart.csv rows through DualConditionPredictor and report p50/p95/p99 "
+                    "latency and rows/sec per stage and per model. Modes: cold (a fresh predict.py "
+                    "process per prediction), warm (single rows on a loaded predictor), batch "
+                    "(predict_batch over fixed-size batches)."
+    )
+    parser.add_argument('--data', default=DEFAULT_DATA_PATH, help="CSV of patient records to replay")
+    parser.add_argument('--condition-type', default='heart_disease',
+                        choices=['heart_disease', 'gastric_cancer'])
+    parser.add_argument('--modes', nargs='+', default=['cold', 'warm', 'batch'],
+                        choices=['cold', 'warm', 'batch'])
+    parser.add_argument('--rows', type=int, default=None, help="Only replay the first N rows")
+    parser.add_argument('--repeat', type=int, default=1, help="Passes over the rows in warm/batch mode")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--cold-runs', type=int, default=10, help="Processes to start in cold mode")
+    parser.add_argument('--output', default=None, help="Write results as JSON to this file")
+    parser.add_argument('--compare', default=None, help="Earlier results JSON to compare against")
+    parser.add_argument('--cold-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_child:
+        cold_child(args.condition_type)
+        sys.exit(0)
+
+    sys.path.insert(0, CURRENT_DIR)
+    rows = load_rows(args.data, args.rows)
+
+    results = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'data': os.path.basename(args.data),
+            'rows': len(rows),
+            'condition_type': args.condition_type,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count()
+        },
+        'modes': {}
+    }
+
+    if 'cold' in args.modes:
+        results['modes']['cold'] = bench_cold(rows, args.condition_type, args.cold_runs)
+    if 'warm' in args.modes:
+        results['modes']['warm'] = bench_warm(rows, args.condition_type, args.repeat)
+    if 'batch' in args.modes:
+        results['modes']['batch'] = bench_batch(rows, args.condition_type, args.batch_size, args.repeat)
+
+    print_summary(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
@@ -0,0 +1,288 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+class RunningMoments:
+    """Count, mean and sum of squared deviations, merged chunk by chunk (Chan et al.)"""
+
+    def __init__(self, size):
+        self.count = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def merge(self, count, mean, m2):
+        total = self.count + count
+        safe_total = np.where(total > 0, total, 1)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / safe_total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / safe_total
+        self.count = total
+
+    def add(self, values):
+        """Merge a (rows x columns) block that may contain NaN"""
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0).astype(np.float64)
+        safe_count = np.where(count > 0, count, 1)
+        mean = np.where(valid, values, 0.0).sum(axis=0) / safe_count
+        m2 = (np.where(valid, values - mean, 0.0) ** 2).sum(axis=0)
+        self.merge(count, mean, m2)
+
+
+class ChunkedDatasetLoader:
+    """
+    Streams a training CSV into memory-mapped float32 train/test matrices
+
+    Pass 1 reads the CSV in chunks and learns everything the in-memory pipeline
+    derives from the full frame: column kinds, category vocabularies, the
+    mean/mode used to fill missing values and the StandardScaler statistics of
+    the training rows. Pass 2 re-reads the CSV and writes each chunk, imputed,
+    one-hot encoded (drop_first, like pd.get_dummies) and scaled, straight into
+    the memory-mapped matrices. Peak memory is set by the chunk size, not the
+    dataset.
+
+    Rows are assigned to the test split by a seeded random stream as they are
+    read, so the split is known during pass 1. It holds test_size of the rows in
+    expectation but is not the same split as train_test_split.
+    """
+
+    def __init__(self, data_path, target_column, chunksize=50000, work_dir=None,
+                 test_size=0.2, random_state=42):
+        if not os.path.exists(data_path):
+            raise FileNotFoundError(f"Dataset not found at {data_path}")
+        self.data_path = data_path
+        self.target_column = target_column
+        self.chunksize = chunksize
+        # A scratch directory created here is removed again by cleanup()
+        self.owns_work_dir = work_dir is None
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix='ensemble_training_')
+        self.test_size = test_size
+        self.random_state = random_state
+
+        self.feature_names = None
+        self.numeric_columns = None
+        self.categorical_columns = None
+        self.categories = None
+        self.fill_values = None
+        self.encoded_feature_names = None
+        self.mean = None
+        self.var = None
+        self.scale = None
+        self.n_train = 0
+        self.n_test = 0
+
+    def chunks(self):
+        """Read the CSV chunk by chunk, with each row's split assignment"""
+        rng = np.random.RandomState(self.random_state)
+        for chunk in pd.read_csv(self.data_path, chunksize=self.chunksize):
+            if self.target_column not in chunk.columns:
+                raise ValueError(f"Target column '{self.target_column}' not found in dataset")
+            is_test = rng.random_sample(len(chunk)) < self.test_size
+            yield chunk, is_test
+
+    def coerce(self, X):
+        """Give a chunk the column kinds learned from the first chunk"""
+        X = X[self.feature_names].copy()
+        for col in self.numeric_columns:
+            try:
+                X[col] = pd.to_numeric(X[col], errors='raise').astype(np.float64)
+            except (TypeError, ValueError):
+                raise ValueError(f"Column {col} looked numeric in the first chunk but holds non-numeric values")
+        for col in self.categorical_columns:
+            X[col] = X[col].where(X[col].isna(), X[col].astype(str))
+        return X
+
+    def learn(self):
+        """Pass 1: vocabularies, imputation values and training-split scaler statistics"""
+        value_counts = {}
+        train_counts = {}
+        all_numeric = None
+        train_numeric = None
+        train_missing = None
+
+        for chunk, is_test in self.chunks():
+            if self.feature_names is None:
+                X = chunk.drop(self.target_column, axis=1)
+                self.feature_names = X.columns.tolist()
+                # Same split as the in-memory scripts: object columns are one-hot encoded,
+                # numbers and booleans stay single columns
+                self.categorical_columns = X.select_dtypes(include=['object']).columns.tolist()
+                self.numeric_columns = [c for c in self.feature_names if c not in self.categorical_columns]
+                value_counts = {col: {} for col in self.categorical_columns}
+                train_counts = {col: {} for col in self.categorical_columns}
+                all_numeric = RunningMoments(len(self.numeric_columns))
+                train_numeric = RunningMoments(len(self.numeric_columns))
+                train_missing = {col: 0 for col in self.feature_names}
+
+            X = self.coerce(chunk)
+            is_train = ~is_test
+            self.n_train += int(is_train.sum())
+            self.n_test += int(is_test.sum())
+
+            numeric = X[self.numeric_columns].to_numpy(dtype=np.float64)
+            all_numeric.add(numeric)
+            train_numeric.add(numeric[is_train])
+
+            for col in self.feature_names:
+                train_missing[col] += int(X[col][is_train].isna().sum())
+            for col in self.categorical_columns:
+                for value, count in X[col].value_counts().items():
+                    value_counts[col][value] = value_counts[col].get(value, 0) + int(count)
+                for value, count in X[col][is_train].value_counts().items():
+                    train_counts[col][value] = train_counts[col].get(value, 0) + int(count)
+
+        if self.feature_names is None:
+            raise ValueError(f"Dataset {self.data_path} is empty")
+
+        # Missing values: numeric columns get the full-data mean, categorical the most
+        # frequent value (smallest one on ties, like Series.mode()[0])
+        self.fill_values = {col: float(mean) for col, mean in zip(self.numeric_columns, all_numeric.mean)}
+        for col in self.categorical_columns:
+            counts = value_counts[col]
+            self.fill_values[col] = min(counts, key=lambda value: (-counts[value], value)) if counts else 'missing'
+
+        # Imputed training values join the moments as a block at the fill value
+        missing = np.array([train_missing[col] for col in self.numeric_columns], dtype=np.float64)
+        fill = np.array([self.fill_values[col] for col in self.numeric_columns])
+        train_numeric.merge(missing, fill, np.zeros(len(self.numeric_columns)))
+
+        means = list(train_numeric.mean)
+        variances = list(train_numeric.m2 / np.maximum(train_numeric.count, 1))
+        self.encoded_feature_names = list(self.numeric_columns)
+
+        # One-hot columns (first category dropped); their moments follow from the counts
+        self.categories = {}
+        for col in self.categorical_columns:
+            counts = dict(train_counts[col])
+            counts[self.fill_values[col]] = counts.get(self.fill_values[col], 0) + train_missing[col]
+            self.categories[col] = sorted(set(value_counts[col]) | {self.fill_values[col]})
+            for value in self.categories[col][1:]:
+                p = counts.get(value, 0) / max(self.n_train, 1)
+                self.encoded_feature_names.append(f"{col}_{value}")
+                means.append(p)
+                variances.append(p * (1 - p))
+
+        self.mean = np.array(means, dtype=np.float64)
+        self.var = np.array(variances, dtype=np.float64)
+        # Constant columns are left unscaled, as StandardScaler does
+        self.scale = np.where(self.var > 0, np.sqrt(self.var), 1.0)
+
+    def encode_chunk(self, X, scale=True):
+        """Impute, one-hot encode and (unless scale is False) scale one coerced chunk into a float32 block"""
+        block = np.zeros((len(X), len(self.encoded_feature_names)), dtype=np.float64)
+        n_numeric = len(self.numeric_columns)
+        if n_numeric:
+            block[:, :n_numeric] = X[self.numeric_columns].fillna(
+                {col: self.fill_values[col] for col in self.numeric_columns}
+            ).to_numpy(dtype=np.float64)
+
+        offset = n_numeric
+        rows = np.arange(len(X))
+        for col in self.categorical_columns:
+            values = X[col].fillna(self.fill_values[col])
+            codes = pd.Categorical(values, categories=self.categories[col]).codes
+            # Code 0 is the dropped first category; unknown values (-1) stay all zero
+            hot = codes > 0
+            block[rows[hot], offset + codes[hot] - 1] = 1.0
+            offset += len(self.categories[col]) - 1
+
+        if not scale:
+            return block
+        block -= self.mean
+        block /= self.scale
+        return block.astype(np.float32)
+
+    def materialize(self):
+        """
+        Pass 2: write the encoded, scaled splits to memory-mapped files
+
+        Returns:
+            X_train, X_test (read-only np.memmap float32), y_train, y_test (np.ndarray)
+        """
+        if self.encoded_feature_names is None:
+            self.learn()
+
+        n_columns = len(self.encoded_feature_names)
+        train_path = os.path.join(self.work_dir, 'X_train.f32')
+        test_path = os.path.join(self.work_dir, 'X_test.f32')
+        X_train = np.memmap(train_path, dtype=np.float32, mode='w+', shape=(max(self.n_train, 1), n_columns))
+        X_test = np.memmap(test_path, dtype=np.float32, mode='w+', shape=(max(self.n_test, 1), n_columns))
+        y_train = []
+        y_test = []
+
+        train_row = 0
+        test_row = 0
+        for chunk, is_test in self.chunks():
+            block = self.encode_chunk(self.coerce(chunk))
+            y = chunk[self.target_column].to_numpy()
+            is_train = ~is_test
+
+            n = int(is_train.sum())
+            X_train[train_row:train_row + n] = block[is_train]
+            train_row += n
+            y_train.append(y[is_train])
+
+            n = int(is_test.sum())
+            X_test[test_row:test_row + n] = block[is_test]
+            test_row += n
+            y_test.append(y[is_test])
+
+        X_train.flush()
+        X_test.flush()
+        del X_train, X_test
+
+        X_train = np.memmap(train_path, dtype=np.float32, mode='r', shape=(self.n_train, n_columns))
+        X_test = np.memmap(test_path, dtype=np.float32, mode='r', shape=(self.n_test, n_columns))
+        return X_train, X_test, np.concatenate(y_train), np.concatenate(y_test)
+
+    def materialize_unscaled_train(self):
+        """
+        Write the encoded training split without scaling to a memory-mapped file
+
+        Cross-validation scales each fold on its own training rows, as it does
+        for the in-memory pipeline's raw get_dummies matrix; feeding it the
+        scaled matrix would scale twice with statistics the validation folds
+        helped compute.
+
+        Returns:
+            X_train (read-only np.memmap float64), in the same row order as materialize()
+        """
+        if self.encoded_feature_names is None:
+            self.learn()
+
+        n_columns = len(self.encoded_feature_names)
+        path = os.path.join(self.work_dir, 'X_train_unscaled.f64')
+        X_train = np.memmap(path, dtype=np.float64, mode='w+', shape=(max(self.n_train, 1), n_columns))
+        train_row = 0
+        for chunk, is_test in self.chunks():
+            block = self.encode_chunk(self.coerce(chunk), scale=False)[~is_test]
+            X_train[train_row:train_row + len(block)] = block
+            train_row += len(block)
+        X_train.flush()
+        del X_train
+        return np.memmap(path, dtype=np.float64, mode='r', shape=(self.n_train, n_columns))
+
+    def cleanup(self):
+        """
+        Delete the memory-mapped matrices if the loader created their directory
+
+        Models fitted on them keep working: the mappings they hold stay valid
+        after the files are unlinked.
+        """
+        if self.owns_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def fitted_scaler(self):
+        """A StandardScaler carrying the streamed statistics, for the saved artifact"""
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+        scaler.mean_ = self.mean
+        scaler.var_ = self.var
+        scaler.scale_ = self.scale
+        scaler.n_samples_seen_ = self.n_train
+        scaler.n_features_in_ = len(self.encoded_feature_names)
+        return scaler
@@ -0,0 +1,137 @@
+import numpy as np
+
+COMBINERS = ('mean', 'weighted', 'stacking')
+
+
+def member_accuracy(performance):
+    """A member's accuracy from its saved performance, cross-validated when available"""
+    return float(performance.get('cv_mean', performance['test_score']))
+
+
+class LinearCombiner:
+    """
+    Weighted mean of member probabilities and votes
+
+    probabilities and labels are (rows x members) matrices in the order of
+    members; members that produced no output are masked out and the remaining
+    weights renormalised, so both outputs are one matrix-vector product.
+    """
+
+    def __init__(self, name, members, weights, accuracies):
+        self.name = name
+        self.members = list(members)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.accuracies = np.asarray(accuracies, dtype=np.float64)
+
+    def combine(self, probabilities, labels, available):
+        """
+        Returns:
+            (labels, probabilities, ensemble accuracy, combiner name)
+        """
+        weights = np.where(available, self.weights, 0.0)
+        total = weights.sum()
+        probability = probabilities @ weights / total
+        prediction = np.round(labels @ weights / total).astype(int)
+        accuracy = float(self.accuracies[available] @ weights[available] / total)
+        return prediction, probability, accuracy, self.name
+
+
+class StackingCombiner:
+    """
+    Logistic regression over member probabilities, fitted on out-of-fold predictions
+
+    Needs every member it was fitted on; when some are missing (skipped or
+    failed) the fallback combiner is used instead.
+    """
+
+    name = 'stacking'
+
+    def __init__(self, members, coef, intercept, accuracy, fallback):
+        self.members = list(members)
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.accuracy = float(accuracy)
+        self.fallback = fallback
+
+    def combine(self, probabilities, labels, available):
+        if not np.all(available):
+            return self.fallback.combine(probabilities, labels, available)
+        probability = 1.0 / (1.0 + np.exp(-(probabilities @ self.coef + self.intercept)))
+        return (probability >= 0.5).astype(int), probability, self.accuracy, self.name
+
+
+def accuracy_weights(accuracies):
+    """Log-odds of each member's accuracy: the optimal vote weights for independent members"""
+    accuracies = np.clip(np.asarray(accuracies, dtype=np.float64), 0.5 + 1e-3, 1 - 1e-3)
+    return np.log(accuracies / (1 - accuracies))
+
+
+def build_combiner(model_dict, name=None):
+    """
+    Combiner for a loaded artifact
+
+    Args:
+        model_dict: Artifact dictionary; its 'combiner' metadata holds the default
+            method and the fitted stacker, if training produced one
+        name: 'mean', 'weighted' or 'stacking'; None uses the artifact's default
+    """
+    members = list(model_dict['models'])
+    settings = model_dict.get('combiner') or {}
+    name = name or settings.get('default', 'mean')
+    if name not in COMBINERS:
+        raise ValueError(f"Unknown ensemble combiner: {name}")
+
+    accuracies = [member_accuracy(model_dict['model_performance'][member]) for member in members]
+    if name == 'mean':
+        return LinearCombiner('mean', members, np.ones(len(members)), accuracies)
+
+    weighted = LinearCombiner('weighted', members, accuracy_weights(accuracies), accuracies)
+    if name == 'weighted':
+        return weighted
+
+    stacker = settings.get('stacking')
+    if stacker is None:
+        raise ValueError("The artifact has no fitted stacking combiner; train it with --combiner stacking")
+    if stacker['members'] != members:
+        raise ValueError(f"The stacking combiner was fitted on members {stacker['members']}, "
+                         f"the artifact has {members}")
+    return StackingCombiner(members, stacker['coef'], stacker['intercept'], stacker['test_score'], weighted)
+
+
+def fit_stacker(models, X_train, y_train, X_test, y_test, cv=5, random_state=42, templates=None):
+    """
+    Fit the stacking combiner on out-of-fold member probabilities
+
+    Args:
+        models: Fitted members (clones of them are refit per fold)
+        templates: name -> sklearn estimator cloned per fold instead of the member,
+            for members that cannot be cloned themselves
+
+    Returns:
+        JSON-serialisable stacker stored under the artifact's 'combiner' metadata
+    """
+    from sklearn.base import clone
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import StratifiedKFold, cross_val_predict
+
+    from feature_encoder import member_input
+
+    members = list(models)
+    templates = templates or {}
+    folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
+    out_of_fold = np.column_stack([
+        cross_val_predict(clone(templates.get(name, models[name])), member_input(models[name], X_train), y_train, cv=folds,
+                          method='predict_proba')[:, 1]
+        for name in members
+    ])
+    test = np.column_stack([models[name].predict_proba(member_input(models[name], X_test))[:, 1]
+                            for name in members])
+
+    stacker = LogisticRegression().fit(out_of_fold, y_train)
+    return {
+        'members': members,
+        'coef': stacker.coef_[0].tolist(),
+        'intercept': float(stacker.intercept_[0]),
+        'train_score': float(stacker.score(out_of_fold, y_train)),
+        'test_score': float(stacker.score(test, y_test)),
+    }
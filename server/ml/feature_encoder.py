@@ -0,0 +1,262 @@
+import numpy as np
+
+# Estimators that need dense input; others take CSR rows as they are. Serving-side
+# predictors say so with an accepts_sparse attribute instead
+DENSE_ONLY = ('GaussianNB', 'KNeighborsClassifier')
+
+
+def member_input(model, X):
+    """X as a member needs it: sparse rows are densified only for members that cannot take them"""
+    if not hasattr(X, 'toarray'):
+        return X
+    if getattr(model, 'accepts_sparse', type(model).__name__ not in DENSE_ONLY):
+        return X
+    return X.toarray()
+
+
+def sparse_design_matrix(frame, categorical_columns):
+    """
+    One-hot encode a training frame straight into a CSR matrix
+
+    The columns are those pd.get_dummies(frame, columns=categorical_columns,
+    drop_first=True) produces, in the same order and with the same names, but
+    the dense frame is never built: each categorical column becomes one
+    non-zero per row.
+
+    Returns:
+        (matrix, encoded_feature_names)
+    """
+    import pandas as pd
+    from scipy import sparse
+
+    categorical = set(categorical_columns)
+    numeric = [column for column in frame.columns if column not in categorical]
+    blocks = []
+    names = list(numeric)
+    if numeric:
+        blocks.append(sparse.csr_matrix(frame[numeric].to_numpy(dtype=np.float64)))
+
+    n_rows = len(frame)
+    for column in categorical_columns:
+        values = pd.Categorical(frame[column])
+        # The first category is dropped, as drop_first does; missing values (code -1) too
+        rows = np.flatnonzero(values.codes >= 1)
+        blocks.append(sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, values.codes[rows] - 1)),
+            shape=(n_rows, max(len(values.categories) - 1, 0))
+        ))
+        names.extend(f"{column}_{category}" for category in values.categories[1:])
+
+    return sparse.hstack(blocks, format='csr', dtype=np.float64), names
+
+
+class FeatureEncoder:
+    """
+    Compiled replacement for pd.get_dummies + column reindexing + StandardScaler
+
+    The one-hot layout is resolved once from the artifact's encoded_feature_names:
+    numeric features map to a single column and each (feature, category) pair maps
+    to its dummy column. Records are written straight into a preallocated float64
+    matrix which is then centred and scaled in place, the same operations
+    StandardScaler.transform performs.
+    """
+
+    def __init__(self, feature_names, encoded_feature_names, mean, scale):
+        self.feature_names = list(feature_names)
+        self.encoded_feature_names = list(encoded_feature_names)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+        n_columns = len(self.encoded_feature_names)
+        if self.mean.shape != (n_columns,) or self.scale.shape != (n_columns,):
+            raise ValueError(
+                f"Scaler statistics have shape {self.mean.shape}/{self.scale.shape}, "
+                f"expected ({n_columns},)"
+            )
+
+        column_index = {name: i for i, name in enumerate(self.encoded_feature_names)}
+
+        # Features kept as a single numeric column
+        self.numeric_columns = [
+            (field, column_index[field]) for field in self.feature_names if field in column_index
+        ]
+
+        # Dummy columns: match each encoded name to the longest feature prefix
+        self.category_index = {}
+        by_length = sorted(self.feature_names, key=len, reverse=True)
+        for name, i in column_index.items():
+            if name in self.feature_names:
+                continue
+            for field in by_length:
+                if name.startswith(field + '_'):
+                    self.category_index.setdefault(field, {})[name[len(field) + 1:]] = i
+                    break
+            else:
+                raise ValueError(f"Encoded column {name} does not belong to any feature")
+
+        self.categorical_columns = list(self.category_index.items())
+
+        # Features trained without centring (StandardScaler(with_mean=False)) can be
+        # encoded as CSR rows; centring would make every column non-zero
+        self.sparse = not self.mean.any()
+        self.inverse_scale = 1.0 / self.scale
+        self.numeric_index = dict(self.numeric_columns)
+        self.defaults = {}
+
+    @classmethod
+    def from_model_dict(cls, model_dict):
+        """Compile an encoder from a trained model dictionary"""
+        if model_dict.get('encoder'):
+            return cls.from_dict(model_dict['encoder'])
+
+        scaler = model_dict['scaler']
+        n_columns = len(model_dict['encoded_feature_names'])
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(n_columns)
+        scale = scaler.scale_ if scaler.with_std else np.ones(n_columns)
+        return cls(model_dict['feature_names'], model_dict['encoded_feature_names'], mean, scale)
+
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuild an encoder saved with to_dict"""
+        return cls(state['feature_names'], state['encoded_feature_names'], state['mean'], state['scale'])
+
+    def to_dict(self):
+        """Plain representation stored in the model artifact"""
+        return {
+            'feature_names': self.feature_names,
+            'encoded_feature_names': self.encoded_feature_names,
+            'mean': self.mean,
+            'scale': self.scale
+        }
+
+    def encode(self, records, out=None):
+        """Write the unscaled one-hot/numeric values for records into a float64 matrix"""
+        n_columns = len(self.encoded_feature_names)
+        if out is None:
+            out = np.zeros((len(records), n_columns), dtype=np.float64)
+        else:
+            out[...] = 0.0
+
+        for row, record in enumerate(records):
+            values = out[row]
+            for field, column in self.numeric_columns:
+                value = record.get(field, 0)
+                try:
+                    values[column] = float(value)
+                except (TypeError, ValueError):
+                    # get_dummies would have turned a non-numeric value into an unknown dummy
+                    values[column] = 0.0
+            for field, categories in self.categorical_columns:
+                column = categories.get(str(record.get(field)))
+                if column is not None:
+                    values[column] = 1.0
+
+        return out
+
+    def transform(self, records, out=None):
+        """Encode and scale records into a float64 matrix"""
+        out = self.encode(records, out)
+        out -= self.mean
+        out /= self.scale
+        return out
+
+    def field_entries(self, field, value):
+        """(columns, values) one field's value writes into a row"""
+        column = self.numeric_index.get(field)
+        if column is not None:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                number = 0.0
+            return ([column], [number]) if number != 0.0 else ((), ())
+        column = self.category_index.get(field, {}).get(str(value))
+        return ([column], [1.0]) if column is not None else ((), ())
+
+    def set_defaults(self, default_row):
+        """
+        Pre-encode the value each field takes when a record leaves it out
+
+        encode_sparse then copies these entries for missing fields, and for
+        fields holding the default object itself (as DefaultFillSchema rows do),
+        so only the fields a caller supplied are encoded per request.
+        """
+        self.defaults = {
+            field: (value, self.field_entries(field, value))
+            for field, value in default_row.items() if field in self.feature_names
+        }
+
+    def encode_sparse(self, records):
+        """Unscaled rows as a CSR matrix, with work and memory proportional to the non-zeros"""
+        from scipy import sparse
+
+        indptr = [0]
+        indices = []
+        data = []
+        missing = (None, ((), ()))
+        for record in records:
+            for field in self.feature_names:
+                default, default_entries = self.defaults.get(field, missing)
+                value = record.get(field, default)
+                columns, values = (default_entries if value is default
+                                   else self.field_entries(field, value))
+                indices.extend(columns)
+                data.extend(values)
+            indptr.append(len(indices))
+
+        matrix = sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int32), np.asarray(indptr)),
+            shape=(len(records), len(self.encoded_feature_names))
+        )
+        matrix.sort_indices()
+        return matrix
+
+    def transform_sparse(self, records):
+        """Encode and scale records into a CSR matrix (features must not be centred)"""
+        if not self.sparse:
+            raise ValueError("Centred features cannot be encoded sparsely; train with a sparse scaler")
+        matrix = self.encode_sparse(records)
+        # StandardScaler scales sparse input by multiplying with the inverse scale
+        matrix.data *= self.inverse_scale[matrix.indices]
+        return matrix
+
+
+def pandas_reference(records, model_dict):
+    """The pandas get_dummies/reindex/scaler path the encoder replaces"""
+    import pandas as pd
+
+    input_encoded = pd.get_dummies(pd.DataFrame(records))
+    input_encoded = input_encoded.reindex(columns=model_dict['encoded_feature_names'], fill_value=0)
+    return model_dict['scaler'].transform(input_encoded)
+
+
+if __name__ == "__main__":
+    import os
+    import pickle
+    import sys
+
+    import pandas as pd
+
+    # Parity check: the compiled encoder must match the pandas path bit for bit
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    data_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(current_dir, "heart.csv")
+    model_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(current_dir, "heart_disease_ensemble.pkl")
+
+    with open(model_path, 'rb') as f:
+        model_dict = pickle.load(f)
+
+    data = pd.read_csv(data_path)
+    records = data[model_dict['feature_names']].to_dict('records')
+    encoder = FeatureEncoder.from_model_dict(model_dict)
+
+    # Whole file at once, and row by row as predict() sees it
+    compiled = encoder.transform(records)
+    mismatched = [
+        i for i, record in enumerate(records)
+        if not np.array_equal(encoder.transform([record]), pandas_reference([record], model_dict))
+    ]
+
+    if not np.array_equal(compiled, pandas_reference(records, model_dict)) or mismatched:
+        print(f"Encoder output differs from pandas on {len(mismatched)} of {len(records)} rows")
+        sys.exit(1)
+
+    print(f"Encoder output is bit-identical to pandas on all {len(records)} rows")
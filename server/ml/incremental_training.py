@@ -0,0 +1,338 @@
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
+
+from artifact_bundle import load_bundle, read_manifest
+from ensemble_combiner import fit_stacker
+from feature_encoder import FeatureEncoder
+from neighbor_index import IndexedKNeighbors, NeighborIndex, load_index
+from numpy_models import RescaledInput
+
+
+def load_rows(data_path, feature_names, target_column, encoder, since_row):
+    """
+    Encode a labelled CSV with the artifact's one-hot layout
+
+    Returns:
+        (X_old, y_old, X_new, y_new): unscaled rows before and from since_row
+    """
+    data = pd.read_csv(data_path)
+    if target_column not in data.columns:
+        raise ValueError(f"Target column {target_column} not found in {data_path}")
+    if since_row > len(data):
+        raise ValueError(f"{data_path} has {len(data)} rows, the artifact was trained on {since_row}")
+
+    missing = set(feature_names) - set(data.columns)
+    if missing:
+        raise ValueError(f"Missing columns in {data_path}: {sorted(missing)}")
+
+    X = encoder.encode(data[feature_names].to_dict('records'))
+    # Missing numbers take the training mean, which the scaler maps to zero
+    X = np.where(np.isnan(X), encoder.mean, X)
+    y = data[target_column].to_numpy()
+    return X[:since_row], y[:since_row], X[since_row:], y[since_row:]
+
+
+def centre(scaler):
+    """What the scaler subtracts: its mean, or zeros for one fitted with_mean=False"""
+    return scaler.mean_ if scaler.with_mean else np.zeros_like(scaler.scale_)
+
+
+def split_rows(X, y, test_size=0.2, random_state=42):
+    """The training scripts' split; too few rows to split all go to training"""
+    if len(X) * test_size < 1:
+        return X, X[:0], y, y[:0]
+    return train_test_split(X, y, test_size=test_size, random_state=random_state)
+
+
+def rescale_logistic_regression(model, scale, offset):
+    """
+    Rewrite coef_/intercept_ so the decision function is unchanged on rows scaled
+    with the new scaler (x_old = x_new * scale + offset)
+    """
+    model.intercept_ = model.intercept_ + model.coef_ @ offset
+    model.coef_ = model.coef_ * scale
+
+
+def rescale_gaussian_nb(model, scale, offset, epsilon=None):
+    """
+    Move the per-class means and variances into the new scaling, exactly
+
+    epsilon replaces the variance smoothing term: partial_fit recomputes
+    epsilon_ from the batch it is given before taking it back off var_.
+    """
+    epsilon = model.epsilon_ if epsilon is None else epsilon
+    model.theta_ = (model.theta_ - offset) / scale
+    model.var_ = (model.var_ - model.epsilon_) / scale ** 2 + epsilon
+    model.epsilon_ = epsilon
+
+
+def update_members(models, old_scaler, new_scaler, X_train_old, y_train_old, X_train_new, y_train_new,
+                   boost_rounds=10, index_specs=None):
+    """
+    Bring every member up to date with new training rows
+
+    Naive Bayes (partial_fit), XGBoost (continued boosting) and KNN (rows
+    appended to its index) only see the new rows; logistic regression is warm
+    started from its old coefficients; the sklearn trees are refit.
+
+    Args:
+        models: Members as loaded with load_bundle(compiled=False)
+        old_scaler, new_scaler: (mean, scale) before and after the scaler's partial fit
+        X_train_old, y_train_old: Old training rows, unscaled; used by the warm start and refits
+        X_train_new, y_train_new: New training rows, unscaled
+        boost_rounds: Trees added to XGBoost members by continued boosting
+        index_specs: name -> (spec, directory) of stored KNN indexes
+
+    Returns:
+        (models, updated, rebuilt): the new members and which names went which way
+    """
+    old_mean, old_scale = old_scaler
+    new_mean, new_scale = new_scaler
+    # x_old = x_new * scale + offset maps rows scaled the new way onto the old scaling
+    scale = new_scale / old_scale
+    offset = (new_mean - old_mean) / old_scale
+
+    Xs_new = (X_train_new - new_mean) / new_scale
+    Xs_all = (np.concatenate([X_train_old, X_train_new]) - new_mean) / new_scale
+    y_all = np.concatenate([y_train_old, y_train_new])
+
+    updated_models = {}
+    updated, rebuilt = [], []
+    for name, model in models.items():
+        wrapped = model if isinstance(model, RescaledInput) else None
+        class_name = type(wrapped.model if wrapped else model).__name__
+        start = time.perf_counter()
+
+        if class_name == 'LogisticRegression':
+            # Warm start from the old optimum in the new scaling; lbfgs then only
+            # has to move as far as the new rows pull it
+            rescale_logistic_regression(model, scale, offset)
+            warm_start = model.warm_start
+            model.set_params(warm_start=True)
+            model.fit(Xs_all, y_all)
+            model.set_params(warm_start=warm_start)
+        elif class_name == 'GaussianNB':
+            if len(Xs_new):
+                rescale_gaussian_nb(model, scale, offset, model.var_smoothing * np.var(Xs_new, axis=0).max())
+                model.partial_fit(Xs_new, y_train_new)
+            else:
+                rescale_gaussian_nb(model, scale, offset)
+        elif class_name == 'XGBClassifier':
+            # Trees stay in the scaling they were grown in; new rounds are boosted on
+            # the new rows mapped into it, starting from the existing margin
+            if wrapped is None:
+                wrapped = RescaledInput(model, np.ones_like(scale), np.zeros_like(offset))
+            booster = wrapped.model
+            model = RescaledInput(booster, wrapped.scale * scale, wrapped.scale * offset + wrapped.offset)
+            if len(Xs_new) and boost_rounds > 0:
+                booster.set_params(n_estimators=boost_rounds)
+                booster.fit(model.native_input(Xs_new), y_train_new, xgb_model=booster.get_booster())
+        elif class_name in ('KNeighborsClassifier', 'IndexedKNeighbors'):
+            if index_specs and name in index_specs:
+                index = load_index(*index_specs[name], mmap=False)
+            else:
+                index = NeighborIndex.build(model._fit_X, model.classes_[model._y], model.n_neighbors)
+            index = index.rescaled(1 / scale, -offset / scale)
+            if len(Xs_new):
+                index = index.append(Xs_new, y_train_new)
+            model = IndexedKNeighbors(index)
+        else:
+            model = clone(model)
+            model.fit(Xs_all, y_all)
+            rebuilt.append(name)
+            updated_models[name] = model
+            print(f"Refit {name} on {len(Xs_all)} rows in {time.perf_counter() - start:.2f}s")
+            continue
+
+        updated.append(name)
+        updated_models[name] = model
+        print(f"Updated {name} with {len(Xs_new)} new rows in {time.perf_counter() - start:.2f}s")
+
+    return updated_models, updated, rebuilt
+
+
+def stacker_template(model):
+    """A cloneable sklearn estimator refit per fold in place of an updated member"""
+    if isinstance(model, RescaledInput):
+        model = model.model
+    if isinstance(model, IndexedKNeighbors):
+        from sklearn.neighbors import KNeighborsClassifier
+
+        return KNeighborsClassifier(n_neighbors=model.n_neighbors)
+    if type(model).__name__ == 'XGBClassifier':
+        # Continued boosting left n_estimators at the rounds added last
+        return clone(model).set_params(n_estimators=model.get_booster().num_boosted_rounds())
+    return model
+
+
+def refit_combiner(combiner, models, X_train, y_train, X_test, y_test):
+    """
+    Refit a stored stacker on the updated members, or drop it if that fails
+
+    The stacker's weights were fitted on the old members' out-of-fold
+    probabilities and do not carry over to new ones.
+
+    Returns:
+        (combiner settings to save, what was done for update_history or None)
+    """
+    combiner = dict(combiner or {})
+    if 'stacking' not in combiner:
+        return combiner, None
+    templates = {name: stacker_template(model) for name, model in models.items()}
+    try:
+        combiner['stacking'] = fit_stacker(models, X_train, y_train, X_test, y_test, templates=templates)
+    except Exception as e:
+        del combiner['stacking']
+        if combiner.get('default') == 'stacking':
+            combiner['default'] = 'weighted'
+        print(f"Could not refit the stacking combiner ({e}); it is dropped, default: "
+              f"{combiner.get('default', 'mean')}")
+        return combiner, f"stacking dropped: {e}"
+    print(f"Stacking combiner - Train Score: {combiner['stacking']['train_score']:.4f}, "
+          f"Test Score: {combiner['stacking']['test_score']:.4f}")
+    return combiner, 'stacking refit'
+
+
+def incremental_update(bundle_dir, data_path, since_row=None, target_column=None, boost_rounds=10,
+                       output_dir=None, keep_previous=True):
+    """
+    Update a trained bundle with labelled rows appended to its training CSV
+
+    Rows from since_row on (default: the training_rows recorded in the bundle)
+    are new. They are split like the original data; the scaler statistics are
+    updated with a partial fit, the members are updated as update_members
+    describes, and every member is scored on the old and new test rows together.
+
+    Args:
+        bundle_dir: Bundle written by the training scripts
+        data_path: Training CSV with the new rows appended
+        since_row: First new row, when the bundle does not record training_rows
+        target_column: Label column (default: the bundle's, or HeartDisease)
+        boost_rounds: Trees added to XGBoost members
+        output_dir: Where to write the new version (default: replace bundle_dir)
+        keep_previous: When replacing, keep the old bundle as <bundle_dir>.v<version>
+
+    Returns:
+        The new model dictionary, as saved
+    """
+    from artifact_bundle import save_bundle
+
+    manifest = read_manifest(bundle_dir)
+    model_dict = load_bundle(bundle_dir, mmap=False)
+    since_row = since_row if since_row is not None else model_dict.get('training_rows')
+    if since_row is None:
+        raise ValueError("The bundle does not record how many rows it was trained on; pass since_row")
+    target_column = target_column or model_dict.get('target_column', 'HeartDisease')
+
+    encoder = FeatureEncoder.from_model_dict(model_dict)
+    X_old, y_old, X_new, y_new = load_rows(data_path, model_dict['feature_names'], target_column,
+                                           encoder, since_row)
+    if not len(X_new):
+        raise ValueError(f"No new rows in {data_path} after row {since_row}")
+    print(f"{len(X_new)} new rows after the {since_row} the bundle was trained on")
+
+    X_train_old, X_test_old, y_train_old, y_test_old = split_rows(X_old, y_old)
+    X_train_new, X_test_new, y_train_new, y_test_new = split_rows(X_new, y_new)
+
+    scaler = model_dict['scaler']
+    old_scaler = (centre(scaler).copy(), scaler.scale_.copy())
+    scaler.partial_fit(X_train_new)
+    new_scaler = (centre(scaler), scaler.scale_)
+
+    index_specs = {
+        name: (spec['index'], os.path.join(bundle_dir, spec['path'], 'index'))
+        for name, spec in manifest['members'].items() if 'index' in spec
+    }
+    models, updated, rebuilt = update_members(model_dict['models'], old_scaler, new_scaler,
+                                              X_train_old, y_train_old, X_train_new, y_train_new,
+                                              boost_rounds, index_specs)
+
+    X_train = scaler.transform(np.concatenate([X_train_old, X_train_new]))
+    y_train = np.concatenate([y_train_old, y_train_new])
+    X_test = scaler.transform(np.concatenate([X_test_old, X_test_new]))
+    y_test = np.concatenate([y_test_old, y_test_new])
+    model_performance = {}
+    for name, model in models.items():
+        model_performance[name] = {
+            'train_score': float(np.mean(model.predict(X_train) == y_train)),
+            'test_score': float(np.mean(model.predict(X_test) == y_test)),
+            'update': 'incremental' if name in updated else 'refit'
+        }
+        print(f"{name} - Train Score: {model_performance[name]['train_score']:.4f}, "
+              f"Test Score: {model_performance[name]['test_score']:.4f}")
+    combiner, combiner_update = refit_combiner(model_dict.get('combiner'), models, X_train, y_train,
+                                               X_test, y_test)
+
+    version = model_dict.get('model_version', 1)
+    history = list(model_dict.get('update_history', []))
+    history.append({
+        'version': version + 1,
+        'updated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'data_path': os.path.basename(data_path),
+        'new_rows': int(len(X_new)),
+        'updated_members': updated,
+        'rebuilt_members': rebuilt,
+    })
+    if combiner_update is not None:
+        history[-1]['combiner'] = combiner_update
+
+    reserved = {'models', 'scaler', 'model_performance', 'encoder', 'schema_hash'}
+    save_dict = {key: value for key, value in model_dict.items() if key not in reserved}
+    save_dict.update({
+        'models': models,
+        'scaler': scaler,
+        'model_performance': model_performance,
+        'encoder': FeatureEncoder(model_dict['feature_names'], model_dict['encoded_feature_names'],
+                                  centre(scaler), scaler.scale_).to_dict(),
+        'target_column': target_column,
+        'training_rows': since_row + len(X_new),
+        'model_version': version + 1,
+        'update_history': history,
+    })
+    if combiner:
+        save_dict['combiner'] = combiner
+
+    if output_dir is None:
+        output_dir = bundle_dir
+        if keep_previous:
+            previous_dir = f"{bundle_dir.rstrip(os.sep)}.v{version}"
+            if os.path.exists(previous_dir):
+                shutil.rmtree(previous_dir)
+            shutil.copytree(bundle_dir, previous_dir)
+            print(f"Previous version kept in {previous_dir}")
+    save_bundle(save_dict, output_dir)
+    print(f"Wrote version {version + 1} to {output_dir} "
+          f"(updated: {', '.join(updated) or 'none'}; refit: {', '.join(rebuilt) or 'none'})")
+    return save_dict
+
+
+if __name__ == "__main__":
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(
+        description="Update a trained ensemble bundle with labelled rows appended to its training CSV, "
+                    "without refitting the members that can be updated incrementally."
+    )
+    parser.add_argument('--bundle', default=os.path.join(current_dir, 'heart_disease_ensemble'),
+                        help="Bundle directory to update")
+    parser.add_argument('--data', default=os.path.join(current_dir, 'heart.csv'),
+                        help="Training CSV with the new rows appended")
+    parser.add_argument('--since-row', type=int, default=None,
+                        help="First new row (default: training_rows recorded in the bundle)")
+    parser.add_argument('--target', default=None, help="Label column (default: the bundle's)")
+    parser.add_argument('--boost-rounds', type=int, default=10,
+                        help="Trees added to XGBoost members by continued boosting")
+    parser.add_argument('--output', default=None, help="Write the new version here instead of replacing the bundle")
+    parser.add_argument('--no-keep-previous', action='store_true',
+                        help="Do not keep the replaced bundle as <bundle>.v<version>")
+    args = parser.parse_args()
+
+    incremental_update(args.bundle, args.data, args.since_row, args.target, args.boost_rounds,
+                       args.output, not args.no_keep_previous)
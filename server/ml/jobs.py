@@ -0,0 +1,405 @@
+import csv
+import fcntl
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_JOBS_DIR = os.environ.get('PREDICTION_JOBS_DIR', os.path.join(CURRENT_DIR, 'jobs'))
+STATE_FILE = 'state.json'
+CANCEL_FILE = 'cancel'
+RESULTS_FILE = 'results.jsonl'
+# Held (flock) by the process running a job for as long as it runs
+RUNNER_LOCK_FILE = 'runner.lock'
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Warm predictor held by each pool process
+_worker_predictor = None
+
+
+def _init_worker():
+    global _worker_predictor
+    from predict import DualConditionPredictor, warm_up
+
+    warm_up()
+    _worker_predictor = DualConditionPredictor()
+
+
+def _score_chunk(records, condition_type):
+    return _worker_predictor.predict_batch(records, condition_type)
+
+
+def _parse_cell(value):
+    """CSV cell to the JSON type the web form would send"""
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            continue
+    return value
+
+
+def read_chunks(input_path, input_format, chunk_size, skip_chunks=0):
+    """
+    Yield (chunk_index, records) from a CSV or JSON lines file
+
+    Chunks before skip_chunks are read past without parsing their records.
+    """
+    with open(input_path, newline='') as f:
+        if input_format == 'csv':
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            lines = iter(reader)
+        else:
+            lines = (line for line in f if line.strip())
+
+        chunk_index = 0
+        while True:
+            raw = []
+            for line in lines:
+                raw.append(line)
+                if len(raw) == chunk_size:
+                    break
+            if not raw:
+                return
+            if chunk_index >= skip_chunks:
+                if input_format == 'csv':
+                    records = [{key: _parse_cell(value) for key, value in zip(header, row)} for row in raw]
+                else:
+                    records = []
+                    for line in raw:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError as e:
+                            # predict_batch reports non-object records per row
+                            records.append(f"Invalid JSON record: {str(e)}")
+                yield chunk_index, records
+            chunk_index += 1
+
+
+def count_records(input_path, input_format):
+    """Number of records in an input file, for progress reporting"""
+    with open(input_path, newline='') as f:
+        if input_format == 'csv':
+            return max(sum(1 for _ in csv.reader(f)) - 1, 0)
+        return sum(1 for line in f if line.strip())
+
+
+class JobQueue:
+    """
+    File-backed bulk scoring jobs
+
+    Each job lives in its own directory with a state.json (status, progress,
+    throughput) and a results.jsonl written one chunk at a time. The state is
+    saved after every chunk together with the output size at that point, so a
+    cancelled or crashed job resumes from its last completed chunk. The runner
+    holds an exclusive lock on the job for the whole run, so a job is never
+    scored by two processes at once and a runner that died is detectable.
+    """
+
+    def __init__(self, jobs_dir=DEFAULT_JOBS_DIR):
+        self.jobs_dir = jobs_dir
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def job_dir(self, job_id):
+        path = os.path.join(self.jobs_dir, job_id)
+        if os.path.basename(path) != job_id or not os.path.isdir(path):
+            raise ValueError(f"Unknown job: {job_id}")
+        return path
+
+    def submit(self, input_path, condition_type='heart_disease', chunk_size=1000, input_format=None):
+        """
+        Register a job for a CSV or JSON lines file of patient records
+
+        Returns:
+            The new job's id; call run() (or start()) to score it
+        """
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"Input file not found at {input_path}")
+        if condition_type not in ('heart_disease', 'gastric_cancer'):
+            raise ValueError(f"Invalid condition type: {condition_type}. Must be 'heart_disease' or 'gastric_cancer'")
+        if input_format is None:
+            input_format = 'csv' if input_path.lower().endswith('.csv') else 'jsonl'
+        if input_format not in ('csv', 'jsonl'):
+            raise ValueError(f"Unsupported input format: {input_format}")
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.jobs_dir, job_id))
+        self.save_state(job_id, {
+            'id': job_id,
+            'status': QUEUED,
+            'input_path': os.path.abspath(input_path),
+            'input_format': input_format,
+            'total_rows': count_records(input_path, input_format),
+            'condition_type': condition_type,
+            'chunk_size': chunk_size,
+            'output_path': os.path.join(self.jobs_dir, job_id, RESULTS_FILE),
+            'completed_chunks': 0,
+            'output_bytes': 0,
+            'rows_done': 0,
+            'rows_failed': 0,
+            'progress': 0.0,
+            'running_seconds': 0.0,
+            'rows_per_sec': None,
+            'error': None,
+            'runner_pid': None,
+            'created': time.time(),
+            'updated': time.time()
+        })
+        return job_id
+
+    def load_state(self, job_id):
+        with open(os.path.join(self.job_dir(job_id), STATE_FILE)) as f:
+            return json.load(f)
+
+    def save_state(self, job_id, state):
+        state['updated'] = time.time()
+        path = os.path.join(self.jobs_dir, job_id, STATE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    def lock_runner(self, job_id):
+        """
+        Take the job's runner lock without waiting
+
+        Returns:
+            The open lock file (closing it releases the lock), or None when
+            another process is running the job
+        """
+        lock_file = open(os.path.join(self.job_dir(job_id), RUNNER_LOCK_FILE), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def is_running(self, job_id):
+        """Whether a live process holds the job's runner lock"""
+        lock_file = self.lock_runner(job_id)
+        if lock_file is None:
+            return True
+        lock_file.close()
+        return False
+
+    def status(self, job_id):
+        """Job state: status, rows done/failed, progress (0-1) and rows_per_sec"""
+        state = self.load_state(job_id)
+        if state['status'] == RUNNING and not self.is_running(job_id):
+            # The runner died without saving a final state; its completed chunks are kept
+            state['status'] = FAILED
+            state['error'] = (f"Runner (pid {state.get('runner_pid')}) exited before finishing; "
+                              f"resume the job to continue from its last completed chunk")
+            state['resumable'] = True
+        if os.path.exists(os.path.join(self.job_dir(job_id), CANCEL_FILE)) and state['status'] in (QUEUED, RUNNING):
+            state['status_requested'] = CANCELLED
+        return state
+
+    def cancel(self, job_id):
+        """Ask a job to stop after its current chunk"""
+        open(os.path.join(self.job_dir(job_id), CANCEL_FILE), 'w').close()
+        state = self.load_state(job_id)
+        if state['status'] == QUEUED:
+            state['status'] = CANCELLED
+            self.save_state(job_id, state)
+        return state
+
+    def resume(self, job_id):
+        """Clear a cancellation request so the next run continues the job"""
+        if self.is_running(job_id):
+            raise ValueError(f"Job {job_id} is still running")
+        cancel_path = os.path.join(self.job_dir(job_id), CANCEL_FILE)
+        if os.path.exists(cancel_path):
+            os.remove(cancel_path)
+
+    def start(self, job_id, workers=None):
+        """Run a job in a detached process and return immediately"""
+        if self.is_running(job_id):
+            raise ValueError(f"Job {job_id} is already running")
+        command = [sys.executable, os.path.abspath(__file__), '--jobs-dir', self.jobs_dir, 'run', job_id]
+        if workers:
+            command += ['--workers', str(workers)]
+        subprocess.Popen(command, cwd=CURRENT_DIR, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+    def run(self, job_id, workers=None):
+        """
+        Score a job's remaining chunks, resuming after its last completed chunk
+
+        Args:
+            job_id: Job to run
+            workers: Scoring processes, each with a warm predictor (default: CPU count)
+
+        Returns:
+            The final job state
+        """
+        lock_file = self.lock_runner(job_id)
+        if lock_file is None:
+            raise ValueError(f"Job {job_id} is already running")
+        # Released only after the final state is saved
+        with lock_file:
+            return self._run_locked(job_id, workers)
+
+    def _run_locked(self, job_id, workers):
+        cancel_path = os.path.join(self.job_dir(job_id), CANCEL_FILE)
+        state = self.load_state(job_id)
+        if state['status'] == COMPLETED:
+            return state
+        state['status'] = RUNNING
+        state['runner_pid'] = os.getpid()
+        state['error'] = None
+        self.save_state(job_id, state)
+
+        workers = workers or os.cpu_count() or 1
+        # Keep a few chunks in flight per worker without reading the whole input
+        max_in_flight = workers * 2
+        pending = []
+
+        context = multiprocessing.get_context('spawn')
+        run_start = time.perf_counter()
+        running_before = state['running_seconds']
+        try:
+            with open(state['output_path'], 'ab') as output:
+                # Drop anything written after the last chunk recorded as complete
+                output.truncate(state['output_bytes'])
+                output.seek(state['output_bytes'])
+
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                         initializer=_init_worker) as executor:
+                    chunks = read_chunks(state['input_path'], state['input_format'],
+                                         state['chunk_size'], state['completed_chunks'])
+                    for chunk_index, records in chunks:
+                        if os.path.exists(cancel_path):
+                            break
+                        pending.append((chunk_index, len(records),
+                                        executor.submit(_score_chunk, records, state['condition_type'])))
+                        if len(pending) >= max_in_flight:
+                            self._write_chunk(job_id, state, output, pending.pop(0), run_start, running_before)
+
+                    while pending and not os.path.exists(cancel_path):
+                        self._write_chunk(job_id, state, output, pending.pop(0), run_start, running_before)
+
+                    if pending:
+                        for _, _, future in pending:
+                            future.cancel()
+                        pending = []
+
+            state['status'] = CANCELLED if os.path.exists(cancel_path) else COMPLETED
+            if state['status'] == COMPLETED:
+                state['progress'] = 1.0
+        except Exception as e:
+            state['status'] = FAILED
+            state['error'] = str(e)
+
+        state['runner_pid'] = None
+        self.save_state(job_id, state)
+        return state
+
+    def _write_chunk(self, job_id, state, output, chunk, run_start, running_before):
+        chunk_index, n_records, future = chunk
+        results = future.result()
+        first_row = chunk_index * state['chunk_size']
+        lines = ''.join(
+            json.dumps({'index': first_row + i, 'result': result}) + '\n' for i, result in enumerate(results)
+        )
+        output.write(lines.encode('utf-8'))
+        output.flush()
+        os.fsync(output.fileno())
+
+        state['completed_chunks'] = chunk_index + 1
+        state['output_bytes'] = output.tell()
+        state['rows_done'] += n_records
+        state['rows_failed'] += sum(1 for result in results if 'error' in result)
+        state['progress'] = state['rows_done'] / state['total_rows'] if state['total_rows'] else 1.0
+        state['running_seconds'] = running_before + time.perf_counter() - run_start
+        state['rows_per_sec'] = state['rows_done'] / state['running_seconds'] if state['running_seconds'] else None
+        self.save_state(job_id, state)
+
+    def results(self, job_id, offset=0, limit=100):
+        """Page through a job's scored rows in input order"""
+        state = self.load_state(job_id)
+        rows = []
+        with open(state['output_path'], 'rb') as f:
+            # Only the chunks recorded as complete; a running job may be mid-write
+            remaining = state['output_bytes']
+            for i, line in enumerate(f):
+                remaining -= len(line)
+                if remaining < 0 or len(rows) == limit:
+                    break
+                if i >= offset:
+                    rows.append(json.loads(line))
+        return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk scoring jobs for CSV / JSON lines files of patient records")
+    parser.add_argument('--jobs-dir', default=DEFAULT_JOBS_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit_parser = commands.add_parser('submit', help="Register a job and start it in the background")
+    submit_parser.add_argument('input', help="CSV or JSON lines file of patient records")
+    submit_parser.add_argument('--condition-type', default='heart_disease',
+                               choices=['heart_disease', 'gastric_cancer'])
+    submit_parser.add_argument('--chunk-size', type=int, default=1000)
+    submit_parser.add_argument('--format', choices=['csv', 'jsonl'], default=None)
+    submit_parser.add_argument('--workers', type=int, default=None)
+    submit_parser.add_argument('--foreground', action='store_true', help="Run in this process instead")
+
+    for name, help_text in (('run', "Run or resume a job in this process"),
+                            ('resume', "Resume a job in the background from its last completed chunk"),
+                            ('status', "Print a job's state"),
+                            ('cancel', "Stop a job after its current chunk"),
+                            ('results', "Print scored rows")):
+        command_parser = commands.add_parser(name, help=help_text)
+        command_parser.add_argument('job_id')
+        if name in ('run', 'resume'):
+            command_parser.add_argument('--workers', type=int, default=None)
+        if name == 'results':
+            command_parser.add_argument('--offset', type=int, default=0)
+            command_parser.add_argument('--limit', type=int, default=100)
+
+    args = parser.parse_args()
+    sys.path.insert(0, CURRENT_DIR)
+    queue = JobQueue(args.jobs_dir)
+
+    try:
+        if args.command == 'submit':
+            job_id = queue.submit(args.input, args.condition_type, args.chunk_size, args.format)
+            if args.foreground:
+                output = queue.run(job_id, args.workers)
+            else:
+                queue.start(job_id, args.workers)
+                output = queue.status(job_id)
+        elif args.command == 'run':
+            queue.resume(args.job_id)
+            output = queue.run(args.job_id, args.workers)
+        elif args.command == 'resume':
+            queue.resume(args.job_id)
+            queue.start(args.job_id, args.workers)
+            output = queue.status(args.job_id)
+        elif args.command == 'status':
+            output = queue.status(args.job_id)
+        elif args.command == 'cancel':
+            output = queue.cancel(args.job_id)
+        else:
+            output = {'results': queue.results(args.job_id, args.offset, args.limit)}
+        print(json.dumps(output))
+    except Exception as e:
+        print(json.dumps({'error': str(e)}))
+        sys.exit(1)
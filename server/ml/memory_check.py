@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmark import DEFAULT_DATA_PATH, load_rows
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# smaps fields summed per worker, in kB
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def read_smaps(pid, artifact_dirs):
+    """
+    Memory of one process from /proc/<pid>/smaps, in kB
+
+    Returns:
+        (totals, artifacts): field sums over every mapping, and over the mappings
+        of files under artifact_dirs (the memory-mapped model arrays)
+    """
+    totals = dict.fromkeys(SMAPS_FIELDS, 0)
+    artifacts = dict.fromkeys(SMAPS_FIELDS, 0)
+    in_artifact = False
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in totals:
+                kb = int(rest.split()[0])
+                totals[key] += kb
+                if in_artifact:
+                    artifacts[key] += kb
+            elif '-' in key and ' ' in line:
+                # Mapping header: "start-end perms offset dev inode [path]"
+                parts = line.split(None, 5)
+                path = parts[5].strip() if len(parts) > 5 else ''
+                in_artifact = any(path.startswith(directory) for directory in artifact_dirs)
+    return totals, artifacts
+
+
+def start_workers(count, worker_args):
+    env = dict(os.environ, PYTHONWARNINGS='ignore')
+    return [
+        subprocess.Popen([sys.executable, os.path.join(CURRENT_DIR, 'predict.py'), '--worker'] + worker_args,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         text=True, cwd=CURRENT_DIR, env=env)
+        for _ in range(count)
+    ]
+
+
+def measure(count, rows, worker_args, artifact_dirs):
+    """Start count workers, have each score rows for both conditions, and read their memory"""
+    workers = start_workers(count, worker_args)
+    try:
+        for worker in workers:
+            for condition_type in ('heart_disease', 'gastric_cancer'):
+                worker.stdin.write(json.dumps({'id': condition_type, 'condition_type': condition_type,
+                                               'records': rows}) + '\n')
+            worker.stdin.flush()
+        for worker in workers:
+            for _ in range(2):
+                if not worker.stdout.readline():
+                    raise RuntimeError(f"Worker {worker.pid} exited before answering")
+        # Let lazily touched pages settle before sampling
+        time.sleep(0.2)
+        samples = [read_smaps(worker.pid, artifact_dirs) for worker in workers]
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+        for worker in workers:
+            worker.wait()
+
+    def mean(field, part):
+        return sum(sample[part][field] for sample in samples) / len(samples)
+
+    return {
+        'workers': count,
+        'rss_kb': mean('Rss', 0),
+        'pss_kb': mean('Pss', 0),
+        'private_kb': mean('Private_Clean', 0) + mean('Private_Dirty', 0),
+        'artifact_rss_kb': mean('Rss', 1),
+        'artifact_pss_kb': mean('Pss', 1),
+        'artifact_private_kb': mean('Private_Clean', 1) + mean('Private_Dirty', 1),
+    }
+
+
+def check(results, max_growth, max_private_mb=None):
+    """
+    Failure messages: model files must be memory-mapped and shared (their PSS per
+    worker falls as 1/N), per-worker private memory must not grow with the worker
+    count, and (optionally) private memory stays in budget
+
+    A model loaded into anonymous memory (unpickled, or np.load without mmap_mode)
+    keeps per-worker private memory flat; it shows up as model files that are not
+    mapped at all, or that each worker maps privately.
+    """
+    failures = []
+    for result in results:
+        if result['artifact_rss_kb'] == 0:
+            failures.append(f"no model file is memory-mapped with {result['workers']} workers; "
+                            f"the arrays were loaded into each worker's own memory")
+    if max_private_mb is not None:
+        for result in results:
+            if result['workers'] > 1 and result['private_kb'] / 1024 > max_private_mb:
+                failures.append(f"{result['private_kb'] / 1024:.1f} MB private per worker with "
+                                f"{result['workers']} workers is over the budget of {max_private_mb} MB")
+
+    # Pages of a file mapped by N workers are shared N ways, so each worker's
+    # proportional share of the model files falls as 1/N
+    smallest = min(results, key=lambda result: result['workers'])
+    for result in results:
+        if result is smallest or smallest['artifact_rss_kb'] == 0:
+            continue
+        expected = smallest['artifact_pss_kb'] * smallest['workers'] / result['workers']
+        if result['artifact_pss_kb'] > expected * (1 + max_growth) + 64:
+            failures.append(f"model files are not shared by {result['workers']} workers: "
+                            f"{result['artifact_pss_kb']:.0f} kB PSS each, expected about {expected:.0f} kB")
+
+    # A lone worker is the only mapper of every file, so all its pages count as private;
+    # compare against the smallest run where pages can be shared
+    shared_runs = [result for result in results if result['workers'] > 1]
+    if not shared_runs:
+        return failures
+    baseline = shared_runs[0]
+    for result in shared_runs[1:]:
+        growth = result['private_kb'] / baseline['private_kb'] - 1
+        if growth > max_growth:
+            failures.append(f"private memory per worker grew {growth:.0%} from {baseline['workers']} to "
+                            f"{result['workers']} workers")
+        if result['artifact_private_kb'] > baseline['artifact_private_kb'] * (1 + max_growth) + 64:
+            failures.append(f"model files are copied into each of {result['workers']} workers "
+                            f"({result['artifact_private_kb']:.0f} kB private)")
+    return failures
+
+
+if __name__ == "__main__":
+    # Linux only: per-worker RSS/PSS from /proc/<pid>/smaps as the worker count grows
+    parser = argparse.ArgumentParser(
+        description="Measure prediction worker memory for increasing worker counts; exits non-zero "
+                    "if the model files are not memory-mapped and shared, or per-worker private memory "
+                    "grows with the count"
+    )
+    parser.add_argument('--workers', default='1,2,4', help="Comma-separated worker counts")
+    parser.add_argument('--rows', type=int, default=32, help="Records each worker scores before sampling")
+    parser.add_argument('--data', default=DEFAULT_DATA_PATH)
+    parser.add_argument('--shared-dir', default=None,
+                        help="Pass --shared-dir to the workers (legacy pickles converted into shared bundles)")
+    parser.add_argument('--max-growth', type=float, default=0.1,
+                        help="Allowed growth of per-worker private memory over the smallest multi-worker run")
+    parser.add_argument('--max-private-mb', type=float, default=None,
+                        help="Fail if a worker's private memory exceeds this (multi-worker runs)")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    worker_args = ['--shared-dir', args.shared_dir] if args.shared_dir else []
+    artifact_dirs = [CURRENT_DIR] + ([os.path.abspath(args.shared_dir)] if args.shared_dir else [])
+    rows = load_rows(args.data, args.rows)
+    results = [measure(int(count), rows, worker_args, artifact_dirs) for count in args.workers.split(',')]
+    failures = check(results, args.max_growth, args.max_private_mb)
+
+    if args.json:
+        print(json.dumps({'results': results, 'failures': failures}, indent=2))
+    else:
+        print(f"{'workers':>7} {'RSS MB':>8} {'PSS MB':>8} {'node PSS MB':>11} {'private MB':>10} "
+              f"{'model RSS MB':>12} {'model PSS MB':>12} {'model private MB':>16}")
+        for result in results:
+            print(f"{result['workers']:>7} {result['rss_kb'] / 1024:>8.1f} {result['pss_kb'] / 1024:>8.1f} "
+                  f"{result['pss_kb'] * result['workers'] / 1024:>11.1f} "
+                  f"{result['private_kb'] / 1024:>10.1f} {result['artifact_rss_kb'] / 1024:>12.2f} "
+                  f"{result['artifact_pss_kb'] / 1024:>12.2f} {result['artifact_private_kb'] / 1024:>16.2f}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,177 @@
+import asyncio
+import time
+
+# Histogram bounds for batch sizes (rows), instead of the default seconds buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-record requests into batches per condition
+
+    Each condition has a queue; one drain task per condition takes up to
+    max_batch_size waiting requests, runs them as one batch in the executor and
+    resolves every caller's future with its own row. The next batch gathers
+    while the previous one runs.
+
+    The window a batch waits for more requests adapts to the arrival rate: the
+    smoothed gap between arrivals predicts whether another request is coming
+    within max_wait. When it is not (an idle service) the batch is dispatched
+    at once, so a lone request pays no added latency; under load the window is
+    the time the gap predicts to fill the batch, capped at max_wait.
+    """
+
+    def __init__(self, run_batch, max_batch_size=32, max_wait=0.005, instrumentation=None, executor=None):
+        """
+        Args:
+            run_batch: Blocking callable (condition_type, records, latency_budget)
+                returning one result per record
+            max_batch_size: Most requests scored together
+            max_wait: Longest a request waits for others to join its batch, in seconds
+            executor: concurrent.futures executor run_batch runs in (default: the loop's)
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.instrumentation = instrumentation
+        self.executor = executor
+        self.queues = {}
+        self.full = {}
+        self.drains = {}
+        self.last_arrival = {}
+        self.arrival_gap = {}
+        if instrumentation is not None:
+            instrumentation.set_buckets('predictor_microbatch_size', BATCH_SIZE_BUCKETS)
+
+    def window(self, condition_type):
+        """Seconds the batch at the head of the queue should wait for more requests"""
+        gap = self.arrival_gap.get(condition_type)
+        if gap is None or gap >= self.max_wait:
+            return 0.0
+        room = self.max_batch_size - len(self.queues[condition_type])
+        return min(self.max_wait, gap * room)
+
+    async def submit(self, condition_type, record, latency_budget=None):
+        """Queue one record and wait for its result"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        last = self.last_arrival.get(condition_type)
+        if last is not None:
+            gap = now - last
+            previous = self.arrival_gap.get(condition_type)
+            self.arrival_gap[condition_type] = gap if previous is None else 0.8 * previous + 0.2 * gap
+        self.last_arrival[condition_type] = now
+
+        future = loop.create_future()
+        queue = self.queues.setdefault(condition_type, [])
+        queue.append((record, latency_budget, now, future))
+        full = self.full.setdefault(condition_type, asyncio.Event())
+        if len(queue) >= self.max_batch_size:
+            full.set()
+
+        drain = self.drains.get(condition_type)
+        if drain is None or drain.done():
+            self.drains[condition_type] = asyncio.create_task(self.drain(condition_type))
+        return await future
+
+    async def drain(self, condition_type):
+        """Dispatch batches for one condition until its queue is empty"""
+        loop = asyncio.get_running_loop()
+        queue = self.queues[condition_type]
+        full = self.full[condition_type]
+        while queue:
+            dispatch_at = queue[0][2] + self.window(condition_type)
+            while len(queue) < self.max_batch_size and loop.time() < dispatch_at:
+                full.clear()
+                try:
+                    await asyncio.wait_for(full.wait(), dispatch_at - loop.time())
+                except asyncio.TimeoutError:
+                    break
+
+            batch = queue[:self.max_batch_size]
+            del queue[:self.max_batch_size]
+            full.clear()
+            await self.run(condition_type, batch)
+
+    async def run(self, condition_type, batch):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # The batch has to meet its most urgent caller's budget
+        budgets = [budget - (now - arrived) for _, budget, arrived, _ in batch if budget is not None]
+        latency_budget = max(min(budgets), 0.0) if budgets else None
+
+        if self.instrumentation is not None:
+            self.instrumentation.observe('predictor_microbatch_size', len(batch), condition=condition_type)
+            for _, _, arrived, _ in batch:
+                self.instrumentation.observe('predictor_microbatch_queue_wait_seconds', now - arrived,
+                                             condition=condition_type)
+
+        records = [record for record, _, _, _ in batch]
+        try:
+            results = await loop.run_in_executor(self.executor, self.run_batch, condition_type, records,
+                                                 latency_budget)
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import os
+    import statistics
+    from concurrent.futures import ThreadPoolExecutor
+
+    from predict import DualConditionPredictor
+
+    # Latency of concurrent single-record requests, one at a time vs micro-batched
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched against per-request scoring")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batch-wait-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    from benchmark import load_rows
+
+    rows = load_rows(os.path.join(current_dir, 'heart.csv'), args.requests)
+    predictor = DualConditionPredictor()
+    predictor.get_model('heart_disease')
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    async def run(score):
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one(row):
+            async with semaphore:
+                start = time.perf_counter()
+                await score(row)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(row) for row in rows))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return {'requests_per_sec': len(rows) / elapsed,
+                'p50_ms': statistics.median(latencies) * 1000,
+                'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000}
+
+    async def single(row):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, predictor.predict, row, 'heart_disease')
+
+    batcher = MicroBatcher(lambda ct, records, budget: predictor.predict_batch(records, ct, latency_budget=budget),
+                           args.batch_size, args.batch_wait_ms / 1000, executor=executor)
+
+    async def batched(row):
+        return await batcher.submit('heart_disease', row)
+
+    print(json.dumps({'one_at_a_time': asyncio.run(run(single)),
+                      'micro_batched': asyncio.run(run(batched))}, indent=2))
@@ -0,0 +1,312 @@
+import hashlib
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from parallel_training import limit_threads
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'PREDICTION_CV_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cv_cache')
+)
+
+SEARCH_STRATEGIES = ('none', 'random', 'halving')
+
+
+def search_spaces():
+    """
+    Parameter distributions searched per estimator class
+
+    KNN stays uniform-weighted so the member can still be served from its
+    neighbour index without sklearn.
+    """
+    from scipy.stats import loguniform, randint, uniform
+
+    return {
+        'LogisticRegression': {'C': loguniform(1e-3, 1e2)},
+        'GaussianNB': {'var_smoothing': loguniform(1e-12, 1e-6)},
+        'RandomForestClassifier': {
+            'n_estimators': randint(20, 200),
+            'max_depth': [3, 5, 8, 10, 15, None],
+            'min_samples_leaf': randint(1, 10),
+            'max_features': ['sqrt', 'log2', None],
+        },
+        'XGBClassifier': {
+            'learning_rate': loguniform(0.01, 0.3),
+            'n_estimators': randint(25, 300),
+            'max_depth': randint(2, 10),
+            'subsample': uniform(0.5, 0.5),
+            'colsample_bytree': uniform(0.5, 0.5),
+            'gamma': uniform(0, 1),
+            'reg_lambda': loguniform(0.1, 10),
+        },
+        'KNeighborsClassifier': {'n_neighbors': randint(3, 31)},
+        'DecisionTreeClassifier': {
+            'criterion': ['gini', 'entropy'],
+            'max_depth': [3, 4, 5, 6, 8, 10, 12, None],
+            'min_samples_leaf': randint(1, 20),
+        },
+    }
+
+
+class FoldCache:
+    """
+    Stratified k-fold splits of a training matrix, scaled and stored as .npy files
+
+    Each fold's scaler is fit on that fold's training rows only. The files are
+    keyed by a hash of the data and the split settings, so every candidate and
+    every later run on the same data reads the same memory-mapped matrices
+    instead of re-encoding and re-scaling them. Training rows are stored in a
+    shuffled order, so a prefix of them is a random subsample (successive
+    halving trains on prefixes).
+    """
+
+    def __init__(self, X, y, n_splits=5, cache_dir=None, random_state=42):
+        self.n_splits = n_splits
+        self.random_state = random_state
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        y = np.asarray(y)
+
+        digest = hashlib.sha256()
+        digest.update(X.tobytes())
+        digest.update(np.ascontiguousarray(y).tobytes())
+        digest.update(f"{X.shape}:{n_splits}:{random_state}".encode('utf-8'))
+        self.directory = os.path.join(cache_dir or DEFAULT_CACHE_DIR, digest.hexdigest()[:16])
+
+        if not os.path.exists(os.path.join(self.directory, 'complete')):
+            self._write(X, y)
+
+    def _write(self, X, y):
+        from sklearn.model_selection import StratifiedKFold
+        from sklearn.preprocessing import StandardScaler
+
+        os.makedirs(self.directory, exist_ok=True)
+        rng = np.random.RandomState(self.random_state)
+        splitter = StratifiedKFold(n_splits=self.n_splits, shuffle=True, random_state=self.random_state)
+        for fold, (train_rows, val_rows) in enumerate(splitter.split(X, y)):
+            train_rows = rng.permutation(train_rows)
+            scaler = StandardScaler().fit(X[train_rows])
+            arrays = {
+                'X_train': scaler.transform(X[train_rows]),
+                'y_train': y[train_rows],
+                'X_val': scaler.transform(X[val_rows]),
+                'y_val': y[val_rows],
+            }
+            for name, array in arrays.items():
+                path = self.path(fold, name)
+                np.save(path + '.tmp.npy', array, allow_pickle=False)
+                os.replace(path + '.tmp.npy', path)
+        # Written last: a cache interrupted mid-way is rebuilt on the next run
+        open(os.path.join(self.directory, 'complete'), 'w').close()
+
+    def path(self, fold, name):
+        return os.path.join(self.directory, f"fold{fold}_{name}.npy")
+
+    def fold_files(self, fold):
+        return {name: self.path(fold, name) for name in ('X_train', 'y_train', 'X_val', 'y_val')}
+
+    def train_size(self):
+        return min(len(np.load(self.path(fold, 'y_train'), mmap_mode='r')) for fold in range(self.n_splits))
+
+
+def score_candidate(key, model, params, fold_files, n_rows=None, n_threads=1):
+    """
+    Fit one candidate on one fold (its first n_rows training rows) and score it
+
+    Returns:
+        (key, validation accuracy or None, error message or None)
+    """
+    from sklearn.base import clone
+    from threadpoolctl import threadpool_limits
+
+    arrays = {name: np.load(path, mmap_mode='r') for name, path in fold_files.items()}
+    try:
+        model = limit_threads(clone(model).set_params(**params), n_threads)
+        with threadpool_limits(limits=n_threads):
+            model.fit(arrays['X_train'][:n_rows], arrays['y_train'][:n_rows])
+            score = model.score(arrays['X_val'], arrays['y_val'])
+        return key, float(score), None
+    except Exception as e:
+        return key, None, str(e)
+
+
+def sample_candidates(model, n_candidates, random_state=42):
+    """The model's current parameters followed by n_candidates - 1 random draws"""
+    from sklearn.model_selection import ParameterSampler
+
+    space = search_spaces().get(type(model).__name__)
+    candidates = [{}]
+    if space and n_candidates > 1:
+        candidates += list(ParameterSampler(space, n_candidates - 1, random_state=random_state))
+    return candidates
+
+
+def tune_members(models, X, y, cv=5, search='random', n_candidates=20, n_jobs=1,
+                 cache_dir=None, halving_factor=3, min_resources=50, random_state=42):
+    """
+    Cross-validate, and optionally search the hyperparameters of, every member
+
+    Args:
+        models: Dictionary of name -> unfitted estimator; its current parameters
+            are always candidate 0, so a search never does worse than them on CV
+        X, y: Training rows (unscaled); each fold is scaled on its own training part
+        cv: Number of stratified folds
+        search: 'none' (cross-validate the current parameters), 'random' (every
+            candidate on the full folds) or 'halving' (successive halving: all
+            candidates start on min_resources rows per fold, the best
+            1/halving_factor go on to halving_factor times as many rows)
+        n_candidates: Candidates per member, including the current parameters
+        n_jobs: Worker processes shared by all members' fits (-1: one per CPU)
+        cache_dir: Where fold matrices are cached (default: PREDICTION_CV_CACHE or ./cv_cache)
+
+    Returns:
+        Dictionary of name -> {'best_params', 'cv_mean', 'cv_std', 'cv_scores',
+        'candidates_evaluated'}; best_params is {} when the current parameters won.
+        A member whose candidates all failed on some fold gets {'best_params': {},
+        'error', 'candidates_evaluated'} instead and keeps its current parameters
+    """
+    if search not in SEARCH_STRATEGIES:
+        raise ValueError(f"Unknown search strategy: {search}")
+    folds = FoldCache(X, y, n_splits=cv, cache_dir=cache_dir, random_state=random_state)
+    full_rows = folds.train_size()
+    print(f"{cv}-fold CV matrices cached in {folds.directory}")
+
+    candidates = {
+        name: sample_candidates(model, 1 if search == 'none' else n_candidates, random_state)
+        for name, model in models.items()
+    }
+
+    # Training rows per fold for each round
+    if search == 'halving':
+        n_rounds = 1 + int(math.log(max(len(c) for c in candidates.values()), halving_factor))
+        resources = [max(min(min_resources, full_rows), full_rows // halving_factor ** (n_rounds - 1 - r))
+                     for r in range(n_rounds)]
+        resources[-1] = full_rows
+    else:
+        resources = [full_rows]
+
+    cpu_count = os.cpu_count() or 1
+    n_jobs = cpu_count if n_jobs is not None and n_jobs < 0 else max(1, n_jobs or 1)
+    n_threads = max(1, cpu_count // n_jobs)
+    executor = None
+    if n_jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn'))
+
+    survivors = {name: list(range(len(c))) for name, c in candidates.items()}
+    scores = {}
+    try:
+        for round_index, n_rows in enumerate(resources):
+            tasks = [
+                ((name, candidate, fold), models[name], candidates[name][candidate], folds.fold_files(fold),
+                 n_rows, n_threads)
+                for name in models for candidate in survivors[name] for fold in range(cv)
+            ]
+            if executor is None:
+                results = [score_candidate(*task) for task in tasks]
+            else:
+                results = [future.result() for future in [executor.submit(score_candidate, *task) for task in tasks]]
+
+            scores = {}
+            for (name, candidate, fold), score, error in results:
+                if error is not None:
+                    print(f"{name} candidate {candidate} failed on fold {fold}: {error}")
+                scores.setdefault((name, candidate), []).append(np.nan if score is None else score)
+
+            if round_index < len(resources) - 1:
+                for name in models:
+                    ranked = sorted(survivors[name], key=lambda c: -_mean_or_nan(scores[(name, c)]))
+                    kept = ranked[:max(1, math.ceil(len(ranked) / halving_factor))]
+                    # The current parameters always reach the full folds, to be compared on them
+                    survivors[name] = kept if 0 in kept else kept + [0]
+                print(f"Halving round {round_index + 1}/{len(resources)} on {n_rows} rows per fold: "
+                      + ", ".join(f"{name} {len(kept)}" for name, kept in survivors.items()))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    results = {}
+    for name in models:
+        best = max(survivors[name], key=lambda c: _mean_or_nan(scores[(name, c)]))
+        best_scores = scores[(name, best)]
+        if np.isnan(best_scores).any():
+            # No candidate has a score on every fold, so there is no CV estimate to report
+            results[name] = {
+                'best_params': {},
+                'error': f"no candidate was scored on all {cv} folds",
+                'candidates_evaluated': len(candidates[name]),
+            }
+            continue
+        results[name] = {
+            'best_params': _plain(candidates[name][best]),
+            'cv_mean': float(np.mean(best_scores)),
+            'cv_std': float(np.std(best_scores)),
+            'cv_scores': [float(score) for score in best_scores],
+            'candidates_evaluated': len(candidates[name]),
+        }
+    return results
+
+
+def _mean_or_nan(scores):
+    """Mean fold score; a candidate that failed on any fold ranks last"""
+    mean = float(np.mean(scores))
+    return -np.inf if np.isnan(mean) else mean
+
+
+def _plain(params):
+    """Sampled parameters as plain Python values"""
+    return {key: value.item() if hasattr(value, 'item') else value for key, value in params.items()}
+
+
+def describe_tuning(result):
+    """One-line summary of a member's tune_members result"""
+    if 'error' in result:
+        return f"CV failed: {result['error']}, params: unchanged"
+    return f"CV: {result['cv_mean']:.4f} +/- {result['cv_std']:.4f}, params: {result['best_params'] or 'unchanged'}"
+
+
+def apply_tuning(models, model_performance, tuning):
+    """Set members to their best parameters (before training) or record CV results (after)"""
+    for name, result in tuning.items():
+        if 'error' in result:
+            # Failed members keep their parameters and only their test_score
+            continue
+        if model_performance is None:
+            if result['best_params']:
+                models[name].set_params(**result['best_params'])
+        elif name in model_performance:
+            model_performance[name].update({
+                'cv_mean': result['cv_mean'],
+                'cv_std': result['cv_std'],
+                'cv_folds': len(result['cv_scores']),
+                'best_params': result['best_params'],
+            })
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Cross-validate and search the heart disease ensemble members")
+    parser.add_argument('--data', default=os.path.join(current_dir, 'heart.csv'))
+    parser.add_argument('--target', default='HeartDisease')
+    parser.add_argument('--cv', type=int, default=5)
+    parser.add_argument('--search', choices=SEARCH_STRATEGIES, default='random')
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+
+    from train_model import HeartDiseaseEnsemblePredictor
+
+    data = pd.read_csv(args.data)
+    X = pd.get_dummies(data.drop(args.target, axis=1), drop_first=True).to_numpy(dtype=np.float64)
+    X_train, _, y_train, _ = train_test_split(X, data[args.target].to_numpy(), test_size=0.2, random_state=42)
+
+    tuning = tune_members(HeartDiseaseEnsemblePredictor().models, X_train, y_train, cv=args.cv,
+                          search=args.search, n_candidates=args.candidates, n_jobs=args.jobs)
+    for name, result in tuning.items():
+        print(f"{name:<20} {describe_tuning(result)}")
@@ -0,0 +1,320 @@
+import os
+
+import numpy as np
+
+# Arrays stored for an index, as .npy files next to the KNN member
+INDEX_ARRAYS = ('vectors', 'row_ids', 'labels', 'centroids', 'list_offsets', 'recall_curve')
+
+# Upper bound on the (queries x rows x features) difference block held at once
+MAX_BLOCK_VALUES = 4 * 1024 * 1024
+
+EXACT = 'exact'
+APPROXIMATE = 'approximate'
+
+
+def _kmeans(X, n_clusters, n_iter=10, sample_size=50000, random_state=42):
+    """Lloyd's k-means on a sample of the rows; returns the centroids"""
+    rng = np.random.RandomState(random_state)
+    sample = X[rng.choice(len(X), min(len(X), sample_size), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = _nearest_centroid(sample, centroids)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def _centroid_distances(X, centroids):
+    """Squared distances to the centroids via ||x||^2 - 2x.c + ||c||^2 (ties here only affect speed)"""
+    return (np.einsum('ij,ij->i', X, X)[:, None] - 2 * X @ centroids.T
+            + np.einsum('ij,ij->i', centroids, centroids)[None, :])
+
+
+def _nearest_centroid(X, centroids):
+    assignment = np.empty(len(X), dtype=np.int64)
+    for start in range(0, len(X), 8192):
+        assignment[start:start + 8192] = np.argmin(_centroid_distances(X[start:start + 8192], centroids), axis=1)
+    return assignment
+
+
+class NeighborIndex:
+    """
+    Inverted-file (IVF) index over a KNN member's training rows
+
+    The rows are clustered with k-means and stored grouped by cluster (vectors,
+    with their original row_ids and labels); list_offsets marks where each
+    cluster's rows start. Exact search scans every row. Approximate search scans
+    only the rows of the n_probe clusters nearest each query; recall_curve,
+    measured when the index is built, maps n_probe to the recall@k it achieved,
+    so a recall target picks n_probe without tuning by hand.
+
+    Ties at equal distance go to the lower original row id, as in a stable
+    brute-force search.
+    """
+
+    def __init__(self, vectors, row_ids, labels, centroids, list_offsets, recall_curve, n_neighbors):
+        self.vectors = vectors
+        self.row_ids = np.asarray(row_ids)
+        self.labels = np.asarray(labels)
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.list_offsets = np.asarray(list_offsets)
+        self.recall_curve = np.asarray(recall_curve, dtype=np.float64)
+        self.n_neighbors = int(n_neighbors)
+
+    @classmethod
+    def build(cls, X, y, n_neighbors, n_lists=None, calibration_queries=256, random_state=42):
+        """Cluster the training rows, group them by cluster and measure the recall curve"""
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+        if n_lists is None:
+            n_lists = int(np.clip(np.sqrt(len(X)), 1, 4096))
+        n_lists = max(1, min(n_lists, len(X)))
+
+        centroids = _kmeans(X, n_lists, random_state=random_state)
+        assignment = _nearest_centroid(X, centroids)
+        order = np.lexsort((np.arange(len(X)), assignment))
+        counts = np.bincount(assignment, minlength=n_lists)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        index = cls(X[order], order, y[order], centroids, list_offsets, np.ones(n_lists), n_neighbors)
+        index.calibrate(calibration_queries, random_state)
+        return index
+
+    def calibrate(self, calibration_queries=256, random_state=42):
+        """
+        Measure recall_curve on a sample of the indexed rows: a true neighbour is
+        found exactly when its cluster is among the n_probe nearest to the query
+        """
+        n_lists = len(self.centroids)
+        X, _ = self.rows()
+        # Cluster of each row, by original row id
+        assignment = np.empty(len(self.row_ids), dtype=np.int64)
+        assignment[self.row_ids] = np.repeat(np.arange(n_lists), np.diff(self.list_offsets))
+
+        rng = np.random.RandomState(random_state)
+        queries = X[rng.choice(len(X), min(len(X), calibration_queries), replace=False)]
+        neighbor_clusters = assignment[self.search(queries, mode=EXACT)]
+        cluster_rank = np.argsort(np.argsort(_centroid_distances(queries, self.centroids), axis=1, kind='stable'),
+                                  axis=1, kind='stable')
+        ranks = np.take_along_axis(cluster_rank, neighbor_clusters, axis=1)
+        self.recall_curve = np.array([np.mean(ranks < n_probe) for n_probe in range(1, n_lists + 1)])
+
+    def rows(self):
+        """Indexed rows and their labels in original row id order"""
+        vectors = np.empty(self.vectors.shape, dtype=np.float64)
+        labels = np.empty(self.labels.shape, dtype=self.labels.dtype)
+        vectors[self.row_ids] = self.vectors
+        labels[self.row_ids] = self.labels
+        return vectors, labels
+
+    def rescaled(self, scale, offset):
+        """
+        Copy of the index with every row (and centroid) mapped to X * scale + offset
+
+        Used when the feature scaling changes: cluster means move with the rows, so
+        the lists stay valid and only the recall curve is measured again.
+        """
+        index = NeighborIndex(np.asarray(self.vectors) * scale + offset, self.row_ids, self.labels,
+                              self.centroids * scale + offset, self.list_offsets, self.recall_curve,
+                              self.n_neighbors)
+        index.calibrate()
+        return index
+
+    def append(self, X, y):
+        """
+        Copy of the index with new rows added to their nearest lists
+
+        The new rows get the next original row ids; each touched list's centroid
+        becomes the mean of its rows again, without re-clustering.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+        n_lists = len(self.centroids)
+        old_sizes = np.diff(self.list_offsets)
+        old_clusters = np.repeat(np.arange(n_lists), old_sizes)
+        new_clusters = _nearest_centroid(X, self.centroids)
+
+        clusters = np.concatenate([old_clusters, new_clusters])
+        row_ids = np.concatenate([self.row_ids, len(self.row_ids) + np.arange(len(X))])
+        order = np.lexsort((row_ids, clusters))
+        vectors = np.concatenate([np.asarray(self.vectors), X])[order]
+        labels = np.concatenate([self.labels, y])[order]
+        counts = np.bincount(clusters, minlength=n_lists)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        centroids = self.centroids.copy()
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, clusters[order], vectors)
+        touched = np.bincount(new_clusters, minlength=n_lists) > 0
+        centroids[touched] = sums[touched] / counts[touched, None]
+
+        index = NeighborIndex(vectors, row_ids[order], labels, centroids, list_offsets, self.recall_curve,
+                              self.n_neighbors)
+        index.calibrate()
+        return index
+
+    def n_probe_for(self, recall_target):
+        """Fewest lists to probe for the measured recall to reach recall_target"""
+        reached = np.flatnonzero(self.recall_curve >= recall_target)
+        return int(reached[0]) + 1 if len(reached) else len(self.centroids)
+
+    def search(self, queries, mode=EXACT, n_probe=None, recall_target=0.95):
+        """
+        Original row ids of the k nearest training rows for a batch of queries
+
+        Returns:
+            Array of shape (queries, k), nearest first
+        """
+        queries = np.asarray(queries, dtype=np.float64)
+        k = min(self.n_neighbors, len(self.row_ids))
+        best_distances = np.full((len(queries), k), np.inf)
+        best_ids = np.full((len(queries), k), np.iinfo(np.int64).max, dtype=np.int64)
+
+        if mode == EXACT:
+            self._merge(np.arange(len(queries)), queries, 0, len(self.row_ids), best_distances, best_ids)
+            return best_ids
+
+        if n_probe is None:
+            n_probe = self.n_probe_for(recall_target)
+        n_probe = min(n_probe, len(self.centroids))
+        order = np.argsort(_centroid_distances(queries, self.centroids), axis=1, kind='stable')
+        # Probe further for queries whose nearest lists hold fewer than k rows
+        list_sizes = np.diff(self.list_offsets)[order]
+        enough = np.argmax(np.cumsum(list_sizes, axis=1) >= k, axis=1) + 1
+        n_probed = np.maximum(n_probe, enough)
+        probed = np.zeros(order.shape, dtype=bool)
+        np.put_along_axis(probed, order, np.arange(order.shape[1])[None, :] < n_probed[:, None], axis=1)
+
+        # One pass per probed list, over every query that probes it
+        for cluster in np.flatnonzero(probed.any(axis=0)):
+            query_rows = np.flatnonzero(probed[:, cluster])
+            start, end = self.list_offsets[cluster], self.list_offsets[cluster + 1]
+            if end > start:
+                self._merge(query_rows, queries[query_rows], start, end, best_distances, best_ids)
+        return best_ids
+
+    def _merge(self, query_rows, queries, start, end, best_distances, best_ids):
+        """Fold the rows in [start, end) into the running k-best of the given queries"""
+        k = best_ids.shape[1]
+        step = max(1, MAX_BLOCK_VALUES // max(1, len(queries) * self.vectors.shape[1]))
+        for block_start in range(start, end, step):
+            block_end = min(block_start + step, end)
+            vectors = np.asarray(self.vectors[block_start:block_end])
+            distances = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+            ids = np.broadcast_to(self.row_ids[block_start:block_end], distances.shape)
+
+            all_distances = np.concatenate([best_distances[query_rows], distances], axis=1)
+            all_ids = np.concatenate([best_ids[query_rows], ids], axis=1)
+            if all_distances.shape[1] > 4 * k:
+                # Keep only rows within each query's k-th distance (ties included) before
+                # the full (distance, id) sort
+                kth = np.partition(all_distances, k - 1, axis=1)[:, k - 1:k]
+                keep = all_distances <= kth
+                candidates = np.argsort(~keep, axis=1, kind='stable')[:, :int(keep.sum(axis=1).max())]
+                all_distances = np.where(np.take_along_axis(keep, candidates, axis=1),
+                                         np.take_along_axis(all_distances, candidates, axis=1), np.inf)
+                all_ids = np.take_along_axis(all_ids, candidates, axis=1)
+            order = np.lexsort((all_ids, all_distances), axis=1)[:, :k]
+            best_distances[query_rows] = np.take_along_axis(all_distances, order, axis=1)
+            best_ids[query_rows] = np.take_along_axis(all_ids, order, axis=1)
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in INDEX_ARRAYS}
+
+
+class IndexedKNeighbors:
+    """
+    Uniform-weight KNN classifier served from a NeighborIndex
+
+    search_mode 'exact' returns the same neighbours as a brute-force search;
+    'approximate' probes as many clusters as recall_target requires.
+    """
+
+    accepts_sparse = False
+
+    def __init__(self, index, classes=None, search_mode=EXACT, recall_target=0.95):
+        self.index = index
+        self.classes_ = np.unique(index.labels) if classes is None else np.asarray(classes)
+        self.n_features_in_ = index.vectors.shape[1]
+        self.n_neighbors = index.n_neighbors
+        # Labels by original row id, as class indices; one byte per row keeps this
+        # per-process copy small next to the memory-mapped index
+        self.y_index = np.empty(len(index.row_ids), dtype=np.uint8 if len(self.classes_) <= 256 else np.int64)
+        self.y_index[index.row_ids] = np.searchsorted(self.classes_, index.labels)
+        self.set_search(search_mode, recall_target)
+
+    def set_search(self, search_mode=EXACT, recall_target=0.95):
+        if search_mode not in (EXACT, APPROXIMATE):
+            raise ValueError(f"Unknown KNN search mode: {search_mode}")
+        self.search_mode = search_mode
+        self.recall_target = recall_target
+        self.n_probe = self.index.n_probe_for(recall_target)
+
+    def kneighbors(self, X):
+        return self.index.search(X, self.search_mode, self.n_probe)
+
+    def predict_proba(self, X):
+        labels = self.y_index[self.kneighbors(X)]
+        votes = np.zeros((labels.shape[0], len(self.classes_)))
+        for column in range(len(self.classes_)):
+            votes[:, column] = np.sum(labels == column, axis=1)
+        return votes / labels.shape[1]
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def save_index(index, directory):
+    """Write an index's arrays and return its manifest spec"""
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    for name, array in index.to_arrays().items():
+        np.save(os.path.join(directory, name + '.npy'), np.ascontiguousarray(array), allow_pickle=False)
+        files[name] = name + '.npy'
+    return {'files': files, 'n_neighbors': index.n_neighbors, 'n_lists': int(len(index.centroids)),
+            'recall_curve': [float(recall) for recall in index.recall_curve]}
+
+
+def load_index(spec, directory, mmap=True):
+    """Open an index written by save_index; with mmap its arrays stay memory-mapped (shared across processes)"""
+    arrays = {
+        name: np.load(os.path.join(directory, filename), mmap_mode='r' if mmap else None, allow_pickle=False)
+        for name, filename in spec['files'].items()
+    }
+    return NeighborIndex(arrays['vectors'], arrays['row_ids'], arrays['labels'], arrays['centroids'],
+                         arrays['list_offsets'], arrays['recall_curve'], spec['n_neighbors'])
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # Recall and latency of exact vs approximate search on a synthetic training set
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.RandomState(0)
+    centers = rng.normal(scale=4.0, size=(50, 15))
+    X = centers[rng.randint(0, 50, n_rows)] + rng.normal(size=(n_rows, 15))
+    y = rng.randint(0, 2, n_rows)
+
+    start = time.perf_counter()
+    index = NeighborIndex.build(X, y, n_neighbors=10)
+    print(f"built {len(index.centroids)} lists over {n_rows} rows in {time.perf_counter() - start:.1f} s")
+
+    queries = X[rng.choice(n_rows, 200, replace=False)] + rng.normal(scale=0.1, size=(200, 15))
+    start = time.perf_counter()
+    exact = np.array([index.search(q[None, :], EXACT)[0] for q in queries])
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"exact             {exact_ms:8.3f} ms/query")
+
+    for recall_target in (0.9, 0.95, 0.99):
+        n_probe = index.n_probe_for(recall_target)
+        start = time.perf_counter()
+        found = np.array([index.search(q[None, :], APPROXIMATE, n_probe)[0] for q in queries])
+        approx_ms = (time.perf_counter() - start) / len(queries) * 1000
+        recall = np.mean([len(np.intersect1d(a, b)) / len(b) for a, b in zip(found, exact)])
+        print(f"target {recall_target:.2f}  n_probe {n_probe:4d}  {approx_ms:8.3f} ms/query  recall {recall:.3f}")
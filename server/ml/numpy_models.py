@@ -0,0 +1,100 @@
+import numpy as np
+
+
+class NumpyLogisticRegression:
+    """predict_proba of a fitted binary LogisticRegression, from coef_ and intercept_"""
+
+    accepts_sparse = True
+
+    def __init__(self, classes, coef, intercept):
+        self.classes_ = np.asarray(classes)
+        self.coef_ = np.asarray(coef, dtype=np.float64)
+        self.intercept_ = np.asarray(intercept, dtype=np.float64)
+        self.n_features_in_ = self.coef_.shape[1]
+        if len(self.classes_) != 2:
+            raise ValueError("Only binary logistic regression is supported")
+
+    def predict_proba(self, X):
+        decision = (X @ self.coef_.T + self.intercept_).reshape(-1)
+        positive = 1.0 / (1.0 + np.exp(-decision))
+        return np.stack([1 - positive, positive], axis=1)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class NumpyGaussianNB:
+    """predict_proba of a fitted GaussianNB, with the joint log likelihood computed as sklearn does"""
+
+    accepts_sparse = False
+
+    def __init__(self, classes, theta, var, class_prior):
+        self.classes_ = np.asarray(classes)
+        self.theta_ = np.asarray(theta, dtype=np.float64)
+        self.var_ = np.asarray(var, dtype=np.float64)
+        self.class_prior_ = np.asarray(class_prior, dtype=np.float64)
+        self.n_features_in_ = self.theta_.shape[1]
+        # Per-class constant terms, kept apart so the sums round as in sklearn
+        self.log_prior = np.log(self.class_prior_)
+        self.log_norm = -0.5 * np.sum(np.log(2.0 * np.pi * self.var_), axis=1)
+
+    def joint_log_likelihood(self, X):
+        joint_log_likelihood = []
+        for i in range(len(self.classes_)):
+            n_ij = self.log_norm[i] - 0.5 * np.sum(((X - self.theta_[i, :]) ** 2) / self.var_[i, :], axis=1)
+            joint_log_likelihood.append(self.log_prior[i] + n_ij)
+        return np.stack(joint_log_likelihood).T
+
+    def predict_proba(self, X):
+        jll = self.joint_log_likelihood(X)
+        return np.exp(jll - _logsumexp(jll)[:, None])
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.joint_log_likelihood(X), axis=1)]
+
+
+class RescaledInput:
+    """
+    Member kept in the feature space it was trained in
+
+    An incremental update can change the scaler without refitting every member;
+    such a member sees X * scale + offset, which maps the current scaled features
+    back onto the ones it was fitted on.
+    """
+
+    accepts_sparse = False
+
+    def __init__(self, model, scale, offset):
+        self.model = model
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.offset = np.asarray(offset, dtype=np.float64)
+
+    @property
+    def classes_(self):
+        return self.model.classes_
+
+    @property
+    def n_features_in_(self):
+        return len(self.scale)
+
+    def native_input(self, X):
+        return X * self.scale + self.offset
+
+    def predict_proba(self, X):
+        return self.model.predict_proba(self.native_input(X))
+
+    def predict(self, X):
+        return self.model.predict(self.native_input(X))
+
+
+def _logsumexp(array):
+    """Row-wise log-sum-exp, in the form sklearn's naive Bayes uses"""
+    array_max = np.max(array, axis=1, keepdims=True)
+    index_max = array == array_max
+    array = array.copy()
+    array[index_max] = -np.inf
+    m = np.sum(index_max, axis=1, keepdims=True, dtype=array.dtype)
+    shift = np.where(np.isfinite(array_max), array_max, 0)
+    s = np.sum(np.exp(array - shift), axis=1, keepdims=True)
+    s = np.where(s == 0, s, s / m)
+    return (np.log1p(s) + np.log(m) + array_max)[:, 0]
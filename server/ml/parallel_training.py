@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from feature_encoder import member_input
+
+# Estimator parameters that control native thread counts
+THREAD_PARAMS = ('n_jobs', 'nthread')
+
+
+def limit_threads(model, n_threads):
+    """Pin an estimator's own thread pool so concurrent fits do not oversubscribe cores"""
+    params = model.get_params(deep=False)
+    model.set_params(**{param: n_threads for param in THREAD_PARAMS if param in params})
+    return model
+
+
+def shareable(array):
+    """Send memory-mapped arrays to workers by file reference instead of by value"""
+    if isinstance(array, np.memmap) and array.filename:
+        return ('memmap', array.filename, array.dtype.str, array.shape, array.offset)
+    return array
+
+
+def resolve(array):
+    """Reopen an array passed with shareable()"""
+    if isinstance(array, tuple) and array and array[0] == 'memmap':
+        _, filename, dtype, shape, offset = array
+        return np.memmap(filename, dtype=dtype, mode='r', shape=shape, offset=offset)
+    return array
+
+
+def fit_and_score(name, model, X_train, y_train, X_test, y_test, n_threads=None):
+    """
+    Fit one ensemble member and score it on the train and test splits
+
+    Returns:
+        (name, fitted model or None, performance dictionary)
+    """
+    from threadpoolctl import threadpool_limits
+
+    X_train = resolve(X_train)
+    X_test = resolve(X_test)
+    try:
+        if n_threads is not None:
+            limit_threads(model, n_threads)
+        # BLAS/OpenMP pools used inside sklearn follow the same limit
+        # Sparse matrices are densified only for the members that need it
+        X_train = member_input(model, X_train)
+        X_test = member_input(model, X_test)
+        with threadpool_limits(limits=n_threads):
+            model.fit(X_train, y_train)
+            train_score = model.score(X_train, y_train)
+            test_score = model.score(X_test, y_test)
+        return name, model, {'train_score': train_score, 'test_score': test_score}
+    except Exception as e:
+        return name, None, {'train_score': None, 'test_score': None, 'error': str(e)}
+
+
+def train_members(models, X_train, y_train, X_test, y_test, n_jobs=1, threads_per_model=None):
+    """
+    Fit and score independent ensemble members, concurrently when n_jobs > 1
+
+    Args:
+        models: Dictionary of name -> unfitted estimator (random seeds already set)
+        n_jobs: Worker processes; 1 trains in this process one model at a time,
+            -1 uses one process per CPU
+        threads_per_model: Native threads each fit may use; defaults to the CPU
+            count divided evenly between the workers
+
+    Yields:
+        (name, fitted model or None, performance dictionary) in the order of models
+    """
+    cpu_count = os.cpu_count() or 1
+    if n_jobs is None or n_jobs == 0:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = cpu_count
+    n_jobs = min(n_jobs, len(models))
+
+    if n_jobs == 1:
+        for name, model in models.items():
+            yield fit_and_score(name, model, X_train, y_train, X_test, y_test, threads_per_model)
+        return
+
+    if threads_per_model is None:
+        threads_per_model = max(1, cpu_count // n_jobs)
+
+    # Spawned workers avoid inheriting an already-initialised OpenMP runtime
+    context = multiprocessing.get_context('spawn')
+    X_train = shareable(X_train)
+    X_test = shareable(X_test)
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as executor:
+        futures = [
+            executor.submit(fit_and_score, name, model, X_train, y_train, X_test, y_test, threads_per_model)
+            for name, model in models.items()
+        ]
+        for future in futures:
+            yield future.result()
@@ -1,33 +1,226 @@
 import sys
 import json
-import pickle
 import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 import numpy as np
-import pandas as pd
+from feature_encoder import FeatureEncoder, member_input
+from artifact_bundle import MANIFEST_NAME, bundle_exists, load_bundle
+from ensemble_combiner import build_combiner, member_accuracy
+from instrumentation import Instrumentation
+from result_cache import ResultCache, SqliteCacheBackend, cache_key
+from validation_schema import ChoiceField, DefaultFillSchema, FieldSchema, NumberField
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Artifact locations without extension: a bundle directory, or the legacy .pkl next to it
+MODEL_PATHS = {
+    'heart_disease': os.path.join(MODEL_DIR, 'heart_disease_ensemble'),
+    'gastric_cancer': os.path.join(MODEL_DIR, 'gastric_cancer_ensemble')
+}
+
+# Serve members as NumPy predictors (tree_compiler node arrays, numpy_models) instead of
+# sklearn/xgboost estimators; bundles then load without importing either library
+COMPILED_TREES = os.environ.get('PREDICTION_COMPILED_TREES', '1') != '0'
+
+# KNN members served from a prebuilt neighbour index: 'exact', or 'approximate' search
+# probing as many index lists as the recall target needs
+KNN_SEARCH = os.environ.get('PREDICTION_KNN_SEARCH', 'exact')
+KNN_RECALL_TARGET = float(os.environ.get('PREDICTION_KNN_RECALL', '0.95'))
+
+# How member outputs are combined: 'mean', 'weighted' (by member accuracy) or 'stacking'
+# (the logistic stacker fitted at training time); unset uses each artifact's default
+ENSEMBLE_COMBINER = os.environ.get('PREDICTION_COMBINER') or None
+
+# Bundle arrays are memory-mapped read-only, so workers on a node share one copy of
+# them in the page cache. A legacy pickle would be unpickled into every worker; with
+# this set it is converted once per node into a bundle here (/dev/shm keeps it in
+# shared memory) and every worker maps that instead
+SHARED_ARTIFACT_DIR = os.environ.get('PREDICTION_SHARED_DIR') or None
+
+# Workers append every result of a request carrying a 'user_id' to an append-only log
+# here, which {"op": "history"} pages through (unset: nothing is logged). Sealed
+# segments are compacted down to the last PREDICTION_LOG_RETENTION_DAYS of records
+PREDICTION_LOG_DIR = os.environ.get('PREDICTION_LOG_DIR') or None
+LOG_RETENTION_DAYS = os.environ.get('PREDICTION_LOG_RETENTION_DAYS') or None
+
+# Patient fields both conditions ask for, each under its own name and coding:
+# canonical name -> {condition: (field name, canonical value -> condition value)}
+SHARED_FIELDS = {
+    'age': {'heart_disease': ('Age', None), 'gastric_cancer': ('age', None)},
+    'sex': {'heart_disease': ('Sex', {'male': 'M', 'female': 'F'}),
+            'gastric_cancer': ('gender', {'male': 'male', 'female': 'female'})},
+}
+# Field names (lower-cased) accepted for the shared fields, and the sex codings
+SHARED_ALIASES = {'age': 'age', 'sex': 'sex', 'gender': 'sex'}
+SEX_VALUES = {'m': 'male', 'male': 'male', 'f': 'female', 'female': 'female'}
+
+# Loaded artifacts shared by every predictor in the process: path -> (mtime, model_dict)
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+
+
+def artifact_path(condition_type):
+    """Bundle directory for a condition, falling back to the legacy pickle"""
+    base_path = MODEL_PATHS[condition_type]
+    return base_path if bundle_exists(base_path) else base_path + '.pkl'
+
+
+def load_artifact(path, instrumentation=None):
+    """Load a model artifact through the process-wide cache, reloading it when the file changes"""
+    is_bundle = bundle_exists(path)
+    # save_bundle swaps in a complete directory, so the manifest's mtime tracks the bundle
+    mtime = os.stat(os.path.join(path, MANIFEST_NAME) if is_bundle else path).st_mtime_ns
+    
+    cached = _model_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        if instrumentation is not None:
+            instrumentation.inc('predictor_model_cache_hits_total', artifact=os.path.basename(path))
+        return cached[1]
+    
+    with _model_cache_lock:
+        # Another thread may have loaded it while we waited
+        cached = _model_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            if instrumentation is not None:
+                instrumentation.inc('predictor_model_cache_hits_total', artifact=os.path.basename(path))
+            return cached[1]
+        
+        start = time.perf_counter()
+        if is_bundle:
+            model_dict = load_bundle(path, compiled=COMPILED_TREES)
+        elif SHARED_ARTIFACT_DIR:
+            model_dict = load_bundle(shared_bundle(path, SHARED_ARTIFACT_DIR), compiled=COMPILED_TREES)
+        else:
+            # Unpickling a legacy artifact imports sklearn and xgboost
+            import pickle
+
+            with open(path, 'rb') as f:
+                model_dict = pickle.load(f)
+            if COMPILED_TREES:
+                from tree_compiler import compile_members
+
+                model_dict['models'] = compile_members(model_dict['models'])
+        model_dict['feature_encoder'] = FeatureEncoder.from_model_dict(model_dict)
+        for model in model_dict['models'].values():
+            if hasattr(model, 'set_search'):
+                model.set_search(KNN_SEARCH, KNN_RECALL_TARGET)
+        model_dict['ensemble_combiner'] = build_combiner(model_dict, ENSEMBLE_COMBINER)
+        # Identifies this load of the artifact and how it is combined, across processes
+        # too (cache keys use it)
+        model_dict['artifact_version'] = (f"{os.path.basename(path)}:{mtime}:"
+                                          f"{model_dict['ensemble_combiner'].name}")
+        
+        if instrumentation is not None:
+            instrumentation.inc('predictor_model_loads_total', artifact=os.path.basename(path))
+            instrumentation.observe('predictor_model_load_seconds', time.perf_counter() - start,
+                                    artifact=os.path.basename(path))
+        
+        _model_cache[path] = (mtime, model_dict)
+        return model_dict
+
+
+def shared_bundle(path, shared_dir):
+    """
+    Bundle converted from a legacy pickle under shared_dir, written by the first
+    worker on the node to need it
+    
+    The bundle is named after the pickle's mtime and size, so a replaced pickle
+    is converted again; earlier conversions are removed (workers still mapping
+    their files keep them until they reload).
+    """
+    import fcntl
+    
+    stat = os.stat(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    target = os.path.join(shared_dir, f"{name}-{stat.st_mtime_ns}-{stat.st_size}")
+    if os.path.exists(os.path.join(target, MANIFEST_NAME)):
+        return target
+    
+    os.makedirs(shared_dir, exist_ok=True)
+    with open(os.path.join(shared_dir, name + '.lock'), 'w') as lock:
+        # Other workers wait here and then find the finished bundle
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(os.path.join(target, MANIFEST_NAME)):
+            import pickle
+            import shutil
+            from artifact_bundle import save_bundle
+            
+            with open(path, 'rb') as f:
+                model_dict = pickle.load(f)
+            save_bundle(model_dict, target)
+            for entry in os.listdir(shared_dir):
+                stale = os.path.join(shared_dir, entry)
+                if entry.startswith(name + '-') and stale != target and os.path.isdir(stale):
+                    shutil.rmtree(stale, ignore_errors=True)
+    return target
+
+
+def warm_up(condition_types=None, instrumentation=None):
+    """
+    Load model artifacts ahead of the first request
+    
+    Args:
+        condition_types: Conditions to load, or None for all of them
+        instrumentation: Optional Instrumentation to count the loads
+        
+    Returns:
+        Dictionary mapping each condition that failed to load to its error message
+    """
+    errors = {}
+    for condition_type in condition_types or MODEL_PATHS:
+        try:
+            load_artifact(artifact_path(condition_type), instrumentation)
+        except Exception as e:
+            errors[condition_type] = str(e)
+    return errors
+
 
 class DualConditionPredictor:
-    def __init__(self):
+    def __init__(self, instrumentation=None, cache=None, member_threads=0, prediction_log=None):
+        # Optional Instrumentation; when None no timing or counting is done
+        self.instrumentation = instrumentation
+        # Optional ResultCache for single-record predictions
+        self.cache = cache
+        # Optional PredictionLog that worker requests made for a user are written to
+        self.prediction_log = prediction_log
+        # Smoothed seconds per call of each member, (condition, name) -> seconds; used
+        # to skip members that would not fit in a latency budget
+        self.member_seconds = {}
+        # Threads that run members concurrently when a call has a deadline; with
+        # none, members run one after another and a slow one cannot be cut short
+        self.member_pool = ThreadPoolExecutor(max_workers=member_threads) if member_threads > 0 else None
+        # Runs the two conditions of a differential diagnosis side by side
+        self.condition_pool = ThreadPoolExecutor(max_workers=len(MODEL_PATHS))
         self.models = {
             'heart_disease': None,
             'gastric_cancer': None
         }
         self.required_fields = {
             'heart_disease': {
-                'Age': (int, float, lambda x: 0 <= x <= 120),
-                'Sex': (str, lambda x: x in ['M', 'F']),
-                'ChestPainType': (str, lambda x: x in ['ATA', 'NAP', 'ASY', 'TA']),
-                'RestingBP': (int, float, lambda x: 0 <= x <= 300),
-                'Cholesterol': (int, float, lambda x: 0 <= x <= 1000),
-                'FastingBS': (int, str, lambda x: str(x) in ['0', '1']),
-                'RestingECG': (str, lambda x: x in ['Normal', 'ST', 'LVH']),
-                'MaxHR': (int, float, lambda x: 0 <= x <= 300),
-                'ExerciseAngina': (str, lambda x: x in ['Y', 'N']),
-                'Oldpeak': (float, lambda x: -10 <= x <= 10),
-                'ST_Slope': (str, lambda x: x in ['Up', 'Flat', 'Down'])
+                'Age': NumberField(0, 120),
+                'Sex': ChoiceField(['M', 'F']),
+                'ChestPainType': ChoiceField(['ATA', 'NAP', 'ASY', 'TA']),
+                'RestingBP': NumberField(0, 300),
+                'Cholesterol': NumberField(0, 1000),
+                'FastingBS': NumberField(0, 1),
+                'RestingECG': ChoiceField(['Normal', 'ST', 'LVH']),
+                'MaxHR': NumberField(0, 300),
+                'ExerciseAngina': ChoiceField(['Y', 'N']),
+                'Oldpeak': NumberField(-10, 10, integer_first=False),
+                'ST_Slope': ChoiceField(['Up', 'Flat', 'Down'])
             },
             'gastric_cancer': None  # Will be populated after loading the model
         }
         
+        # Validators compiled from required_fields, rebuilt whenever an artifact (re)loads
+        self.validators = {
+            'heart_disease': None,
+            'gastric_cancer': None
+        }
+        
         # List of key gastric cancer fields that user will provide
         self.key_gastric_fields = [
             'age', 'gender', 'alcohol_consumption', 'ct_scan', 
@@ -63,281 +256,540 @@ class DualConditionPredictor:
             'endoscopic_images': 'Available'
         }
     
-    def load_models(self):
-        """Load both the heart disease and gastric cancer models"""
+    def get_model(self, condition_type):
+        """Return the model for one condition, loading it through the shared cache on first use"""
         try:
-            # Load heart disease model
-            heart_model_path = os.path.join(os.path.dirname(__file__), 'heart_disease_ensemble.pkl')
-            with open(heart_model_path, 'rb') as f:
-                self.models['heart_disease'] = pickle.load(f)
-                
-            # Load gastric cancer model
-            gastric_model_path = os.path.join(os.path.dirname(__file__), 'gastric_cancer_ensemble.pkl')
-            with open(gastric_model_path, 'rb') as f:
-                gastric_model = pickle.load(f)
-                self.models['gastric_cancer'] = gastric_model
-                
+            model_dict = load_artifact(artifact_path(condition_type), self.instrumentation)
+        except Exception as e:
+            raise Exception(f"Failed to load {condition_type} model: {str(e)}")
+        
+        if self.models[condition_type] is not model_dict:
+            if self.models[condition_type] is not None and self.cache is not None:
+                # A new artifact was loaded: results from the old one must not be served
+                self.cache.invalidate(condition_type)
+            self.models[condition_type] = model_dict
+            
+            if condition_type == 'gastric_cancer':
                 # Set gastric cancer required fields based on features in the model
                 self.required_fields['gastric_cancer'] = {
-                    field: (int, float, str) for field in gastric_model['feature_names']
+                    field: (int, float, str) for field in model_dict['feature_names']
                 }
-                
+                self.validators[condition_type] = DefaultFillSchema(model_dict['feature_names'], self.gastric_default)
+                if model_dict['feature_encoder'].sparse:
+                    # Defaults are encoded once; requests only encode the fields they set
+                    model_dict['feature_encoder'].set_defaults(self.validators[condition_type].default_row)
+            else:
+                self.validators[condition_type] = FieldSchema(self.required_fields[condition_type])
+        
+        return model_dict
+    
+    def load_models(self):
+        """Load both the heart disease and gastric cancer models"""
+        try:
+            for condition_type in MODEL_PATHS:
+                self.get_model(condition_type)
             return True
         except Exception as e:
             raise Exception(f"Failed to load models: {str(e)}")
     
     def validate_input(self, data, condition_type):
-        """Validate input data against required fields for the specific condition"""
+        """Validate input data against required fields for the specific condition, returning a new dictionary"""
         if condition_type not in self.models:
             raise ValueError(f"Invalid condition type: {condition_type}. Must be 'heart_disease' or 'gastric_cancer'")
         
-        if not self.models[condition_type]:
-            self.load_models()
-            
-        required_fields = self.required_fields[condition_type]
+        self.get_model(condition_type)
         
-        # Handle gastric cancer input more flexibly
-        if condition_type == 'gastric_cancer':
-            # Fix capitalization issues - if 'age' exists but 'Age' is required, use the lowercase version
-            normalized_data = {}
-            field_map = {}
-            
-            # Create a case-insensitive mapping of field names
-            for field in data:
-                field_map[field.lower()] = field
-            
-            # Try to map all required fields using case-insensitive matching
-            for required_field in required_fields:
-                if required_field in data:
-                    normalized_data[required_field] = data[required_field]
-                elif required_field.lower() in field_map:
-                    normalized_data[required_field] = data[field_map[required_field.lower()]]
-                else:
-                    # For fields not in the key fields list, use our default values
-                    if required_field.lower() in self.other_gastric_defaults:
-                        normalized_data[required_field] = self.other_gastric_defaults[required_field.lower()]
-                    # For missing fields, provide generic default values
-                    elif isinstance(required_field, str) and ('mirna' in required_field.lower() or 'target' in required_field.lower()):
-                        normalized_data[required_field] = "unknown"
-                    elif 'sum' in required_field.lower():
-                        normalized_data[required_field] = 0
-                    elif required_field.lower() in ['true', 'false']:
-                        normalized_data[required_field] = False
-                    else:
-                        normalized_data[required_field] = 0
-            
-            # Add any fields that might be needed but weren't in required_fields
-            for field in self.models[condition_type]['feature_names']:
-                if field not in normalized_data:
-                    if field in data:
-                        normalized_data[field] = data[field]
-                    elif field.lower() in field_map:
-                        normalized_data[field] = data[field_map[field.lower()]]
-                    else:
-                        # Use our comprehensive defaults for other fields
-                        if field.lower() in self.other_gastric_defaults:
-                            normalized_data[field] = self.other_gastric_defaults[field.lower()]
-                        # Default values for missing fields
-                        elif isinstance(field, str) and ('mirna' in field.lower() or 'target' in field.lower()):
-                            normalized_data[field] = "unknown"
-                        elif 'sum' in field.lower():
-                            normalized_data[field] = 0
-                        elif field.lower() in ['true', 'false']:
-                            normalized_data[field] = False
-                        else:
-                            normalized_data[field] = 0
-                            
-            return normalized_data
-            
-        # For heart disease, we have specific validation rules
-        for field, validators in required_fields.items():
-            if field not in data:
-                raise ValueError(f"Missing required field: {field}")
-            
-            value = data[field]
-            valid = False
-            
-            for validator in validators:
-                if isinstance(validator, type):
-                    try:
-                        data[field] = validator(value)
-                        valid = True
-                        break
-                    except:
-                        continue
-                elif callable(validator):
-                    try:
-                        if validator(value):
-                            valid = True
-                            break
-                    except:
-                        continue
-            
-            if not valid:
-                raise ValueError(f"Invalid value for {field}: {value}")
-
-        return data
+        # Heart disease checks each field's type and range; gastric cancer maps field
+        # names case-insensitively and fills the rest with defaults
+        return self.validators[condition_type].validate(data)
     
+    def gastric_default(self, field):
+        """Default value for a gastric cancer feature the caller did not provide"""
+        if field.lower() in self.other_gastric_defaults:
+            return self.other_gastric_defaults[field.lower()]
+        # Otherwise use generic defaults
+        elif 'mirna' in field.lower() or 'target' in field.lower():
+            return "unknown"
+        elif 'sum' in field.lower():
+            return 0
+        elif field.lower() in ['true', 'false']:
+            return False
+        return 0
+
     def prepare_input(self, data, condition_type):
-        """Prepare input data for prediction for the specific condition"""
+        """Prepare one record (dict) or a batch (list of dicts) as a scaled feature matrix (CSR when sparse)"""
         model_dict = self.models[condition_type]
+        records = data if isinstance(data, list) else [data]
         
-        # Convert to DataFrame
-        input_df = pd.DataFrame([data])
+        # Artifacts trained without centring are served as CSR rows; missing fields
+        # take the encoder's pre-encoded defaults
+        if model_dict['feature_encoder'].sparse:
+            return model_dict['feature_encoder'].transform_sparse(records)
         
-        # For gastric cancer, handle missing values the same way as in training
+        # For gastric cancer, make sure every model feature has a value
         if condition_type == 'gastric_cancer':
-            # Handle feature preparation specifically for gastric cancer
-            try:
-                # First, ensure we have all the required columns
-                for col in model_dict['feature_names']:
-                    if col not in input_df.columns:
-                        # Add missing columns with default values from our defaults dictionary
-                        if col.lower() in self.other_gastric_defaults:
-                            input_df[col] = self.other_gastric_defaults[col.lower()]
-                        # Otherwise use generic defaults
-                        elif isinstance(col, str) and ('mirna' in col.lower() or 'target' in col.lower()):
-                            input_df[col] = "unknown"
-                        elif 'sum' in str(col).lower():
-                            input_df[col] = 0
-                        elif str(col).lower() in ['true', 'false']:
-                            input_df[col] = False
-                        else:
-                            input_df[col] = 0
-                
-                # Remove any extra columns not needed by the model
-                for col in input_df.columns:
-                    if col not in model_dict['feature_names']:
-                        input_df = input_df.drop(col, axis=1)
-            except Exception as e:
-                print(f"Error in gastric cancer preparation: {str(e)}")
-                raise
+            records = [
+                {col: record[col] if col in record else self.gastric_default(col) for col in model_dict['feature_names']}
+                for record in records
+            ]
         
-        # Convert categorical variables to dummy variables
-        try:
-            input_encoded = pd.get_dummies(input_df, drop_first=True)
-            
-            # Ensure all encoded features are present
-            for col in model_dict['encoded_feature_names']:
-                if col not in input_encoded.columns:
-                    input_encoded[col] = 0
-                    
-            # Reorder columns to match training data
-            input_encoded = input_encoded[model_dict['encoded_feature_names']]
-            
-            # Scale the features
-            input_scaled = model_dict['scaler'].transform(input_encoded)
-            
-            return input_scaled
-        except Exception as e:
-            print(f"Error encoding/scaling: {str(e)}")
-            raise
+        # One-hot encode and scale straight into a float64 matrix
+        return model_dict['feature_encoder'].transform(records)
     
-    def predict(self, input_data, condition_type=None):
+    def predict(self, input_data, condition_type=None, include_timings=False, latency_budget=None):
         """
         Make predictions using the ensemble of models
         
         Args:
             input_data: Dictionary with input features
-            condition_type: 'heart_disease', 'gastric_cancer', or None (for differential diagnosis)
+            condition_type: 'heart_disease', 'gastric_cancer', or None / 'differential' (differential diagnosis)
+            include_timings: Add a 'timings' block (milliseconds per stage and model)
+            latency_budget: Seconds the call may take (its deadline). Members expected
+                to overrun it are skipped and reported as {'skipped': 'latency_budget'};
+                with a member pool, members still running at the deadline are
+                reported as {'timed_out': True}. The ensemble uses the rest
             
         Returns:
             Dictionary with predictions for each model and ensemble
         """
-        # Load models if not already loaded
-        if not all(self.models.values()):
-            self.load_models()
+        deadline = time.perf_counter() + latency_budget if latency_budget is not None else None
         
         # If condition_type is not specified, perform differential diagnosis
-        if condition_type is None:
-            results = {}
-            # Try to predict with both models if possible
-            try:
-                heart_preds = self.predict(input_data, 'heart_disease')
-                results['heart_disease'] = heart_preds
-            except Exception as e:
-                results['heart_disease'] = {'error': str(e)}
-                
-            try:
-                gastric_preds = self.predict(input_data, 'gastric_cancer')
-                results['gastric_cancer'] = gastric_preds
-            except Exception as e:
-                results['gastric_cancer'] = {'error': str(e)}
-                
-            # Determine the most likely condition
-            if 'error' not in results['heart_disease'] and 'error' not in results['gastric_cancer']:
-                heart_prob = results['heart_disease']['ensemble']['probability']
-                gastric_prob = results['gastric_cancer']['ensemble']['probability']
-                
-                if heart_prob > gastric_prob:
-                    results['differential_diagnosis'] = {
-                        'most_likely_condition': 'heart_disease',
-                        'confidence': float(heart_prob / (heart_prob + gastric_prob)) if (heart_prob + gastric_prob) > 0 else 0.5
-                    }
-                else:
-                    results['differential_diagnosis'] = {
-                        'most_likely_condition': 'gastric_cancer',
-                        'confidence': float(gastric_prob / (heart_prob + gastric_prob)) if (heart_prob + gastric_prob) > 0 else 0.5
-                    }
-                    
+        if condition_type is None or condition_type == 'differential':
+            timings = {} if include_timings else None
+            results = self.predict_differential([input_data], timings, latency_budget)[0]
+            if include_timings:
+                results['timings'] = format_timings(timings)
             return results
         
-        # Validate input for the specific condition
+        if not include_timings and self.instrumentation is None:
+            # Validate input for the specific condition
+            validated_data = self.validate_input(input_data, condition_type)
+            
+            key = self.cache_key(validated_data, condition_type) if self.cache is not None else None
+            if key is not None:
+                cached = self.cache.get(key, condition_type)
+                if cached is not None:
+                    return cached
+            
+            # Prepare input for prediction
+            input_scaled = self.prepare_input(validated_data, condition_type)
+            
+            predictions = self.score(input_scaled, condition_type, deadline=deadline)[0]
+            if key is not None and is_complete(predictions):
+                self.cache.put(key, condition_type, predictions)
+            return predictions
+        
+        # Same steps, timed
+        timings = {}
+        start = time.perf_counter()
         validated_data = self.validate_input(input_data, condition_type)
+        mark = time.perf_counter()
+        timings['validate_input'] = mark - start
+        
+        key = self.cache_key(validated_data, condition_type) if self.cache is not None else None
+        predictions = self.cache.get(key, condition_type) if key is not None else None
+        if predictions is not None:
+            timings['cache'] = time.perf_counter() - mark
+        else:
+            mark = time.perf_counter()
+            input_scaled = self.prepare_input(validated_data, condition_type)
+            timings['prepare_input'] = time.perf_counter() - mark
+            
+            predictions = self.score(input_scaled, condition_type, timings, deadline)[0]
+            if key is not None and is_complete(predictions):
+                self.cache.put(key, condition_type, predictions)
+        timings['total'] = time.perf_counter() - start
+        
+        self.record_timings(timings, condition_type, rows=1)
+        if include_timings:
+            predictions['timings'] = format_timings(timings)
+        return predictions
+
+    def predict_differential(self, records, timings=None, latency_budget=None):
+        """
+        Score records for both conditions at once and compare them
+        
+        The fields both conditions share are normalised once per record and
+        written under each condition's own names; the two conditions then run
+        concurrently as batches. A condition whose artifact is missing or fails
+        reports {'error': message} in its place while the other is still
+        scored; 'differential_diagnosis' needs both.
+        
+        Args:
+            records: List of dictionaries with input features
+            timings: Optional dictionary to fill with each condition's stage timings
+            latency_budget: Seconds the call may take; see predict()
+            
+        Returns:
+            List aligned with records of {'heart_disease': ..., 'gastric_cancer': ...,
+            'differential_diagnosis': ...}
+        """
+        condition_records = {condition_type: [] for condition_type in MODEL_PATHS}
+        for record in records:
+            shared = shared_fields(record)
+            for condition_type, rows in condition_records.items():
+                rows.append(condition_record(record, shared, condition_type))
+        
+        def run(condition_type):
+            condition_timings = {} if timings is not None else None
+            try:
+                results = self.predict_batch(condition_records[condition_type], condition_type,
+                                             condition_timings, latency_budget, use_cache=True)
+            except Exception as e:
+                results = [{'error': str(e)} for _ in records]
+            return results, condition_timings
         
-        # Prepare input for prediction
-        input_scaled = self.prepare_input(validated_data, condition_type)
+        futures = {condition_type: self.condition_pool.submit(run, condition_type) for condition_type in MODEL_PATHS}
+        by_condition = {}
+        for condition_type, future in futures.items():
+            by_condition[condition_type], condition_timings = future.result()
+            if timings is not None and condition_timings:
+                timings[condition_type] = condition_timings
         
-        # Make predictions with each model
-        predictions = {}
+        results = []
+        for row in range(len(records)):
+            result = {condition_type: by_condition[condition_type][row] for condition_type in MODEL_PATHS}
+            diagnosis = differential_diagnosis(result['heart_disease'], result['gastric_cancer'])
+            if diagnosis is not None:
+                result['differential_diagnosis'] = diagnosis
+            results.append(result)
+        return results
+
+    def cache_key(self, validated_data, condition_type):
+        """Result cache key: the encoded (unscaled) feature row, condition and artifact version"""
         model_dict = self.models[condition_type]
+        encoder = model_dict['feature_encoder']
+        encoded = encoder.encode_sparse([validated_data]) if encoder.sparse else encoder.encode([validated_data])
+        return cache_key(condition_type, model_dict['artifact_version'], encoded)
+
+    def record_timings(self, timings, condition_type, rows):
+        """Feed one request's stage and model timings into the instrumentation"""
+        if self.instrumentation is None:
+            return
+        self.instrumentation.inc('predictor_requests_total', condition=condition_type)
+        self.instrumentation.inc('predictor_rows_total', rows, condition=condition_type)
+        for stage, seconds in timings.items():
+            if stage == 'models':
+                for name, model_seconds in seconds.items():
+                    self.instrumentation.observe('predictor_model_seconds', model_seconds,
+                                                 condition=condition_type, model=name)
+            else:
+                self.instrumentation.observe('predictor_stage_seconds', seconds,
+                                             condition=condition_type, stage=stage)
+
+    def run_member(self, model, input_scaled):
+        """Labels and positive-class probabilities (None without predict_proba) of one member"""
+        input_scaled = member_input(model, input_scaled)
+        # Check if model has predict_proba method
+        if hasattr(model, 'predict_proba'):
+            proba = model.predict_proba(input_scaled)
+            labels = model.classes_[np.argmax(proba, axis=1)]
+            return labels, np.where(labels == 1, proba[:, 1], 1 - proba[:, 0])
+        # For models without predict_proba
+        return np.asarray(model.predict(input_scaled)), None
+
+    def timed_member(self, condition_type, name, model, input_scaled):
+        """run_member, folding the call's duration into the member's smoothed latency"""
+        start = time.perf_counter()
+        try:
+            return self.run_member(model, input_scaled)
+        finally:
+            seconds = time.perf_counter() - start
+            previous = self.member_seconds.get((condition_type, name))
+            self.member_seconds[(condition_type, name)] = (
+                seconds if previous is None else 0.8 * previous + 0.2 * seconds
+            )
+
+    def run_members(self, model_dict, members, skipped, input_scaled, condition_type, deadline=None):
+        """
+        Run members one after another
         
-        for name, model in model_dict['models'].items():
+        Returns:
+            name -> (status, value, seconds): status 'ok' with (labels, probabilities),
+            'error' / 'skipped' / 'timed_out' with the member's response entry
+        """
+        runs = {}
+        for name in members:
+            if name in skipped:
+                runs[name] = ('skipped', {'skipped': 'latency_budget'}, None)
+                continue
+            # Later members that would start after the deadline are skipped too
+            if deadline is not None and time.perf_counter() > deadline and any(
+                    run[0] == 'ok' for run in runs.values()):
+                runs[name] = ('skipped', {'skipped': 'latency_budget'}, None)
+                continue
+            start = time.perf_counter()
             try:
-                # Check if model has predict_proba method
-                if hasattr(model, 'predict_proba'):
-                    # Get prediction and probability
-                    pred = model.predict(input_scaled)[0]
-                    prob = model.predict_proba(input_scaled)[0][1] if pred == 1 else 1 - model.predict_proba(input_scaled)[0][0]
-                    
-                    # Get model accuracy from saved performance metrics
-                    model_accuracy = model_dict['model_performance'][name]['test_score']
-                    
-                    predictions[name] = {
-                        'prediction': int(pred),
-                        'probability': float(prob),
-                        'model_accuracy': float(model_accuracy)
-                    }
-                else:
-                    # For models without predict_proba
-                    pred = model.predict(input_scaled)[0]
-                    
-                    # Get model accuracy from saved performance metrics
-                    model_accuracy = model_dict['model_performance'][name]['test_score']
-                    
-                    predictions[name] = {
-                        'prediction': int(pred),
-                        'probability': None,
-                        'model_accuracy': float(model_accuracy)
-                    }
+                result = self.timed_member(condition_type, name, model_dict['models'][name], input_scaled)
+                runs[name] = ('ok', result, time.perf_counter() - start)
             except Exception as e:
-                predictions[name] = {'error': str(e)}
-        
-        # Calculate ensemble prediction
-        valid_preds = [p for p in predictions.values() if 'error' not in p and p['probability'] is not None]
-        if valid_preds:
-            ensemble_pred = np.round(np.mean([pred['prediction'] for pred in valid_preds]))
-            ensemble_prob = np.mean([pred['probability'] for pred in valid_preds])
-            ensemble_accuracy = np.mean([pred['model_accuracy'] for pred in valid_preds])
+                runs[name] = ('error', {'error': str(e)}, time.perf_counter() - start)
+        return runs
+
+    def run_members_concurrently(self, model_dict, members, skipped, input_scaled, condition_type, deadline):
+        """
+        Run members in the member pool and collect those done by the deadline
+        
+        Members still running at the deadline are reported as timed out; they
+        finish in the background and their duration still updates the latency
+        estimate. Returns the same mapping as run_members.
+        """
+        start = time.perf_counter()
+        futures = {}
+        for name in members:
+            if name in skipped:
+                continue
+            futures[name] = self.member_pool.submit(self.timed_member, condition_type, name,
+                                                    model_dict['models'][name], input_scaled)
+        
+        wait(list(futures.values()), timeout=max(0.0, deadline - time.perf_counter()))
+        
+        runs = {}
+        for name in members:
+            if name in skipped:
+                runs[name] = ('skipped', {'skipped': 'latency_budget'}, None)
+                continue
+            future = futures[name]
+            if not future.done():
+                # Drops members still queued; one already running cannot be interrupted
+                future.cancel()
+                runs[name] = ('timed_out', {'timed_out': True}, time.perf_counter() - start)
+            elif future.exception() is not None:
+                runs[name] = ('error', {'error': str(future.exception())}, time.perf_counter() - start)
+            else:
+                runs[name] = ('ok', future.result(), time.perf_counter() - start)
+        return runs
+
+    def score(self, input_scaled, condition_type, timings=None, deadline=None):
+        """
+        Run the models over a scaled feature matrix and build per-row predictions
+        
+        Args:
+            deadline: time.perf_counter() value to finish by. A member expected to
+                run past it is skipped (as long as another is expected to finish);
+                with a member pool the rest run concurrently and any still running
+                at the deadline are reported as timed out
+        """
+        model_dict = self.models[condition_type]
+        combiner = model_dict['ensemble_combiner']
+        n_rows = input_scaled.shape[0]
+        
+        # Members expected to overrun the deadline are not started
+        skipped = set()
+        if deadline is not None:
+            remaining = deadline - time.perf_counter()
+            expected = {name: self.member_seconds.get((condition_type, name)) for name in combiner.members}
+            if any(seconds is None or seconds <= remaining for seconds in expected.values()):
+                skipped = {name for name, seconds in expected.items() if seconds is not None and seconds > remaining}
+        
+        if deadline is not None and self.member_pool is not None:
+            runs = self.run_members_concurrently(model_dict, combiner.members, skipped, input_scaled,
+                                                 condition_type, deadline)
+        else:
+            runs = self.run_members(model_dict, combiner.members, skipped, input_scaled, condition_type, deadline)
+        
+        # One pass per model; labels come from the probabilities instead of a second predict()
+        outputs = []
+        # Member probabilities and labels as (rows x members), for the combiner
+        member_probs = np.zeros((n_rows, len(combiner.members)))
+        member_labels = np.zeros((n_rows, len(combiner.members)))
+        available = np.zeros(len(combiner.members), dtype=bool)
+        model_timings = timings.setdefault('models', {}) if timings is not None else None
+        for column, name in enumerate(combiner.members):
+            status, value, seconds = runs[name]
+            if model_timings is not None and seconds is not None:
+                model_timings[name] = seconds
+            if status != 'ok':
+                outputs.append((name, value, None, None))
+                if self.instrumentation is not None and status in ('skipped', 'timed_out'):
+                    metric = 'predictor_model_skipped_total' if status == 'skipped' else 'predictor_model_timeouts_total'
+                    self.instrumentation.inc(metric, condition=condition_type, model=name)
+                continue
+            
+            labels, probs = value
+            # Get model accuracy from saved performance metrics, cross-validated when available
+            model_accuracy = member_accuracy(model_dict['model_performance'][name])
+            if probs is not None:
+                member_probs[:, column] = probs
+                member_labels[:, column] = labels
+                available[column] = True
+            outputs.append((name, labels.tolist(), None if probs is None else probs.tolist(), model_accuracy))
+        
+        # Combine every member's output for all rows at once
+        ensemble = None
+        if available.any():
+            ensemble_pred, ensemble_prob, ensemble_accuracy, combined_by = combiner.combine(
+                member_probs, member_labels, available
+            )
+            contributing = [name for name, used in zip(combiner.members, available) if used]
+            ensemble = (ensemble_pred.tolist(), ensemble_prob.tolist(), ensemble_accuracy, combined_by, contributing)
+        
+        results = []
+        for row in range(n_rows):
+            predictions = {}
+            for name, labels, probs, model_accuracy in outputs:
+                if isinstance(labels, dict):
+                    predictions[name] = labels
+                    continue
+                predictions[name] = {
+                    'prediction': int(labels[row]),
+                    'probability': probs[row] if probs is not None else None,
+                    'model_accuracy': model_accuracy
+                }
             
             # Add ensemble results
-            predictions['ensemble'] = {
-                'prediction': int(ensemble_pred),
-                'probability': float(ensemble_prob),
-                'model_accuracy': float(ensemble_accuracy)
-            }
+            if ensemble is not None:
+                predictions['ensemble'] = {
+                    'prediction': ensemble[0][row],
+                    'probability': ensemble[1][row],
+                    'model_accuracy': ensemble[2],
+                    'combiner': ensemble[3],
+                    'contributing_members': ensemble[4]
+                }
+            results.append(predictions)
         
-        return predictions
+        return results
+
+    def predict_batch(self, records, condition_type, timings=None, latency_budget=None, use_cache=False):
+        """
+        Score many records for one condition in a single pass over the models
+        
+        Args:
+            records: List of dictionaries with input features
+            condition_type: 'heart_disease', 'gastric_cancer', or None / 'differential'
+                (see predict_differential)
+            timings: Optional dictionary to fill with stage and model durations in seconds
+            latency_budget: Seconds the call may take; see predict()
+            use_cache: Look records up in (and add them to) the result cache, as
+                predict() does; used for micro-batches of single-record requests
+            
+        Returns:
+            List aligned with records; each entry is the prediction dictionary for
+            that record, or {'error': message} if the record failed validation
+        """
+        if condition_type is None or condition_type == 'differential':
+            return self.predict_differential(records, timings, latency_budget)
+        if condition_type not in self.models:
+            raise ValueError(f"Invalid condition type: {condition_type}. Must be 'heart_disease' or 'gastric_cancer'")
+        
+        # A missing artifact fails the whole batch rather than every row
+        self.get_model(condition_type)
+        
+        if timings is None and self.instrumentation is not None:
+            timings = {}
+        start = time.perf_counter()
+        deadline = start + latency_budget if latency_budget is not None else None
+        
+        results = [None] * len(records)
+        
+        # Validate every record column by column, keeping failures per row
+        validated, errors = self.validators[condition_type].validate_batch(records)
+        valid_rows = []
+        valid_index = []
+        for i, (row, error) in enumerate(zip(validated, errors)):
+            if error is not None:
+                results[i] = {'error': error}
+            else:
+                valid_rows.append(row)
+                valid_index.append(i)
+        
+        if timings is not None:
+            mark = time.perf_counter()
+            timings['validate_input'] = mark - start
+        
+        keys = None
+        if use_cache and self.cache is not None and valid_rows:
+            pending_rows, pending_index, keys = [], [], []
+            for i, row in zip(valid_index, valid_rows):
+                key = self.cache_key(row, condition_type)
+                cached = self.cache.get(key, condition_type)
+                if cached is not None:
+                    results[i] = cached
+                else:
+                    pending_rows.append(row)
+                    pending_index.append(i)
+                    keys.append(key)
+            valid_rows, valid_index = pending_rows, pending_index
+            if timings is not None:
+                timings['cache'] = time.perf_counter() - mark
+                mark = time.perf_counter()
+        
+        if valid_rows:
+            input_scaled = self.prepare_input(valid_rows, condition_type)
+            if timings is not None:
+                timings['prepare_input'] = time.perf_counter() - mark
+            for row, (i, row_predictions) in enumerate(
+                    zip(valid_index, self.score(input_scaled, condition_type, timings, deadline))):
+                results[i] = row_predictions
+                if keys is not None and is_complete(row_predictions):
+                    self.cache.put(keys[row], condition_type, row_predictions)
+        
+        if timings is not None:
+            timings['total'] = time.perf_counter() - start
+            self.record_timings(timings, condition_type, rows=len(records))
+        
+        return results
+
+
+def shared_fields(record):
+    """The record's shared patient fields under their canonical names and codings"""
+    shared = {}
+    if not isinstance(record, dict):
+        return shared
+    for key, value in record.items():
+        canonical = SHARED_ALIASES.get(key.lower()) if isinstance(key, str) else None
+        if canonical is None or canonical in shared:
+            continue
+        if canonical == 'sex':
+            value = SEX_VALUES.get(str(value).strip().lower(), value)
+        shared[canonical] = value
+    return shared
+
+
+def condition_record(record, shared, condition_type):
+    """The record with shared fields the caller did not give for this condition filled in"""
+    if not isinstance(record, dict):
+        return record
+    record = dict(record)
+    for canonical, value in shared.items():
+        field, coding = SHARED_FIELDS[canonical][condition_type]
+        if field not in record:
+            record[field] = coding.get(value, value) if coding else value
+    return record
+
+
+def differential_diagnosis(heart_preds, gastric_preds):
+    """Most likely condition from both ensembles, or None unless both were scored"""
+    if 'ensemble' not in heart_preds or 'ensemble' not in gastric_preds:
+        return None
+    heart_prob = heart_preds['ensemble']['probability']
+    gastric_prob = gastric_preds['ensemble']['probability']
+    total = heart_prob + gastric_prob
+    if heart_prob > gastric_prob:
+        return {
+            'most_likely_condition': 'heart_disease',
+            'confidence': float(heart_prob / total) if total > 0 else 0.5
+        }
+    return {
+        'most_likely_condition': 'gastric_cancer',
+        'confidence': float(gastric_prob / total) if total > 0 else 0.5
+    }
+
+
+def is_complete(predictions):
+    """Whether no member was skipped or timed out (partial results are never cached)"""
+    return not any(isinstance(value, dict) and ('skipped' in value or 'timed_out' in value)
+                   for value in predictions.values())
+
+
+def format_timings(timings):
+    """Stage and model durations in milliseconds for a JSON response"""
+    # Nested blocks: per-model durations, and each condition's stages in differential mode
+    return {
+        stage: format_timings(value) if isinstance(value, dict) else value * 1000
+        for stage, value in timings.items()
+    }
 
 
 def predict(input_data, condition_type=None):
@@ -358,7 +810,416 @@ def predict(input_data, condition_type=None):
         return {'error': str(e)}
 
 
+def predict_batch(records, condition_type):
+    """
+    Score a list of records for one condition
+    
+    Args:
+        records: List of dictionaries with input features
+        condition_type: 'heart_disease', 'gastric_cancer' or 'differential'
+        
+    Returns:
+        Dictionary with a 'results' list aligned with records
+    """
+    try:
+        predictor = DualConditionPredictor()
+        return {'results': predictor.predict_batch(records, condition_type)}
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def read_records(text):
+    """Parse a JSON array or newline-delimited JSON objects into a list of records"""
+    text = text.strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+# Request envelope fields that are never part of a bare patient record
+REQUEST_CONTROL_KEYS = ('id', 'op', 'condition_type', 'include_timings', 'latency_budget_ms', 'user_id')
+
+
+def handle_request(predictor, request):
+    """Serve one worker request and return the response envelope"""
+    request_id = request.get('id') if isinstance(request, dict) else None
+    try:
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object")
+
+        # Prometheus text for this worker's counters and histograms
+        if request.get('op') == 'metrics':
+            if predictor.instrumentation is None:
+                raise ValueError("Metrics are not enabled; start the worker with --metrics")
+            return {'id': request_id, 'result': {'metrics': predictor.instrumentation.to_prometheus()}}
+
+        # Result cache size and hit/miss/eviction counters
+        if request.get('op') == 'cache':
+            if predictor.cache is None:
+                raise ValueError("The result cache is not enabled; start the worker with --cache-size")
+            return {'id': request_id, 'result': {'cache': predictor.cache.info()}}
+
+        # One page of a user's logged predictions
+        if request.get('op') == 'history':
+            return {'id': request_id, 'result': prediction_history(predictor, request)}
+
+        include_timings = bool(request.get('include_timings'))
+        condition_type = request.get('condition_type')
+        latency_budget = request_latency_budget(request)
+
+        # Batch requests carry a list of records under 'records'
+        if 'records' in request:
+            if not isinstance(request['records'], list):
+                raise ValueError("'records' must be a list of patient records")
+            timings = {} if include_timings else None
+            results = predictor.predict_batch(request['records'], condition_type, timings, latency_budget)
+            log_predictions(predictor, request, request['records'], results)
+            result = {'results': results}
+            if include_timings:
+                result['timings'] = format_timings(timings)
+            return {'id': request_id, 'result': result}
+
+        record = request_record(request)
+        result = predictor.predict(record, condition_type, include_timings, latency_budget)
+        log_predictions(predictor, request, [record], [result])
+    except Exception as e:
+        result = {'error': str(e)}
+
+    return {'id': request_id, 'result': result}
+
+
+def request_latency_budget(request):
+    """A request's 'latency_budget_ms' in seconds, or None"""
+    latency_budget = request.get('latency_budget_ms')
+    if latency_budget is None:
+        return None
+    if isinstance(latency_budget, bool) or not isinstance(latency_budget, (int, float)) or latency_budget <= 0:
+        raise ValueError("'latency_budget_ms' must be a positive number")
+    return latency_budget / 1000
+
+
+def request_record(request):
+    """The patient record of a single-record request"""
+    # Requests carry the patient record under 'data'; bare records are accepted too
+    if 'data' in request:
+        return request['data']
+    return {k: v for k, v in request.items() if k not in REQUEST_CONTROL_KEYS}
+
+
+def log_predictions(predictor, request, records, results):
+    """Queue the successful results of a request made for a user on the prediction log"""
+    user_id = request.get('user_id')
+    if predictor.prediction_log is None or user_id is None:
+        return
+    condition_type = request.get('condition_type') or 'differential'
+    for record, result in zip(records, results):
+        if isinstance(result, dict) and 'error' not in result:
+            result = {k: v for k, v in result.items() if k != 'timings'}
+            predictor.prediction_log.append(user_id, condition_type, record, result)
+
+
+def prediction_history(predictor, request):
+    """A 'history' request's page of the user's logged predictions"""
+    if predictor.prediction_log is None:
+        raise ValueError("The prediction log is not enabled; start the worker with --log-dir")
+    if request.get('user_id') is None:
+        raise ValueError("'user_id' is required")
+    limit = request.get('limit', 50)
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0:
+        raise ValueError("'limit' must be a positive integer")
+    return predictor.prediction_log.history(request['user_id'], limit, request.get('cursor'),
+                                            bool(request.get('newest_first')))
+
+
+def is_batchable(request):
+    """Whether a request is a plain single-record prediction for one condition"""
+    return (isinstance(request, dict) and 'op' not in request and 'records' not in request
+            and not request.get('include_timings')
+            and request.get('condition_type') in ('heart_disease', 'gastric_cancer'))
+
+
+def serve_stream(predictor, instream, outstream):
+    """Answer newline-delimited JSON requests until the input stream closes"""
+    for line in instream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'id': None, 'result': {'error': f"Invalid JSON request: {str(e)}"}}
+        else:
+            response = handle_request(predictor, request)
+        outstream.write(json.dumps(response) + '\n')
+        outstream.flush()
+
+
+def serve_socket(predictor, socket_path):
+    """Answer newline-delimited JSON requests on a local Unix socket"""
+    import socketserver
+
+    class PredictionHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            reader = (line.decode('utf-8') for line in self.rfile)
+            writer = _SocketWriter(self.wfile)
+            serve_stream(predictor, reader, writer)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with socketserver.ThreadingUnixStreamServer(socket_path, PredictionHandler) as server:
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+async def answer_batched(predictor, batcher, executor, line):
+    """
+    Response to one request line in micro-batching mode
+
+    Single-record predictions are queued on the batcher; everything else runs
+    through handle_request in the executor.
+    """
+    import asyncio
+
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return {'id': None, 'result': {'error': f"Invalid JSON request: {str(e)}"}}
+    if not is_batchable(request):
+        return await asyncio.get_running_loop().run_in_executor(executor, handle_request, predictor, request)
+
+    try:
+        record = request_record(request)
+        result = await batcher.submit(request['condition_type'], record, request_latency_budget(request))
+        log_predictions(predictor, request, [record], [result])
+    except Exception as e:
+        result = {'error': str(e)}
+    return {'id': request.get('id'), 'result': result}
+
+
+async def serve_stream_batched(predictor, batcher, executor, instream, outstream):
+    """
+    Answer newline-delimited JSON requests, micro-batching concurrent predictions
+
+    Requests are answered as they complete, so responses can come back out of
+    order; callers match them by 'id'.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    pending = set()
+
+    def read_lines():
+        try:
+            for line in iter(instream.readline, ''):
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, '')
+        except RuntimeError:
+            # The loop closed while input was still coming in
+            pass
+
+    async def answer(line):
+        response = await answer_batched(predictor, batcher, executor, line)
+        outstream.write(json.dumps(response) + '\n')
+        outstream.flush()
+
+    # Lines are read on their own thread, which works for pipes, files and terminals alike;
+    # a daemon one, so a worker stopped while its input is still open can exit
+    threading.Thread(target=read_lines, name='request-reader', daemon=True).start()
+    while True:
+        line = await lines.get()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        task = asyncio.create_task(answer(line))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending)
+
+
+async def serve_socket_batched(predictor, batcher, executor, socket_path):
+    """Answer newline-delimited JSON requests on a Unix socket, micro-batching across connections"""
+    import asyncio
+
+    async def handle(reader, writer):
+        pending = set()
+
+        async def answer(line):
+            response = await answer_batched(predictor, batcher, executor, line)
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(answer(line.decode('utf-8')))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    # Batch requests can be large; the default 64 KiB line limit is too small
+    server = await asyncio.start_unix_server(handle, socket_path, limit=2 ** 26)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        os.unlink(socket_path)
+
+
+class _SocketWriter:
+    """Text adapter over a socket's binary write file"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf-8'))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def run_worker(socket_path=None, metrics=False, cache_size=0, cache_ttl=300.0, cache_db=None, member_threads=0,
+               micro_batch=False, batch_size=32, batch_wait=0.005, shared_dir=None, log_dir=None):
+    """
+    Load the predictor once and serve requests until shut down
+
+    With micro_batch, concurrent single-record requests are scored together in
+    batches of up to batch_size, waiting at most batch_wait seconds (see MicroBatcher).
+    shared_dir overrides PREDICTION_SHARED_DIR (see SHARED_ARTIFACT_DIR) and
+    log_dir PREDICTION_LOG_DIR (see PredictionLog).
+    """
+    global SHARED_ARTIFACT_DIR
+    if shared_dir:
+        SHARED_ARTIFACT_DIR = shared_dir
+    instrumentation = Instrumentation() if metrics else None
+    cache = None
+    if cache_size > 0:
+        backend = SqliteCacheBackend(cache_db) if cache_db else None
+        cache = ResultCache(max_entries=cache_size, ttl=cache_ttl, backend=backend, instrumentation=instrumentation)
+    
+    # Keep serving if a model is missing: requests for it report the load error
+    for condition_type, error in warm_up(instrumentation=instrumentation).items():
+        print(f"Worker could not preload {condition_type} model: {error}", file=sys.stderr)
+
+    prediction_log = None
+    log_dir = log_dir or PREDICTION_LOG_DIR
+    if log_dir:
+        from prediction_log import PredictionLog
+
+        retention = float(LOG_RETENTION_DAYS) * 86400 if LOG_RETENTION_DAYS else None
+        prediction_log = PredictionLog(log_dir, retention=retention, instrumentation=instrumentation)
+        # The Node pool stops workers with SIGTERM; exit through the finally below
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    predictor = DualConditionPredictor(instrumentation, cache, member_threads, prediction_log)
+    try:
+        serve(predictor, socket_path, micro_batch, batch_size, batch_wait)
+    finally:
+        # Write out the results still queued on the log
+        if prediction_log is not None:
+            prediction_log.close()
+
+
+def serve(predictor, socket_path=None, micro_batch=False, batch_size=32, batch_wait=0.005):
+    """Serve requests on stdin/stdout or socket_path, micro-batched or one at a time"""
+    instrumentation = predictor.instrumentation
+    if micro_batch:
+        import asyncio
+        from micro_batcher import MicroBatcher
+
+        # One thread scores batches (the models parallelise internally); control
+        # and multi-record requests get their own so they do not queue behind them
+        batch_executor = ThreadPoolExecutor(max_workers=1)
+        executor = ThreadPoolExecutor(max_workers=2)
+        batcher = MicroBatcher(
+            lambda condition_type, records, latency_budget: predictor.predict_batch(
+                records, condition_type, latency_budget=latency_budget, use_cache=True),
+            batch_size, batch_wait, instrumentation, batch_executor
+        )
+        if socket_path:
+            asyncio.run(serve_socket_batched(predictor, batcher, executor, socket_path))
+        else:
+            asyncio.run(serve_stream_batched(predictor, batcher, executor, sys.stdin, sys.stdout))
+        return
+
+    if socket_path:
+        serve_socket(predictor, socket_path)
+    else:
+        serve_stream(predictor, sys.stdin, sys.stdout)
+
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Heart disease / gastric cancer prediction")
+    parser.add_argument('--worker', action='store_true',
+                        help="Serve newline-delimited JSON requests instead of a single prediction")
+    parser.add_argument('--socket', default=None,
+                        help="Unix socket path to serve on in worker mode (default: stdin/stdout)")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Collect per-stage timings and counters in worker mode ({\"op\": \"metrics\"} returns them)")
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help="Cache up to N single-record results in worker mode (0 disables the cache)")
+    parser.add_argument('--cache-ttl', type=float, default=300.0,
+                        help="Seconds a cached result stays valid")
+    parser.add_argument('--cache-db', default=None,
+                        help="SQLite file shared by workers as a second cache level")
+    parser.add_argument('--member-threads', type=int, default=0,
+                        help="Threads running ensemble members concurrently for requests with a "
+                             "latency_budget_ms, so late members time out (0: run them in turn)")
+    parser.add_argument('--shared-dir', default=None,
+                        help="Convert legacy pickled artifacts once per node into bundles here (e.g. under "
+                             "/dev/shm) that all workers memory-map, instead of each unpickling a copy")
+    parser.add_argument('--log-dir', default=None,
+                        help="Append the results of requests carrying a user_id to a prediction log here "
+                             "in worker mode ({\"op\": \"history\"} pages through a user's)")
+    parser.add_argument('--micro-batch', action='store_true',
+                        help="Score concurrent single-record requests together in micro-batches in worker mode")
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help="Most requests in one micro-batch")
+    parser.add_argument('--batch-wait-ms', type=float, default=5.0,
+                        help="Longest a request waits for a micro-batch to fill; the wait adapts to the "
+                             "arrival rate and is zero when requests arrive further apart than this")
+    parser.add_argument('--batch', action='store_true',
+                        help="Read a JSON array or JSON lines of records from stdin and score them together")
+    parser.add_argument('--condition-type', default='heart_disease',
+                        choices=['heart_disease', 'gastric_cancer', 'differential'],
+                        help="Condition to score in batch mode")
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.socket, args.metrics, args.cache_size, args.cache_ttl, args.cache_db, args.member_threads,
+                   args.micro_batch, args.batch_size, args.batch_wait_ms / 1000, args.shared_dir, args.log_dir)
+        sys.exit(0)
+
+    if args.batch:
+        try:
+            records = read_records(sys.stdin.read())
+            predictions = predict_batch(records, args.condition_type)
+            print(json.dumps(predictions))
+            sys.exit(1 if 'error' in predictions else 0)
+        except ValueError as e:
+            print(json.dumps({'error': f"Invalid batch input: {str(e)}"}))
+            sys.exit(1)
+
     try:
         # Read input from stdin
         input_json = sys.stdin.read()
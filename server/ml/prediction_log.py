@@ -0,0 +1,666 @@
+import fcntl
+import hashlib
+import heapq
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+# Record header: payload length, CRC-32 of the payload
+RECORD_HEADER = struct.Struct('<II')
+# Index entry: user hash, record offset in the segment, timestamp
+INDEX_ENTRY = struct.Struct('<QQd')
+# The same entry as a NumPy record, for the sorted index of a sealed segment
+INDEX_DTYPE = np.dtype([('user', '<u8'), ('offset', '<u8'), ('timestamp', '<f8')])
+SORT_ORDER = ('user', 'timestamp', 'offset')
+
+STREAM_PREFIX = 'stream-'
+LOCK_NAME = 'writer.lock'
+COMPACT_LOCK_NAME = 'compact.lock'
+
+# Reused: json.dumps builds a new encoder per call whenever separators are given
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def user_hash(user_id):
+    """64-bit key of a user id in the segment indexes"""
+    return int.from_bytes(hashlib.blake2b(str(user_id).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def segment_name(seq, gen):
+    # The generation goes up each time compaction rewrites a segment
+    return f"{seq:010d}.{gen}"
+
+
+def list_segments(stream_dir):
+    """{seq: gen} of the newest complete generation of each segment in a stream"""
+    segments = {}
+    try:
+        names = os.listdir(stream_dir)
+    except FileNotFoundError:
+        return segments
+    for name in names:
+        if not name.endswith('.log'):
+            continue
+        try:
+            seq, gen = (int(part) for part in name[:-len('.log')].split('.'))
+        except ValueError:
+            continue
+        if gen >= segments.get(seq, -1):
+            segments[seq] = gen
+    return segments
+
+
+def read_records(path):
+    """
+    (offset, payload bytes) of every intact record in a segment file, in order
+
+    Stops at the first torn or corrupt record; returns the records and the
+    offset where the valid data ends.
+    """
+    records = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append((offset, payload))
+        offset = start + length
+    return records, offset
+
+
+def read_record(f, offset):
+    """Decode the record at offset of an open segment file"""
+    f.seek(offset)
+    header = f.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        raise ValueError(f"No record at offset {offset}")
+    length, crc = RECORD_HEADER.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        raise ValueError(f"Corrupt record at offset {offset}")
+    return json.loads(payload)
+
+
+def encode_record(entry):
+    payload = _encoder.encode(entry).encode('utf-8')
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def write_file(path, data):
+    """Write a file under a temporary name, fsync it and rename it into place"""
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def write_segment(stream_dir, seq, gen, entries):
+    """Write a complete sealed segment (log and sorted index) and make it visible atomically"""
+    base = os.path.join(stream_dir, segment_name(seq, gen))
+    log_data = bytearray()
+    index = np.empty(len(entries), dtype=INDEX_DTYPE)
+    for i, entry in enumerate(entries):
+        index[i] = (user_hash(entry['user_id']), len(log_data), entry['timestamp'])
+        log_data += encode_record(entry)
+    index.sort(order=SORT_ORDER)
+    # Readers only pick up segments by their .log file, so the index goes in first
+    write_file(base + '.sidx', index.tobytes())
+    write_file(base + '.log', bytes(log_data))
+
+
+def seal_index(stream_dir, seq, gen):
+    """
+    Replace a finished segment's append-order index with one sorted by user, then time
+
+    Readers binary-search the sorted index through a memory map, so sealed
+    segments cost them no memory per record.
+    """
+    base = os.path.join(stream_dir, segment_name(seq, gen))
+    try:
+        with open(base + '.idx', 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b''
+    index = np.frombuffer(data[:len(data) - len(data) % INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE).copy()
+    index.sort(order=SORT_ORDER)
+    write_file(base + '.sidx', index.tobytes())
+    try:
+        os.unlink(base + '.idx')
+    except FileNotFoundError:
+        pass
+
+
+def load_sorted_index(path):
+    # np.memmap cannot map an empty file
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=INDEX_DTYPE)
+    return np.memmap(path, dtype=INDEX_DTYPE, mode='r')
+
+
+def remove_segment(stream_dir, seq, gen):
+    name = segment_name(seq, gen)
+    for suffix in ('.log', '.idx', '.sidx'):
+        try:
+            os.unlink(os.path.join(stream_dir, name + suffix))
+        except FileNotFoundError:
+            pass
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _SegmentIndex:
+    """
+    Per-user offsets of one segment
+
+    A sealed segment's sorted index is memory-mapped and binary-searched. Only
+    the segment a stream is still writing is held in memory, read incrementally
+    from its append-order index, so a reader's memory is bounded by one segment
+    per stream rather than by the size of the log.
+    """
+
+    def __init__(self, stream, seq, gen, path):
+        self.stream = stream
+        self.seq = seq
+        self.gen = gen
+        self.path = path
+        self.consumed = 0
+        self.users = {}
+        self.sorted = None
+
+    def __len__(self):
+        if self.sorted is not None:
+            return len(self.sorted)
+        return sum(len(entries) for entries in self.users.values())
+
+    def lookup(self, key):
+        """(timestamp, stream, seq, offset) of a user's records in this segment, in time order"""
+        if self.sorted is None:
+            return self.users.get(key, [])
+        users = self.sorted['user']
+        key = np.uint64(key)
+        found = self.sorted[np.searchsorted(users, key, 'left'):np.searchsorted(users, key, 'right')]
+        return [(timestamp, self.stream, self.seq, offset)
+                for timestamp, offset in zip(found['timestamp'].tolist(), found['offset'].tolist())]
+
+    def arrays(self):
+        """(user, timestamp, offset) arrays of every record in the segment"""
+        if self.sorted is not None:
+            return self.sorted['user'], self.sorted['timestamp'], self.sorted['offset']
+        entries = [(key, timestamp, offset) for key, positions in self.users.items()
+                   for timestamp, _, _, offset in positions]
+        users, timestamps, offsets = zip(*entries) if entries else ((), (), ())
+        return (np.array(users, dtype=np.uint64), np.array(timestamps, dtype=np.float64),
+                np.array(offsets, dtype=np.uint64))
+
+    def refresh(self):
+        if self.sorted is not None:
+            return
+        base = self.path[:-len('.log')]
+        if os.path.exists(base + '.sidx'):
+            self.sorted = load_sorted_index(base + '.sidx')
+            self.users = {}
+            return
+        try:
+            with open(base + '.idx', 'rb') as f:
+                f.seek(self.consumed)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for key, offset, timestamp in INDEX_ENTRY.iter_unpack(data[:usable]):
+            entries = self.users.setdefault(key, [])
+            entries.append((timestamp, self.stream, self.seq, offset))
+            if len(entries) > 1 and entries[-2] > entries[-1]:
+                # The wall clock stepped back; keep the user's list in time order
+                entries.sort()
+        self.consumed += usable
+
+
+class PredictionLog:
+    """
+    Append-only log of prediction results with a per-user index
+
+    Every worker process appends to its own stream directory under directory,
+    claimed with a file lock so no two writers share one. A stream is a series
+    of segment files of length-prefixed, CRC-checked JSON records; next to each
+    segment an index file holds one fixed-size (user hash, offset, timestamp)
+    entry per record. Segments are rotated at segment_bytes; a sealed segment's
+    index is rewritten sorted by user, so lookups in it are a binary search of
+    a memory-mapped file and readers hold no per-record state for it.
+
+    append() only queues the record. A background thread writes whatever has
+    queued up as one group, fsyncs the segment once for the group, then adds
+    the group's index entries - so an index entry never points at data that is
+    not on disk, and logging adds no latency to the request that produced it.
+
+    history() pages through one user's records in time order across all streams,
+    reading only the index files (incrementally) and the records on the page.
+    """
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, flush_interval=0.05, max_batch=1024,
+                 max_pending=100000, retention=None, keep_per_user=None, writer=True, instrumentation=None):
+        """
+        Args:
+            directory: Directory holding the log's streams (created if missing)
+            segment_bytes: Size at which the active segment is sealed and a new one started
+            flush_interval: Longest a record waits to be written, in seconds; records
+                arriving within it share one write and fsync
+            max_batch: Most records written per group
+            max_pending: Records queued beyond this are dropped (and counted) rather
+                than slowing requests down
+            retention: Seconds records are kept by compact() (None: forever)
+            keep_per_user: Newest records per user kept by compact() (None: all)
+            writer: Claim a stream and accept appends; False opens the log read-only
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retention = retention
+        self.keep_per_user = keep_per_user
+        self.instrumentation = instrumentation
+        self.segments = {}
+        self.index_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.lock_file = None
+        self.thread = None
+        os.makedirs(directory, exist_ok=True)
+
+        if writer:
+            self.pending = queue.Queue(maxsize=max_pending)
+            self.claim_stream()
+            self.thread = threading.Thread(target=self.write_loop, name='prediction-log-writer', daemon=True)
+            self.thread.start()
+
+    def claim_stream(self):
+        """Lock the first stream no other writer holds and reopen its active segment"""
+        number = 0
+        while True:
+            stream_dir = os.path.join(self.directory, f"{STREAM_PREFIX}{number:03d}")
+            os.makedirs(stream_dir, exist_ok=True)
+            lock_file = open(os.path.join(stream_dir, LOCK_NAME), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                number += 1
+                continue
+            break
+        self.lock_file = lock_file
+        self.stream_dir = stream_dir
+
+        segments = list_segments(stream_dir)
+        if not segments:
+            self.open_segment(0, 0)
+            return
+        # The previous writer may have died mid-write: drop a torn tail and
+        # rebuild the index of the active segment from the records themselves
+        seq = max(segments)
+        gen = segments[seq]
+        # A writer that died while rotating may have left the previous segment unsealed
+        for other, other_gen in segments.items():
+            base = os.path.join(stream_dir, segment_name(other, other_gen))
+            if other != seq and not os.path.exists(base + '.sidx'):
+                seal_index(stream_dir, other, other_gen)
+        if os.path.exists(os.path.join(stream_dir, segment_name(seq, gen) + '.sidx')):
+            # ... or sealed the last one without opening the next
+            self.open_segment(seq + 1, 0)
+            return
+        log_path = os.path.join(stream_dir, segment_name(seq, gen) + '.log')
+        records, end = read_records(log_path)
+        entries = []
+        for offset, payload in records:
+            entry = json.loads(payload)
+            entries.append(INDEX_ENTRY.pack(user_hash(entry['user_id']), offset, entry['timestamp']))
+        with open(log_path, 'r+b') as f:
+            f.truncate(end)
+        with open(log_path[:-len('.log')] + '.idx', 'wb') as f:
+            f.write(b''.join(entries))
+        self.open_segment(seq, gen)
+
+    def open_segment(self, seq, gen):
+        name = segment_name(seq, gen)
+        self.active_seq = seq
+        self.active_gen = gen
+        self.log_file = open(os.path.join(self.stream_dir, name + '.log'), 'ab')
+        self.index_file = open(os.path.join(self.stream_dir, name + '.idx'), 'ab')
+        self.log_size = self.log_file.tell()
+
+    def append(self, user_id, condition_type, record, result):
+        """Queue one prediction for writing; never blocks"""
+        entry = {'user_id': user_id, 'timestamp': time.time(), 'condition_type': condition_type,
+                 'record': record, 'result': result}
+        try:
+            self.pending.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            if self.instrumentation is not None:
+                self.instrumentation.inc('predictor_log_dropped_total')
+
+    def write_loop(self):
+        while True:
+            group = [self.pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(group) < self.max_batch and group[-1] is not None:
+                remaining = deadline - time.monotonic()
+                try:
+                    group.append(self.pending.get(timeout=remaining) if remaining > 0
+                                 else self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            # flush() and close() queue markers: an Event to set once the records
+            # before it are written, None to stop
+            entries = [entry for entry in group if isinstance(entry, dict)]
+            if entries:
+                try:
+                    self.write_group(entries)
+                except Exception as e:
+                    # Keep serving predictions if the disk is full or gone
+                    self.dropped += len(entries)
+                    print(f"Prediction log could not write {len(entries)} records: {e}", file=sys.stderr)
+            for entry in group:
+                if isinstance(entry, threading.Event):
+                    entry.set()
+            if group[-1] is None:
+                return
+
+    def write_group(self, group):
+        start = time.perf_counter()
+        log_data = bytearray()
+        index_data = bytearray()
+        for entry in group:
+            try:
+                record = encode_record(entry)
+            except (TypeError, ValueError) as e:
+                self.dropped += 1
+                print(f"Prediction log skipped a record that is not JSON serialisable: {e}", file=sys.stderr)
+                continue
+            index_data += INDEX_ENTRY.pack(user_hash(entry['user_id']), self.log_size + len(log_data),
+                                           entry['timestamp'])
+            log_data += record
+        if not log_data:
+            return
+
+        self.log_file.write(log_data)
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.index_file.write(index_data)
+        self.index_file.flush()
+        self.log_size += len(log_data)
+        self.written += len(index_data) // INDEX_ENTRY.size
+
+        if self.instrumentation is not None:
+            self.instrumentation.observe('predictor_log_flush_seconds', time.perf_counter() - start)
+            self.instrumentation.inc('predictor_log_records_total', len(index_data) // INDEX_ENTRY.size)
+
+        if self.log_size >= self.segment_bytes:
+            self.rotate()
+
+    def rotate(self):
+        """Seal the active segment and start the next one (writer thread only)"""
+        os.fsync(self.index_file.fileno())
+        self.log_file.close()
+        self.index_file.close()
+        seal_index(self.stream_dir, self.active_seq, self.active_gen)
+        self.open_segment(self.active_seq + 1, 0)
+        fsync_dir(self.stream_dir)
+        if self.retention is not None or self.keep_per_user is not None:
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Prediction log compaction failed: {e}", file=sys.stderr)
+
+    def compact(self, retention=None, keep_per_user=None, now=None):
+        """
+        Rewrite sealed segments without expired records and without all but the
+        newest keep_per_user records of each user
+
+        Only sealed segments are touched, so this can run in any process alongside
+        the writers; compactions are serialised by a lock file. Rewritten segments
+        get a new generation and emptied ones are removed.
+
+        Returns:
+            Number of records removed
+        """
+        retention = self.retention if retention is None else retention
+        keep_per_user = self.keep_per_user if keep_per_user is None else keep_per_user
+        if retention is None and keep_per_user is None:
+            return 0
+        now = time.time() if now is None else now
+        cutoff = now - retention if retention is not None else None
+
+        with open(os.path.join(self.directory, COMPACT_LOCK_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.refresh()
+            with self.index_lock:
+                sealed = [key for key in sorted(self.segments) if self.segments[key].sorted is not None]
+                kept = self.newest_per_user(keep_per_user) if keep_per_user is not None else None
+
+            removed = 0
+            for stream, seq in sealed:
+                segment = self.segments[(stream, seq)]
+                stream_dir = os.path.join(self.directory, stream)
+                records, _ = read_records(segment.path)
+                keep_offsets = kept.get((stream, seq)) if kept is not None else None
+                survivors = []
+                for offset, payload in records:
+                    entry = json.loads(payload)
+                    if cutoff is not None and entry['timestamp'] < cutoff:
+                        continue
+                    if keep_offsets is not None and not _contains(keep_offsets, offset):
+                        continue
+                    survivors.append(entry)
+                if len(survivors) == len(records):
+                    continue
+                removed += len(records) - len(survivors)
+                if survivors:
+                    write_segment(stream_dir, seq, segment.gen + 1, survivors)
+                remove_segment(stream_dir, seq, segment.gen)
+                fsync_dir(stream_dir)
+        if self.instrumentation is not None and removed:
+            self.instrumentation.inc('predictor_log_compacted_total', removed)
+        self.refresh()
+        return removed
+
+    def newest_per_user(self, keep_per_user):
+        """
+        Sorted offsets of each user's keep_per_user newest records, by segment
+
+        Works on the index arrays rather than per-record Python objects, so a
+        compaction's memory is a few arrays the size of the index.
+        """
+        keys = sorted(self.segments)
+        columns = [self.segments[key].arrays() for key in keys]
+        users = np.concatenate([c[0] for c in columns]) if columns else np.empty(0, dtype=np.uint64)
+        timestamps = np.concatenate([c[1] for c in columns]) if columns else np.empty(0)
+        offsets = np.concatenate([c[2] for c in columns]) if columns else np.empty(0, dtype=np.uint64)
+        segments = np.repeat(np.arange(len(keys)), [len(c[0]) for c in columns])
+        # Ascending by user, then (timestamp, stream, seq, offset): the history order
+        order = np.lexsort((offsets, segments, timestamps, users))
+        users = users[order]
+        # Position of each record counted back from the last (newest) one of its user
+        group_end = np.searchsorted(users, users, 'right')
+        newest = group_end - np.arange(len(users)) <= keep_per_user
+        kept_segments = segments[order][newest]
+        kept_offsets = offsets[order][newest]
+        return {key: np.sort(kept_offsets[kept_segments == i]) for i, key in enumerate(keys)}
+
+    def refresh(self):
+        """Pick up new segments, index entries written since the last call and compacted generations"""
+        with self.index_lock:
+            current = {}
+            for stream in sorted(os.listdir(self.directory)):
+                if not stream.startswith(STREAM_PREFIX):
+                    continue
+                stream_dir = os.path.join(self.directory, stream)
+                for seq, gen in list_segments(stream_dir).items():
+                    current[(stream, seq)] = gen
+            for key in list(self.segments):
+                if current.get(key) != self.segments[key].gen:
+                    del self.segments[key]
+            for (stream, seq), gen in current.items():
+                segment = self.segments.get((stream, seq))
+                if segment is None:
+                    path = os.path.join(self.directory, stream, segment_name(seq, gen) + '.log')
+                    segment = self.segments[(stream, seq)] = _SegmentIndex(stream, seq, gen, path)
+                segment.refresh()
+
+    def history(self, user_id, limit=50, cursor=None, newest_first=False):
+        """
+        One page of a user's predictions in time order
+
+        Args:
+            user_id: User whose records to return
+            limit: Most records on the page
+            cursor: next_cursor of the previous page (None: start from the oldest, or
+                the newest with newest_first)
+            newest_first: Page backwards from the most recent prediction
+
+        Returns:
+            {'entries': [...], 'next_cursor': str or None}; each entry has timestamp,
+            condition_type, record and result
+        """
+        if limit <= 0:
+            raise ValueError("'limit' must be a positive integer")
+        after = parse_cursor(cursor) if cursor is not None else None
+        key = user_hash(user_id)
+
+        for attempt in range(2):
+            self.refresh()
+            with self.index_lock:
+                candidates = []
+                for segment in self.segments.values():
+                    entries = segment.lookup(key)
+                    if entries:
+                        candidates.append(entries if not newest_first else reversed(entries))
+                if newest_first:
+                    positions = heapq.merge(*candidates, reverse=True)
+                    positions = (p for p in positions if after is None or p < after)
+                else:
+                    positions = heapq.merge(*candidates)
+                    positions = (p for p in positions if after is None or p > after)
+                # One spare position tells whether there is a next page
+                page = [p for _, p in zip(range(limit + 1), positions)]
+                paths = {(p[1], p[2]): self.segments[(p[1], p[2])].path for p in page}
+
+            try:
+                entries = self.read_page(page[:limit], paths, user_id)
+            except FileNotFoundError:
+                # A segment was compacted away under us; its new generation has the record
+                if attempt:
+                    raise
+                continue
+            next_cursor = format_cursor(page[limit - 1]) if len(page) > limit else None
+            return {'entries': entries, 'next_cursor': next_cursor}
+
+    @staticmethod
+    def read_page(positions, paths, user_id):
+        entries = []
+        files = {}
+        try:
+            for position in positions:
+                segment = (position[1], position[2])
+                if segment not in files:
+                    files[segment] = open(paths[segment], 'rb')
+                entry = read_record(files[segment], position[3])
+                # A 64-bit hash collision would show another user's record
+                if str(entry.pop('user_id')) != str(user_id):
+                    continue
+                entries.append(entry)
+        finally:
+            for f in files.values():
+                f.close()
+        return entries
+
+    def flush(self, timeout=5.0):
+        """Wait until every record queued so far is written; False if that took over timeout seconds"""
+        if self.thread is None:
+            return True
+        written = threading.Event()
+        self.pending.put(written)
+        return written.wait(timeout)
+
+    def info(self):
+        self.refresh()
+        with self.index_lock:
+            segments = len(self.segments)
+            indexed = sum(len(segment) for segment in self.segments.values())
+        return {'segments': segments, 'records': indexed, 'written': self.written, 'dropped': self.dropped,
+                'pending': self.pending.qsize() if self.thread is not None else 0}
+
+    def close(self):
+        """Write everything still queued and release the stream"""
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+            self.log_file.close()
+            os.fsync(self.index_file.fileno())
+            self.index_file.close()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+def _contains(sorted_array, value):
+    i = np.searchsorted(sorted_array, np.uint64(value))
+    return i < len(sorted_array) and sorted_array[i] == value
+
+
+def format_cursor(position):
+    timestamp, stream, seq, offset = position
+    return f"{timestamp!r}:{stream}:{seq}:{offset}"
+
+
+def parse_cursor(cursor):
+    try:
+        timestamp, stream, seq, offset = str(cursor).split(':')
+        return float(timestamp), stream, int(seq), int(offset)
+    except ValueError:
+        raise ValueError(f"Invalid history cursor: {cursor!r}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or compact a prediction log")
+    parser.add_argument('directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    history_parser = subparsers.add_parser('history', help="Print a user's predictions, oldest first")
+    history_parser.add_argument('user_id')
+    history_parser.add_argument('--limit', type=int, default=50)
+    history_parser.add_argument('--cursor', default=None)
+    history_parser.add_argument('--newest-first', action='store_true')
+    compact_parser = subparsers.add_parser('compact', help="Drop old records from sealed segments")
+    compact_parser.add_argument('--retention-days', type=float, default=None)
+    compact_parser.add_argument('--keep-per-user', type=int, default=None)
+    subparsers.add_parser('info', help="Segment and record counts")
+    args = parser.parse_args()
+
+    log = PredictionLog(args.directory, writer=False)
+    if args.command == 'history':
+        print(json.dumps(log.history(args.user_id, args.limit, args.cursor, args.newest_first), indent=2))
+    elif args.command == 'compact':
+        retention = args.retention_days * 86400 if args.retention_days is not None else None
+        print(json.dumps({'removed': log.compact(retention, args.keep_per_user)}))
+    else:
+        print(json.dumps(log.info(), indent=2))
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(condition_type, artifact_version, encoded_row):
+    """
+    Hash of one canonical prediction input
+
+    encoded_row is the unscaled float64 feature vector from FeatureEncoder.encode
+    (or its CSR row from encode_sparse), so inputs that only differ in spelling
+    (54 vs "54" vs 54.0, extra fields the model ignores) share an entry.
+    """
+    digest = hashlib.sha256()
+    digest.update(condition_type.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(str(artifact_version).encode('utf-8'))
+    digest.update(b'\0')
+    if hasattr(encoded_row, 'indices'):
+        digest.update(encoded_row.indices.tobytes())
+        digest.update(b'\0')
+        digest.update(encoded_row.data.tobytes())
+    else:
+        digest.update(encoded_row.tobytes())
+    return digest.hexdigest()
+
+
+class SqliteCacheBackend:
+    """
+    Cache entries shared between worker processes through a local SQLite file
+
+    Entries carry their own expiry; the table is trimmed back to max_entries,
+    least recently stored first, every trim_interval writes.
+    """
+
+    def __init__(self, path, max_entries=100000, trim_interval=500):
+        import sqlite3
+
+        self.path = path
+        self.max_entries = max_entries
+        self.trim_interval = trim_interval
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS predictions ('
+            'key TEXT PRIMARY KEY, condition TEXT, value TEXT, expires REAL, stored REAL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS predictions_stored ON predictions (stored)')
+
+    def get(self, key, now):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM predictions WHERE key = ? AND expires > ?', (key, now)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, condition_type, value, expires, now):
+        """Store an entry; returns how many entries were trimmed"""
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO predictions (key, condition, value, expires, stored) VALUES (?, ?, ?, ?, ?)',
+                (key, condition_type, value, expires, now)
+            )
+            self.writes += 1
+            if self.writes % self.trim_interval:
+                return 0
+            trimmed = self.connection.execute('DELETE FROM predictions WHERE expires <= ?', (now,)).rowcount
+            trimmed += self.connection.execute(
+                'DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY stored DESC '
+                'LIMIT -1 OFFSET ?)', (self.max_entries,)
+            ).rowcount
+            return trimmed
+
+    def invalidate(self, condition_type=None):
+        with self.lock:
+            if condition_type is None:
+                self.connection.execute('DELETE FROM predictions')
+            else:
+                self.connection.execute('DELETE FROM predictions WHERE condition = ?', (condition_type,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ResultCache:
+    """
+    LRU + TTL cache of prediction results
+
+    Values are stored as JSON text, which both bounds memory by bytes and means a
+    caller modifying a returned prediction cannot alter the cached copy. Keys
+    include the artifact version, and invalidate() is called when a condition's
+    artifact is reloaded, so results from an old model are never served.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=300.0,
+                 backend=None, instrumentation=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend
+        self.instrumentation = instrumentation
+        self.entries = OrderedDict()  # key -> (condition_type, value, expires)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidations': 0}
+
+    def _count(self, stat, condition_type, amount=1):
+        self.stats[stat] += amount
+        if self.instrumentation is not None:
+            self.instrumentation.inc(f'predictor_cache_{stat}_total', amount, condition=condition_type)
+
+    def get(self, key, condition_type):
+        """Cached prediction for key, or None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self.entries.move_to_end(key)
+                    self._count('hits', condition_type)
+                    return json.loads(entry[1])
+                self._drop(key)
+                self._count('expired', condition_type)
+
+        if self.backend is not None:
+            value = self.backend.get(key, now)
+            if value is not None:
+                with self.lock:
+                    self._store(key, condition_type, value, now + self.ttl)
+                    self._count('shared_hits', condition_type)
+                return json.loads(value)
+
+        with self.lock:
+            self._count('misses', condition_type)
+        return None
+
+    def put(self, key, condition_type, prediction):
+        """Cache a prediction (anything JSON serialisable)"""
+        now = time.time()
+        value = json.dumps(prediction)
+        with self.lock:
+            self._store(key, condition_type, value, now + self.ttl)
+        if self.backend is not None:
+            self.backend.put(key, condition_type, value, now + self.ttl, now)
+
+    def invalidate(self, condition_type=None):
+        """Drop every entry, or only those for one condition"""
+        with self.lock:
+            for key in [key for key, entry in self.entries.items()
+                        if condition_type is None or entry[0] == condition_type]:
+                self._drop(key)
+            self._count('invalidations', condition_type or 'all')
+        if self.backend is not None:
+            self.backend.invalidate(condition_type)
+
+    def _store(self, key, condition_type, value, expires):
+        if key in self.entries:
+            self._drop(key)
+        if len(value) > self.max_bytes:
+            return
+        self.entries[key] = (condition_type, value, expires)
+        self.size += len(value)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            oldest = next(iter(self.entries))
+            evicted_condition = self.entries[oldest][0]
+            self._drop(oldest)
+            self._count('evictions', evicted_condition)
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry[1])
+
+    def info(self):
+        """Current size and counters"""
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.size,
+                        max_entries=self.max_entries, max_bytes=self.max_bytes, ttl=self.ttl)
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmark import DEFAULT_DATA_PATH, load_rows
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUDGET_PATH = os.path.join(CURRENT_DIR, "startup_budget.json")
+
+
+def parse_importtime(stderr):
+    """
+    Parse `python -X importtime` output
+
+    Returns:
+        List of (module, self_us, cumulative_us, depth) in import order
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def run_python(args, stdin=None):
+    """Run a fresh interpreter in the ML directory; returns (seconds, completed process)"""
+    env = dict(os.environ, PYTHONWARNINGS='ignore', PYTHONDONTWRITEBYTECODE='1')
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable] + args, input=stdin, capture_output=True,
+                               text=True, cwd=CURRENT_DIR, env=env)
+    return time.perf_counter() - start, completed
+
+
+def measure(runs, row):
+    """Import and first-prediction timings of predict.py in fresh processes"""
+    import_ms = []
+    first_prediction_ms = []
+    payload = json.dumps(dict(row, condition_type='heart_disease'))
+
+    for _ in range(runs):
+        _, completed = run_python(['-X', 'importtime', '-c', 'import predict'])
+        modules = parse_importtime(completed.stderr)
+        import_ms.append(next(cum for name, _, cum, _ in modules if name == 'predict') / 1000)
+
+        seconds, completed = run_python([os.path.join(CURRENT_DIR, 'predict.py')], payload)
+        if completed.returncode != 0:
+            raise RuntimeError(f"predict.py failed: {completed.stdout or completed.stderr}")
+        first_prediction_ms.append(seconds * 1000)
+
+    # One traced run shows what a prediction process imports, and what it costs
+    _, completed = run_python(['-X', 'importtime', os.path.join(CURRENT_DIR, 'predict.py')], payload)
+    modules = parse_importtime(completed.stderr)
+    packages = {}
+    for name, self_us, _, _ in modules:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    return {
+        'import_predict_ms': statistics.median(import_ms),
+        'first_prediction_ms': statistics.median(first_prediction_ms),
+        'modules_imported': len(modules),
+        'packages_ms': {package: us / 1000 for package, us in sorted(packages.items(), key=lambda item: -item[1])},
+    }
+
+
+def check(results, budget):
+    """Budget violations as a list of messages"""
+    failures = []
+    for metric in ('import_predict_ms', 'first_prediction_ms'):
+        if metric in budget and results[metric] > budget[metric]:
+            failures.append(f"{metric} {results[metric]:.1f} ms is over the budget of {budget[metric]} ms")
+    for package in budget.get('forbidden_modules', []):
+        if package in results['packages_ms']:
+            failures.append(f"{package} is imported while serving a prediction")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure predict.py start-up in fresh interpreters (python -X importtime plus a "
+                    "timed one-shot prediction) and check it against the budget in startup_budget.json."
+    )
+    parser.add_argument('--budget', default=DEFAULT_BUDGET_PATH)
+    parser.add_argument('--runs', type=int, default=None, help="Processes per measurement (median is used)")
+    parser.add_argument('--top', type=int, default=10, help="Packages to list by import time")
+    parser.add_argument('--output', default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    with open(args.budget) as f:
+        budget = json.load(f)
+
+    results = measure(args.runs or budget.get('runs', 5), load_rows(DEFAULT_DATA_PATH, 1)[0])
+
+    print(f"import predict      {results['import_predict_ms']:8.1f} ms  (budget {budget.get('import_predict_ms')} ms)")
+    print(f"first prediction    {results['first_prediction_ms']:8.1f} ms  (budget {budget.get('first_prediction_ms')} ms)")
+    print(f"modules imported    {results['modules_imported']:8d}")
+    print("import time by package (self, ms):")
+    for package, ms in list(results['packages_ms'].items())[:args.top]:
+        print(f"  {package:<24} {ms:8.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failures = check(results, budget)
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    sys.exit(1 if failures else 0)
@@ -8,7 +8,12 @@ from sklearn.ensemble import RandomForestClassifier
 from xgboost import XGBClassifier
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.tree import DecisionTreeClassifier
-import pickle
+from feature_encoder import FeatureEncoder
+from artifact_bundle import save_bundle
+from parallel_training import train_members
+from model_tuning import apply_tuning, describe_tuning, tune_members
+from ensemble_combiner import COMBINERS, fit_stacker
+from chunked_loader import ChunkedDatasetLoader
 
 class HeartDiseaseEnsemblePredictor:
     def __init__(self):
@@ -25,9 +30,17 @@ class HeartDiseaseEnsemblePredictor:
         }
         self.scaler = StandardScaler()
         self.feature_names = None
+        self.training_rows = None
+        self.tuning = None
+        # Default ensemble combiner stored in the artifact, plus the stacker when it is 'stacking'
+        self.combiner = {'default': 'mean'}
+        
+    def train(self, data_path, n_jobs=1, chunksize=None, cv=0, search='none', n_candidates=20):
+        """Train all models, fitting up to n_jobs of them concurrently"""
+        if chunksize:
+            return self.train_chunked(data_path, chunksize, n_jobs, cv=cv, search=search,
+                                      n_candidates=n_candidates)
         
-    def train(self, data_path):
-        """Train all models"""
         print(f"Loading data from: {data_path}")
         if not os.path.exists(data_path):
             raise FileNotFoundError(f"Dataset not found at {data_path}")
@@ -35,6 +48,7 @@ class HeartDiseaseEnsemblePredictor:
         # Load data
         data = pd.read_csv(data_path)
         print(f"Dataset loaded successfully. Shape: {data.shape}")
+        self.training_rows = len(data)
         print("\nFirst few rows of the dataset:")
         print(data.head())
         print("\nColumns in the dataset:")
@@ -59,47 +73,132 @@ class HeartDiseaseEnsemblePredictor:
         print(f"\nTraining set shape: {X_train.shape}")
         print(f"Test set shape: {X_test.shape}")
         
+        if cv:
+            self.tune(X_train.to_numpy(dtype=float), y_train.to_numpy(), cv, search, n_candidates, n_jobs)
+        
         # Train all models
         print("\nTraining models...")
+        self.train_members(X_train_scaled, y_train, X_test_scaled, y_test, n_jobs)
+
+    def train_chunked(self, data_path, chunksize, n_jobs=1, work_dir=None, cv=0, search='none',
+                      n_candidates=20):
+        """Train all models from a CSV streamed in chunks into memory-mapped matrices"""
+        print(f"Streaming data from: {data_path} ({chunksize} rows per chunk)")
+        loader = ChunkedDatasetLoader(data_path, "HeartDisease", chunksize=chunksize, work_dir=work_dir)
+        
+        try:
+            # Pass 1: vocabularies, imputation values and scaler statistics
+            loader.learn()
+            self.feature_names = loader.feature_names
+            self.encoded_feature_names = loader.encoded_feature_names
+            self.scaler = loader.fitted_scaler()
+            print(f"\nFeatures being used: {self.feature_names}")
+            print(f"Encoded features: {len(self.encoded_feature_names)}")
+        
+            # Pass 2: encoded, scaled float32 rows written to disk
+            X_train_scaled, X_test_scaled, y_train, y_test = loader.materialize()
+            self.training_rows = loader.n_train + loader.n_test
+            print(f"\nTraining set shape: {X_train_scaled.shape}")
+            print(f"Test set shape: {X_test_scaled.shape}")
+            print(f"Memory-mapped matrices in: {loader.work_dir}")
+        
+            if cv:
+                # Unscaled rows, as in train(): every fold is scaled on its own training rows
+                self.tune(loader.materialize_unscaled_train(), y_train, cv, search, n_candidates, n_jobs)
+        
+            print("\nTraining models...")
+            self.train_members(X_train_scaled, y_train, X_test_scaled, y_test, n_jobs)
+        finally:
+            # Scratch matrices hold the whole dataset; drop them unless work_dir was given
+            loader.cleanup()
+
+    def tune(self, X_train, y_train, cv=5, search='random', n_candidates=20, n_jobs=1):
+        """Cross-validate the models on the training rows and switch them to the best parameters found"""
+        print(f"\nCross-validating models ({cv} folds, search: {search})...")
+        self.tuning = tune_members(self.models, X_train, y_train, cv=cv, search=search,
+                                   n_candidates=n_candidates, n_jobs=n_jobs)
+        apply_tuning(self.models, None, self.tuning)
+        for name, result in self.tuning.items():
+            print(f"{name} - {describe_tuning(result)}")
+
+    def train_members(self, X_train_scaled, y_train, X_test_scaled, y_test, n_jobs=1):
+        """Fit and score every model on prepared matrices"""
         self.model_performance = {}
-        for name, model in self.models.items():
-            print(f"\nTraining {name}...")
-            model.fit(X_train_scaled, y_train)
-            train_score = model.score(X_train_scaled, y_train)
-            test_score = model.score(X_test_scaled, y_test)
-            self.model_performance[name] = {
-                'train_score': train_score,
-                'test_score': test_score
-            }
-            print(f"{name} - Train Score: {train_score:.4f}, Test Score: {test_score:.4f}")
+        for name, model, performance in train_members(self.models, X_train_scaled, y_train,
+                                                      X_test_scaled, y_test, n_jobs=n_jobs):
+            print(f"\nTrained {name}")
+            if 'error' in performance:
+                raise Exception(f"Training {name} failed: {performance['error']}")
+            self.models[name] = model
+            self.model_performance[name] = performance
+            print(f"{name} - Train Score: {performance['train_score']:.4f}, Test Score: {performance['test_score']:.4f}")
+        if self.tuning:
+            # Cross-validated accuracy alongside the single held-out test score
+            apply_tuning(self.models, self.model_performance, self.tuning)
+        if self.combiner['default'] == 'stacking':
+            self.fit_combiner(X_train_scaled, y_train, X_test_scaled, y_test)
+
+    def fit_combiner(self, X_train_scaled, y_train, X_test_scaled, y_test):
+        """Fit the logistic stacker over the members' out-of-fold probabilities"""
+        print("\nFitting stacking combiner...")
+        members = {name: model for name, model in self.models.items()
+                   if 'error' not in self.model_performance.get(name, {})}
+        self.combiner['stacking'] = fit_stacker(members, X_train_scaled, y_train, X_test_scaled, y_test)
+        print(f"Stacking combiner - Train Score: {self.combiner['stacking']['train_score']:.4f}, "
+              f"Test Score: {self.combiner['stacking']['test_score']:.4f}")
 
     def save_models(self, save_path):
-        """Save all models and components"""
+        """Save all models and components as an artifact bundle directory"""
         print(f"\nSaving models to: {save_path}")
         save_dict = {
             'models': self.models,
             'scaler': self.scaler,
             'feature_names': self.feature_names,
             'encoded_feature_names': self.encoded_feature_names,
-            'model_performance': self.model_performance
+            'model_performance': self.model_performance,
+            # Compiled one-hot layout and scaler statistics used at prediction time
+            'encoder': FeatureEncoder(self.feature_names, self.encoded_feature_names,
+                                      self.scaler.mean_, self.scaler.scale_).to_dict(),
+            'combiner': self.combiner,
+            # Rows of the CSV used, so incremental_training.py knows which rows are new
+            'training_rows': self.training_rows,
+            'model_version': 1
         }
-        with open(save_path, 'wb') as f:
-            pickle.dump(save_dict, f)
+        save_bundle(save_dict, save_path)
         print("Models saved successfully!")
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the heart disease ensemble")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Models to train concurrently in separate processes (-1: one per CPU)")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Stream the CSV in chunks of this many rows into memory-mapped matrices")
+    parser.add_argument('--cv', type=int, default=0,
+                        help="Cross-validate every model with this many folds (0: off)")
+    parser.add_argument('--search', choices=('none', 'random', 'halving'), default='none',
+                        help="Hyperparameter search run within the cross-validation")
+    parser.add_argument('--candidates', type=int, default=20,
+                        help="Parameter candidates per model, including the current ones")
+    parser.add_argument('--combiner', choices=COMBINERS, default='mean',
+                        help="Default way predictions combine the members ('stacking' fits a stacker)")
+    args = parser.parse_args()
+
     try:
         # Define paths
         current_dir = os.path.dirname(os.path.abspath(__file__))
         DATA_PATH = os.path.join(current_dir, "heart.csv")
-        MODEL_SAVE_PATH = os.path.join(current_dir, "heart_disease_ensemble.pkl")
+        MODEL_SAVE_PATH = os.path.join(current_dir, "heart_disease_ensemble")
         
         print("Starting model training process...")
         print(f"Current directory: {current_dir}")
         
         # Initialize and train
         predictor = HeartDiseaseEnsemblePredictor()
-        predictor.train(DATA_PATH)
+        predictor.combiner['default'] = args.combiner
+        predictor.train(DATA_PATH, n_jobs=args.jobs, chunksize=args.chunksize, cv=args.cv,
+                        search=args.search, n_candidates=args.candidates)
         
         # Save the trained model
         predictor.save_models(MODEL_SAVE_PATH)
@@ -9,10 +9,15 @@ from sklearn.ensemble import RandomForestClassifier
 from xgboost import XGBClassifier
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.tree import DecisionTreeClassifier
-import pickle
+from feature_encoder import FeatureEncoder, sparse_design_matrix
+from artifact_bundle import save_bundle
+from parallel_training import train_members
+from model_tuning import apply_tuning, describe_tuning, tune_members
+from ensemble_combiner import COMBINERS, fit_stacker
+from chunked_loader import ChunkedDatasetLoader
 
 class GastricCancerEnsemblePredictor:
-    def __init__(self):
+    def __init__(self, sparse=False):
         self.models = {
             'Logistic Regression': LogisticRegression(max_iter=1000),
             'Naive Bayes': GaussianNB(),
@@ -23,12 +28,26 @@ class GastricCancerEnsemblePredictor:
             'KNN': KNeighborsClassifier(n_neighbors=5),
             'Decision Tree': DecisionTreeClassifier(criterion='gini', random_state=42, max_depth=8)
         }
-        self.scaler = StandardScaler()
+        # Sparse: one-hot columns go straight into a CSR matrix and are scaled without
+        # centring, so memory follows the non-zeros rather than the vocabulary size
+        self.sparse = sparse
+        self.scaler = StandardScaler(with_mean=not sparse)
         self.feature_names = None
+        self.training_rows = None
+        self.tuning = None
+        # Default ensemble combiner stored in the artifact, plus the stacker when it is 'stacking'
+        self.combiner = {'default': 'mean'}
         self.target_column = "Diagnosis"  # Default target column
         
-    def train(self, data_path):
-        """Train all models on the gastric cancer dataset"""
+    def train(self, data_path, n_jobs=1, chunksize=None, cv=0, search='none', n_candidates=20):
+        """Train all models on the gastric cancer dataset, fitting up to n_jobs of them concurrently"""
+        if self.sparse and (chunksize or cv):
+            raise ValueError("The sparse pipeline does not support chunked loading or cross-validation, "
+                             "which work on dense matrices")
+        if chunksize:
+            return self.train_chunked(data_path, chunksize, n_jobs, cv=cv, search=search,
+                                      n_candidates=n_candidates)
+        
         print(f"Loading data from: {data_path}")
         if not os.path.exists(data_path):
             raise FileNotFoundError(f"Dataset not found at {data_path}")
@@ -36,6 +55,7 @@ class GastricCancerEnsemblePredictor:
         # Load data
         data = pd.read_csv(data_path)
         print(f"Dataset loaded successfully. Shape: {data.shape}")
+        self.training_rows = len(data)
         print("\nFirst few rows of the dataset:")
         print(data.head())
         print("\nColumns in the dataset:")
@@ -82,6 +102,19 @@ class GastricCancerEnsemblePredictor:
             if X[col].isnull().sum() > 0:
                 X[col] = X[col].fillna(X[col].mode()[0])
         
+        if self.sparse:
+            # Columns other than the categorical ones are numeric (bools included)
+            for col in X.columns.difference(categorical_columns):
+                if X[col].dtype not in (np.int64, np.float64):
+                    X[col] = pd.to_numeric(X[col], errors='coerce')
+                    X[col] = X[col].fillna(X[col].mean())
+            print(f"\nEncoding categorical columns into a sparse matrix: {categorical_columns.tolist()}")
+            X, self.encoded_feature_names = sparse_design_matrix(X, categorical_columns)
+            print(f"Encoded features: {len(self.encoded_feature_names)}, non-zeros: {X.nnz} "
+                  f"({X.nnz / max(X.shape[0] * X.shape[1], 1):.2%} dense)")
+            self.split_and_train(X, y, n_jobs)
+            return
+        
         # Convert categorical variables to numeric
         if len(categorical_columns) > 0:
             print(f"\nEncoding categorical columns: {categorical_columns.tolist()}")
@@ -108,7 +141,10 @@ class GastricCancerEnsemblePredictor:
                 X[col] = pd.to_numeric(X[col], errors='coerce')
                 X[col] = X[col].fillna(X[col].mean())
         
-        # Split and scale data
+        self.split_and_train(X, y, n_jobs, cv, search, n_candidates)
+
+    def split_and_train(self, X, y, n_jobs=1, cv=0, search='none', n_candidates=20):
+        """Split, scale (a CSR matrix stays sparse) and train on an encoded feature matrix"""
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
@@ -116,41 +152,114 @@ class GastricCancerEnsemblePredictor:
         print(f"\nTraining set shape: {X_train.shape}")
         print(f"Test set shape: {X_test.shape}")
         
+        if cv:
+            self.tune(X_train.to_numpy(dtype=float), y_train.to_numpy(), cv, search, n_candidates, n_jobs)
+        
         # Train all models
         print("\nTraining models...")
+        self.train_members(X_train_scaled, y_train, X_test_scaled, y_test, n_jobs)
+
+    def train_chunked(self, data_path, chunksize, n_jobs=1, work_dir=None, cv=0, search='none',
+                      n_candidates=20):
+        """Train all models from a CSV streamed in chunks into memory-mapped matrices"""
+        print(f"Streaming data from: {data_path} ({chunksize} rows per chunk)")
+        if not os.path.exists(data_path):
+            raise FileNotFoundError(f"Dataset not found at {data_path}")
+        
+        # Only the header is needed to check the target column
+        columns = pd.read_csv(data_path, nrows=0).columns
+        if self.target_column not in columns:
+            print(f"\nWarning: Target column '{self.target_column}' not found in dataset.")
+            self.target_column = columns[-1]
+            print(f"Using '{self.target_column}' as the target column.")
+        
+        loader = ChunkedDatasetLoader(data_path, self.target_column, chunksize=chunksize, work_dir=work_dir)
+        
+        try:
+            # Pass 1: vocabularies, imputation values and scaler statistics
+            loader.learn()
+            self.feature_names = loader.feature_names
+            self.encoded_feature_names = loader.encoded_feature_names
+            self.scaler = loader.fitted_scaler()
+            print(f"\nFeatures being used: {self.feature_names}")
+            print(f"Encoded features: {len(self.encoded_feature_names)}")
+        
+            # Pass 2: encoded, scaled float32 rows written to disk
+            X_train_scaled, X_test_scaled, y_train, y_test = loader.materialize()
+            self.training_rows = loader.n_train + loader.n_test
+            print(f"\nTraining set shape: {X_train_scaled.shape}")
+            print(f"Test set shape: {X_test_scaled.shape}")
+            print(f"Memory-mapped matrices in: {loader.work_dir}")
+        
+            if cv:
+                # Unscaled rows, as in train(): every fold is scaled on its own training rows
+                self.tune(loader.materialize_unscaled_train(), y_train, cv, search, n_candidates, n_jobs)
+        
+            print("\nTraining models...")
+            self.train_members(X_train_scaled, y_train, X_test_scaled, y_test, n_jobs)
+        finally:
+            # Scratch matrices hold the whole dataset; drop them unless work_dir was given
+            loader.cleanup()
+
+    def tune(self, X_train, y_train, cv=5, search='random', n_candidates=20, n_jobs=1):
+        """Cross-validate the models on the training rows and switch them to the best parameters found"""
+        print(f"\nCross-validating models ({cv} folds, search: {search})...")
+        self.tuning = tune_members(self.models, X_train, y_train, cv=cv, search=search,
+                                   n_candidates=n_candidates, n_jobs=n_jobs)
+        apply_tuning(self.models, None, self.tuning)
+        for name, result in self.tuning.items():
+            print(f"{name} - {describe_tuning(result)}")
+
+    def train_members(self, X_train_scaled, y_train, X_test_scaled, y_test, n_jobs=1):
+        """Fit and score every model on prepared matrices"""
         self.model_performance = {}
-        for name, model in self.models.items():
-            print(f"\nTraining {name}...")
-            try:
-                model.fit(X_train_scaled, y_train)
-                train_score = model.score(X_train_scaled, y_train)
-                test_score = model.score(X_test_scaled, y_test)
-                self.model_performance[name] = {
-                    'train_score': train_score,
-                    'test_score': test_score
-                }
-                print(f"{name} - Train Score: {train_score:.4f}, Test Score: {test_score:.4f}")
-            except Exception as e:
-                print(f"Error training {name}: {str(e)}")
-                self.model_performance[name] = {
-                    'train_score': None,
-                    'test_score': None,
-                    'error': str(e)
-                }
+        for name, model, performance in train_members(self.models, X_train_scaled, y_train,
+                                                      X_test_scaled, y_test, n_jobs=n_jobs):
+            print(f"\nTrained {name}")
+            self.model_performance[name] = performance
+            if 'error' in performance:
+                print(f"Error training {name}: {performance['error']}")
+                continue
+            self.models[name] = model
+            print(f"{name} - Train Score: {performance['train_score']:.4f}, Test Score: {performance['test_score']:.4f}")
+        if self.tuning:
+            # Cross-validated accuracy alongside the single held-out test score
+            apply_tuning(self.models, self.model_performance, self.tuning)
+        if self.combiner['default'] == 'stacking':
+            self.fit_combiner(X_train_scaled, y_train, X_test_scaled, y_test)
+
+    def fit_combiner(self, X_train_scaled, y_train, X_test_scaled, y_test):
+        """Fit the logistic stacker over the members' out-of-fold probabilities"""
+        print("\nFitting stacking combiner...")
+        members = {name: model for name, model in self.models.items()
+                   if 'error' not in self.model_performance.get(name, {})}
+        self.combiner['stacking'] = fit_stacker(members, X_train_scaled, y_train, X_test_scaled, y_test)
+        print(f"Stacking combiner - Train Score: {self.combiner['stacking']['train_score']:.4f}, "
+              f"Test Score: {self.combiner['stacking']['test_score']:.4f}")
 
     def save_models(self, save_path):
-        """Save all models and components"""
+        """Save all models and components as an artifact bundle directory"""
         print(f"\nSaving models to: {save_path}")
         save_dict = {
-            'models': self.models,
+            # Members that failed to train are left out of the artifact
+            'models': {name: model for name, model in self.models.items()
+                       if 'error' not in self.model_performance.get(name, {})},
             'scaler': self.scaler,
             'feature_names': self.feature_names,
             'encoded_feature_names': self.encoded_feature_names,
             'model_performance': self.model_performance,
-            'target_column': self.target_column
+            # Compiled one-hot layout and scaler statistics used at prediction time
+            'encoder': FeatureEncoder(self.feature_names, self.encoded_feature_names,
+                                      self.scaler.mean_ if self.scaler.with_mean
+                                      else np.zeros(len(self.encoded_feature_names)),
+                                      self.scaler.scale_).to_dict(),
+            'combiner': self.combiner,
+            'target_column': self.target_column,
+            # Rows of the CSV used, so incremental_training.py knows which rows are new
+            'training_rows': self.training_rows,
+            'model_version': 1
         }
-        with open(save_path, 'wb') as f:
-            pickle.dump(save_dict, f)
+        save_bundle(save_dict, save_path)
         print("Models saved successfully!")
         
     def predict(self, data):
@@ -210,18 +319,39 @@ class GastricCancerEnsemblePredictor:
         return predictions
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the gastric cancer ensemble")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Models to train concurrently in separate processes (-1: one per CPU)")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Stream the CSV in chunks of this many rows into memory-mapped matrices")
+    parser.add_argument('--cv', type=int, default=0,
+                        help="Cross-validate every model with this many folds (0: off)")
+    parser.add_argument('--search', choices=('none', 'random', 'halving'), default='none',
+                        help="Hyperparameter search run within the cross-validation")
+    parser.add_argument('--candidates', type=int, default=20,
+                        help="Parameter candidates per model, including the current ones")
+    parser.add_argument('--sparse', action='store_true',
+                        help="Encode into a CSR matrix scaled without centring (for high-cardinality columns)")
+    parser.add_argument('--combiner', choices=COMBINERS, default='mean',
+                        help="Default way predictions combine the members ('stacking' fits a stacker)")
+    args = parser.parse_args()
+
     try:
         # Define paths
         current_dir = os.path.dirname(os.path.abspath(__file__))
         DATA_PATH = os.path.join(current_dir, "gastric_cancer.csv")
-        MODEL_SAVE_PATH = os.path.join(current_dir, "gastric_cancer_ensemble.pkl")
+        MODEL_SAVE_PATH = os.path.join(current_dir, "gastric_cancer_ensemble")
         
         print("Starting model training process...")
         print(f"Current directory: {current_dir}")
         
         # Initialize and train
-        predictor = GastricCancerEnsemblePredictor()
-        predictor.train(DATA_PATH)
+        predictor = GastricCancerEnsemblePredictor(sparse=args.sparse)
+        predictor.combiner['default'] = args.combiner
+        predictor.train(DATA_PATH, n_jobs=args.jobs, chunksize=args.chunksize, cv=args.cv,
+                        search=args.search, n_candidates=args.candidates)
         
         # Save the trained model
         predictor.save_models(MODEL_SAVE_PATH)
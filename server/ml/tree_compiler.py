@@ -0,0 +1,327 @@
+import json
+import os
+
+import numpy as np
+
+# Arrays that make up a compiled ensemble, stored as .npy files in artifact bundles
+ARRAY_NAMES = ('feature', 'threshold', 'left', 'right', 'default_left', 'value', 'roots', 'tree_weights', 'classes')
+
+# How leaf values become class probabilities
+MEAN_PROBA = 'mean_proba'            # sklearn trees: average of normalised leaf class counts
+BINARY_LOGISTIC = 'binary_logistic'  # XGBoost binary:logistic: sigmoid of the weighted leaf sum
+
+
+class CompiledTrees:
+    """
+    Tree ensemble flattened into node arrays and evaluated with NumPy
+
+    All trees share one set of node arrays (feature, threshold, left, right,
+    default_left, value); roots holds each tree's first node. Leaves point to
+    themselves, so a batch is traversed by max_depth vectorized steps over a
+    (rows x trees) matrix of node indices with no per-row Python.
+
+    Comparisons follow the source library so leaves match exactly: sklearn sends
+    x <= threshold left after casting X to float32, XGBoost sends x < threshold
+    left in float32 and missing values along default_left.
+
+    Sparse (CSR) input is narrowed to the columns the trees split on before it
+    is densified. Entries absent from the matrix are zeros for sklearn trees and
+    missing values for XGBoost, as each library reads sparse input.
+    """
+
+    accepts_sparse = True
+
+    def __init__(self, kind, feature, threshold, left, right, default_left, value, roots,
+                 max_depth, classes, tree_weights=None, base_margin=0.0, n_features=None):
+        self.kind = kind
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float32 if kind == BINARY_LOGISTIC else np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.value = np.asarray(value)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes)
+        self.tree_weights = (np.ones(len(self.roots), dtype=np.float32) if tree_weights is None
+                             else np.asarray(tree_weights, dtype=np.float32))
+        self.base_margin = float(base_margin)
+        self.n_features_in_ = n_features
+        # Columns any node splits on, and node features renumbered into them; built on
+        # the first sparse batch so dense-only workers keep no per-process node arrays
+        self.used_features = None
+        self.used_feature = None
+
+    def dense_used_columns(self, X):
+        """The split columns of a sparse matrix as a dense float32 array"""
+        if self.used_feature is None:
+            used_features, used_feature = np.unique(self.feature, return_inverse=True)
+            self.used_feature = used_feature.astype(np.int32).reshape(self.feature.shape)
+            self.used_features = used_features
+        used = X[:, self.used_features].tocoo()
+        fill = np.nan if self.kind == BINARY_LOGISTIC else 0.0
+        dense = np.full(used.shape, fill, dtype=np.float32)
+        dense[used.row, used.col] = used.data
+        return dense
+
+    def apply(self, X):
+        """Leaf index reached in every tree, shape (rows, trees)"""
+        if hasattr(X, 'tocsr'):
+            X = self.dense_used_columns(X.tocsr())
+            feature = self.used_feature
+        else:
+            X = np.asarray(X, dtype=np.float32)
+            feature = self.feature
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        strict = self.kind == BINARY_LOGISTIC
+
+        for _ in range(self.max_depth):
+            values = X[rows, feature[nodes]]
+            threshold = self.threshold[nodes]
+            go_left = values < threshold if strict else values <= threshold
+            missing = np.isnan(values)
+            if missing.any():
+                go_left = np.where(missing, self.default_left[nodes], go_left)
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+
+        if self.kind == BINARY_LOGISTIC:
+            # Accumulate the margin tree by tree in float32, as XGBoost does
+            margin = np.full(leaves.shape[0], self.base_margin, dtype=np.float32)
+            leaf_values = self.value[:, 0]
+            for tree in range(leaves.shape[1]):
+                margin += leaf_values[leaves[:, tree]] * self.tree_weights[tree]
+            positive = np.float32(1.0) / (np.float32(1.0) + np.exp(-margin))
+            return np.column_stack([np.float32(1.0) - positive, positive])
+
+        # Sum the trees in order, then average, as RandomForestClassifier does
+        proba = self.value[leaves[:, 0]].copy()
+        for tree in range(1, leaves.shape[1]):
+            proba += self.value[leaves[:, tree]]
+        if leaves.shape[1] > 1:
+            proba /= leaves.shape[1]
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def to_arrays(self):
+        """Arrays and JSON metadata for storage"""
+        arrays = {name: getattr(self, 'classes_' if name == 'classes' else name) for name in ARRAY_NAMES}
+        meta = {'kind': self.kind, 'max_depth': self.max_depth, 'base_margin': self.base_margin,
+                'n_features': self.n_features_in_}
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        return cls(meta['kind'], arrays['feature'], arrays['threshold'], arrays['left'], arrays['right'],
+                   arrays['default_left'], arrays['value'], arrays['roots'], meta['max_depth'],
+                   arrays['classes'], arrays['tree_weights'], meta['base_margin'], meta['n_features'])
+
+
+def _flatten(trees):
+    """
+    Concatenate per-tree node lists into shared arrays
+
+    Args:
+        trees: List of (feature, threshold, left, right, default_left, value) tuples
+            with tree-local child indices and -1 children at leaves
+
+    Returns:
+        Concatenated arrays with global indices, leaves pointing to themselves,
+        plus the roots and the deepest tree's depth
+    """
+    columns = [[] for _ in range(6)]
+    roots = []
+    max_depth = 0
+    offset = 0
+    for feature, threshold, left, right, default_left, value in trees:
+        n_nodes = len(feature)
+        is_leaf = left < 0
+        own = np.arange(n_nodes) + offset
+        left = np.where(is_leaf, own, left + offset)
+        right = np.where(is_leaf, own, right + offset)
+        feature = np.where(is_leaf, 0, feature)
+
+        for column, array in zip(columns, (feature, threshold, left, right, default_left, value)):
+            column.append(array)
+        roots.append(offset)
+
+        # Depth of every node, from the parent links (parents come before children)
+        depth = np.zeros(n_nodes, dtype=np.int64)
+        for node in range(n_nodes):
+            if not is_leaf[node]:
+                depth[left[node] - offset] = depth[node] + 1
+                depth[right[node] - offset] = depth[node] + 1
+        max_depth = max(max_depth, int(depth.max()))
+        offset += n_nodes
+
+    arrays = [np.concatenate(column) for column in columns]
+    return arrays, np.array(roots), max_depth
+
+
+def compile_sklearn(model):
+    """Compile a fitted DecisionTreeClassifier or RandomForestClassifier"""
+    estimators = model.estimators_ if hasattr(model, 'estimators_') else [model]
+    if getattr(model, 'n_outputs_', 1) != 1:
+        raise ValueError("Multi-output trees are not supported")
+
+    trees = []
+    for estimator in estimators:
+        tree = estimator.tree_
+        value = tree.value[:, 0, :].astype(np.float64)
+        # Normalise leaf counts the way DecisionTreeClassifier.predict_proba does
+        totals = value.sum(axis=1, keepdims=True)
+        value = value / np.where(totals == 0, 1.0, totals)
+        trees.append((tree.feature, tree.threshold, tree.children_left, tree.children_right,
+                      np.zeros(tree.node_count, dtype=bool), value))
+
+    (feature, threshold, left, right, default_left, value), roots, max_depth = _flatten(trees)
+    return CompiledTrees(MEAN_PROBA, feature, threshold, left, right, default_left, value, roots,
+                         max_depth, model.classes_, n_features=int(model.n_features_in_))
+
+
+def compile_xgboost(model):
+    """Compile a fitted binary XGBClassifier (gbtree or dart booster)"""
+    booster = model.get_booster()
+    dump = json.loads(booster.save_raw('json'))
+    learner = dump['learner']
+    objective = learner['objective']['name']
+    if objective != 'binary:logistic':
+        raise ValueError(f"Objective {objective} is not supported")
+
+    gradient_booster = learner['gradient_booster']
+    if gradient_booster['name'] == 'dart':
+        # Dart scales each tree by its drop weight at prediction time
+        tree_weights = gradient_booster['weight_drop']
+        gradient_booster = gradient_booster['gbtree']
+    elif gradient_booster['name'] == 'gbtree':
+        tree_weights = None
+    else:
+        raise ValueError(f"Booster {gradient_booster['name']} is not supported")
+
+    tree_dumps = gradient_booster['model']['trees']
+    # predict_proba stops at the best iteration when early stopping recorded one
+    best_iteration = booster.attributes().get('best_iteration')
+    if best_iteration is not None:
+        tree_dumps = tree_dumps[:int(best_iteration) + 1]
+        tree_weights = tree_weights[:len(tree_dumps)] if tree_weights is not None else None
+
+    trees = []
+    for tree in tree_dumps:
+        if int(tree['tree_param'].get('size_leaf_vector', '1')) > 1 or tree.get('categories_nodes'):
+            raise ValueError("Vector-leaf and categorical trees are not supported")
+        left = np.array(tree['left_children'], dtype=np.int64)
+        # Leaves keep their output in split_conditions
+        values = np.array(tree['split_conditions'], dtype=np.float32)
+        trees.append((np.array(tree['split_indices'], dtype=np.int64), values, left,
+                      np.array(tree['right_children'], dtype=np.int64),
+                      np.array(tree['default_left'], dtype=bool), values[:, None]))
+
+    (feature, threshold, left, right, default_left, value), roots, max_depth = _flatten(trees)
+
+    # base_score is stored as a probability; the margin starts from its logit
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    base_margin = float(np.log(np.float32(base_score) / (np.float32(1.0) - np.float32(base_score))))
+
+    return CompiledTrees(BINARY_LOGISTIC, feature, threshold, left, right, default_left, value, roots,
+                         max_depth, model.classes_, tree_weights, base_margin,
+                         n_features=int(learner['learner_model_param']['num_feature']))
+
+
+COMPILERS = {
+    'DecisionTreeClassifier': compile_sklearn,
+    'RandomForestClassifier': compile_sklearn,
+    'XGBClassifier': compile_xgboost,
+}
+
+
+def compile_model(model):
+    """Compiled form of a tree model, or None for models that are not compiled"""
+    compiler = COMPILERS.get(type(model).__name__)
+    return compiler(model) if compiler is not None else None
+
+
+def compile_members(models):
+    """Replace compilable members of a models dictionary with their compiled form"""
+    compiled = {}
+    for name, model in models.items():
+        try:
+            compiled[name] = compile_model(model) or model
+        except ValueError:
+            # Layouts the compiler does not handle keep the original estimator
+            compiled[name] = model
+    return compiled
+
+
+def save_compiled(compiled, directory):
+    """Write a compiled ensemble's arrays and return its manifest spec"""
+    os.makedirs(directory, exist_ok=True)
+    arrays, meta = compiled.to_arrays()
+    files = {}
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), np.ascontiguousarray(array), allow_pickle=False)
+        files[name] = name + '.npy'
+    return dict(meta, files=files)
+
+
+def load_compiled(spec, directory, mmap=True):
+    """Rebuild a compiled ensemble written by save_compiled"""
+    arrays = {
+        name: np.load(os.path.join(directory, filename), mmap_mode='r' if mmap else None, allow_pickle=False)
+        for name, filename in spec['files'].items()
+    }
+    return CompiledTrees.from_arrays(arrays, spec)
+
+
+if __name__ == "__main__":
+    import pickle
+    import sys
+    import time
+
+    from feature_encoder import FeatureEncoder
+
+    # Parity check: compiled trees against the original estimators on heart.csv
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    data_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(current_dir, "heart.csv")
+    model_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(current_dir, "heart_disease_ensemble.pkl")
+    tolerance = 1e-6
+
+    import pandas as pd
+
+    with open(model_path, 'rb') as f:
+        model_dict = pickle.load(f)
+    records = pd.read_csv(data_path)[model_dict['feature_names']].to_dict('records')
+    X = FeatureEncoder.from_model_dict(model_dict).transform(records)
+
+    failed = False
+    for name, model in model_dict['models'].items():
+        compiled = compile_model(model)
+        if compiled is None:
+            continue
+
+        expected = model.predict_proba(X)
+        actual = compiled.predict_proba(X)
+        max_error = float(np.max(np.abs(expected.astype(np.float64) - actual)))
+        label_mismatches = int(np.sum(model.predict(X) != compiled.predict(X)))
+
+        start = time.perf_counter()
+        for i in range(200):
+            model.predict_proba(X[i:i + 1])
+        native_us = (time.perf_counter() - start) / 200 * 1e6
+        start = time.perf_counter()
+        for i in range(200):
+            compiled.predict_proba(X[i:i + 1])
+        compiled_us = (time.perf_counter() - start) / 200 * 1e6
+
+        ok = max_error <= tolerance and label_mismatches == 0
+        failed = failed or not ok
+        print(f"{name:<14} {'OK' if ok else 'MISMATCH'}  max |dp| {max_error:.2e}  "
+              f"label mismatches {label_mismatches}/{len(X)}  "
+              f"one row {native_us:8.1f} us -> {compiled_us:6.1f} us")
+
+    sys.exit(1 if failed else 0)
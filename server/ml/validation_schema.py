@@ -0,0 +1,183 @@
+import math
+
+import numpy as np
+
+_MISSING = object()
+_INVALID = float('nan')
+
+
+def _finite_int(value):
+    """value, or _INVALID when it is beyond the float range (validate_batch needs floats)"""
+    try:
+        float(value)
+    except OverflowError:
+        return _INVALID
+    return value
+
+
+class NumberField:
+    """Numeric field with an inclusive range"""
+
+    def __init__(self, minimum, maximum, integer_first=True):
+        self.minimum = minimum
+        self.maximum = maximum
+        # int() is tried before float(), as the original (int, float, ...) validators did,
+        # so 54.7 becomes 54 while the string "54.7" stays 54.7
+        self.integer_first = integer_first
+
+    def coerce(self, value):
+        """Converted value, or NaN when the value is not a number"""
+        kind = type(value)
+        if kind is int:
+            return _finite_int(value)
+        if kind is float:
+            if not math.isfinite(value):
+                return _INVALID
+            return int(value) if self.integer_first else value
+        if kind is bool:
+            return int(value) if self.integer_first else float(value)
+        if kind is str:
+            text = value.strip()
+            digits = text.lstrip('+-')
+            # isdigit() also accepts non-ASCII digits such as "²" that int() rejects
+            if self.integer_first and digits.isascii() and digits.isdigit():
+                try:
+                    return _finite_int(int(text))
+                except ValueError:
+                    # More digits than int() converts
+                    return _INVALID
+            try:
+                number = float(text)
+            except ValueError:
+                return _INVALID
+            return number if math.isfinite(number) else _INVALID
+        return _INVALID
+
+    def check(self, value):
+        """Converted value, or _INVALID"""
+        value = self.coerce(value)
+        if value != value or not (self.minimum <= value <= self.maximum):
+            return _INVALID
+        return value
+
+
+class ChoiceField:
+    """String field restricted to a fixed set of values"""
+
+    def __init__(self, choices):
+        self.choices = frozenset(choices)
+
+    def check(self, value):
+        value = value if type(value) is str else str(value)
+        return value if value in self.choices else _INVALID
+
+
+class FieldSchema:
+    """Validator for conditions with explicit per-field rules (heart disease)"""
+
+    def __init__(self, fields):
+        self.fields = list(fields.items())
+
+    def validate(self, data):
+        """Return a new, coerced copy of data or raise ValueError for the first bad field"""
+        validated = dict(data)
+        for name, spec in self.fields:
+            value = data.get(name, _MISSING)
+            if value is _MISSING:
+                raise ValueError(f"Missing required field: {name}")
+            checked = spec.check(value)
+            if checked is _INVALID:
+                raise ValueError(f"Invalid value for {name}: {value}")
+            validated[name] = checked
+        return validated
+
+    def validate_batch(self, records):
+        """
+        Validate records column by column
+
+        Returns:
+            (validated, errors): validated is a list of coerced copies, errors a list
+            of messages; each has None where the other has a value
+        """
+        n = len(records)
+        errors = [None] * n
+        failed = np.zeros(n, dtype=bool)
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                errors[i] = "Record must be a JSON object"
+                failed[i] = True
+        rows = [record if isinstance(record, dict) else {} for record in records]
+        columns = {}
+
+        for name, spec in self.fields:
+            raw = [row.get(name, _MISSING) for row in rows]
+            missing = np.fromiter((value is _MISSING for value in raw), dtype=bool, count=n)
+
+            if isinstance(spec, NumberField):
+                values = [spec.coerce(value) if value is not _MISSING else _INVALID for value in raw]
+                numbers = np.array(values, dtype=np.float64)
+                with np.errstate(invalid='ignore'):
+                    bad = ~((numbers >= spec.minimum) & (numbers <= spec.maximum))
+            else:
+                values = [value if type(value) is str else str(value) for value in raw]
+                bad = np.fromiter((value not in spec.choices for value in values), dtype=bool, count=n)
+            columns[name] = values
+
+            # Report only the first failing field of each record, as validate() does
+            for i in np.flatnonzero((missing | bad) & ~failed):
+                errors[i] = (f"Missing required field: {name}" if missing[i]
+                             else f"Invalid value for {name}: {raw[i]}")
+            failed |= missing | bad
+
+        validated = [None] * n
+        for i in np.flatnonzero(~failed):
+            row = dict(rows[i])
+            for name, _ in self.fields:
+                row[name] = columns[name][i]
+            validated[i] = row
+        return validated, errors
+
+
+class DefaultFillSchema:
+    """
+    Validator for conditions that fill unknown fields with defaults (gastric cancer)
+
+    The case-insensitive lookup and the complete default row are built once, so
+    validating a record is one copy of the default row plus one pass over its keys.
+    """
+
+    def __init__(self, feature_names, default_for):
+        self.feature_names = list(feature_names)
+        self.default_row = {field: default_for(field) for field in self.feature_names}
+        self.fields = frozenset(self.feature_names)
+        self.by_lower = {}
+        for field in self.feature_names:
+            self.by_lower.setdefault(field.lower(), []).append(field)
+
+    def validate(self, data):
+        """Return the complete feature row for data"""
+        if not isinstance(data, dict):
+            raise ValueError("Record must be a JSON object")
+        row = dict(self.default_row)
+        for key, value in data.items():
+            if not isinstance(key, str):
+                continue
+            # Case-insensitive matches fill fields the caller did not name exactly
+            for field in self.by_lower.get(key.lower(), ()):
+                if field not in data:
+                    row[field] = value
+            if key in self.fields:
+                row[key] = value
+        return row
+
+    def validate_batch(self, records):
+        validated = []
+        errors = []
+        for record in records:
+            try:
+                validated.append(self.validate(record))
+                errors.append(None)
+            except ValueError as e:
+                validated.append(None)
+                errors.append(str(e))
+        return validated, errors
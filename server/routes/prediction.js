@@ -3,6 +3,8 @@ const router = express.Router();
 const predictionController = require('../controllers/predictionController');
 const authenticateUser = require('../middleware/authenticateUser');
 
+const MAX_BATCH_SIZE = parseInt(process.env.MAX_BATCH_SIZE, 10) || 10000;
+
 // Route for making a heart disease prediction
 router.post('/predict', authenticateUser, async (req, res) => {
     try {
@@ -35,7 +37,7 @@ router.post('/predict', authenticateUser, async (req, res) => {
             Age, Sex, ChestPainType, RestingBP, Cholesterol,
             FastingBS, RestingECG, MaxHR, ExerciseAngina, 
             Oldpeak, ST_Slope
-        });
+        }, req.user.userId);
 
         res.json({
             success: true,
@@ -53,15 +55,59 @@ router.post('/predict', authenticateUser, async (req, res) => {
     }
 });
 
+// Route for scoring many patient records in one pass
+router.post('/predict/batch', authenticateUser, async (req, res) => {
+    const { records, condition_type } = req.body;
+
+    if (!Array.isArray(records) || records.length === 0) {
+        return res.status(400).json({
+            success: false,
+            message: 'records must be a non-empty array'
+        });
+    }
+
+    if (records.length > MAX_BATCH_SIZE) {
+        return res.status(400).json({
+            success: false,
+            message: `At most ${MAX_BATCH_SIZE} records can be scored per request`
+        });
+    }
+
+    try {
+        const results = await predictionController.makeBatchPrediction(
+            records,
+            condition_type || 'heart_disease',
+            req.user.userId
+        );
+
+        res.json({
+            success: true,
+            predictions: results,
+            user: req.user.id
+        });
+
+    } catch (error) {
+        console.error('Batch Prediction Error:', error);
+        res.status(500).json({
+            success: false,
+            message: 'Error processing batch prediction',
+            error: error.message
+        });
+    }
+});
+
 // Route to get prediction history for authenticated user
 router.get('/prediction-history', authenticateUser, async (req, res) => {
     try {
-        const userId = req.user.id;
-        const history = await predictionController.getPredictionHistory(userId);
+        // Tokens are signed with { userId } (see authRoutes)
+        const userId = req.user.userId;
+        const limit = Math.min(parseInt(req.query.limit, 10) || 50, 500);
+        const history = await predictionController.getPredictionHistory(userId, limit, req.query.cursor || null);
         
         res.json({
             success: true,
-            predictionHistory: history
+            predictionHistory: history.predictions,
+            nextCursor: history.nextCursor
         });
     } catch (error) {
         console.error('Prediction History Error:', error);
@@ -4,11 +4,13 @@ const mongoose = require('mongoose');
 const cors = require('cors');
 const authRoutes = require('./routes/authRoutes');
 const predictionRoutes = require('./routes/prediction');
+const { pool: predictionPool } = require('./services/predictionWorkerPool');
 
 const app = express();
 
 app.use(cors());
-app.use(express.json()); 
+// Batch prediction bodies can carry thousands of records
+app.use(express.json({ limit: process.env.JSON_BODY_LIMIT || '5mb' }));
 
 mongoose.connect(process.env.MONGO_URI, {
     useNewUrlParser: true,
@@ -23,4 +25,8 @@ app.use('/api/auth', authRoutes);
 app.use('/api', predictionRoutes);
 
 const PORT = process.env.PORT || 5000;
-app.listen(PORT, () => console.log(`Server running on port ${PORT}`));
\ No newline at end of file
+app.listen(PORT, () => {
+  console.log(`Server running on port ${PORT}`);
+  // Warm the prediction workers so the first request does not pay model load time
+  predictionPool.start();
+});
\ No newline at end of file
@@ -0,0 +1,211 @@
+const { spawn } = require('child_process');
+const path = require('path');
+const readline = require('readline');
+
+const PYTHON_SCRIPT = path.join(__dirname, '../ml/predict.py');
+const PYTHON_BIN = process.env.PYTHON_BIN || 'python';
+const DEFAULT_POOL_SIZE = parseInt(process.env.PREDICTION_WORKERS, 10) || 2;
+const DEFAULT_TIMEOUT_MS = parseInt(process.env.PREDICTION_TIMEOUT_MS, 10) || 30000;
+const RESTART_DELAY_MS = 1000;
+// Deadline sent with each prediction: members still running by then are reported as
+// timed out and the ensemble is built from the rest, before the request itself times out
+const DEFAULT_DEADLINE_MS = parseInt(process.env.PREDICTION_DEADLINE_MS, 10) || Math.floor(DEFAULT_TIMEOUT_MS * 0.8);
+
+// Result cache per worker (PREDICTION_CACHE_SIZE=0 disables it); PREDICTION_CACHE_DB
+// names a SQLite file the workers share as a second cache level
+const WORKER_ARGS = ['--worker', '--cache-size', process.env.PREDICTION_CACHE_SIZE || '1024'];
+if (process.env.PREDICTION_CACHE_TTL) {
+    WORKER_ARGS.push('--cache-ttl', process.env.PREDICTION_CACHE_TTL);
+}
+if (process.env.PREDICTION_CACHE_DB) {
+    WORKER_ARGS.push('--cache-db', process.env.PREDICTION_CACHE_DB);
+}
+// Ensemble members run concurrently so a stalled one cannot hold up the response
+WORKER_ARGS.push('--member-threads', process.env.PREDICTION_MEMBER_THREADS || '8');
+// Concurrent single-record requests are scored together in micro-batches
+// (PREDICTION_MICRO_BATCH=0 answers them one at a time)
+if (process.env.PREDICTION_MICRO_BATCH !== '0') {
+    WORKER_ARGS.push('--micro-batch',
+        '--batch-size', process.env.PREDICTION_BATCH_SIZE || '32',
+        '--batch-wait-ms', process.env.PREDICTION_BATCH_WAIT_MS || '5');
+}
+// Results of predictions made for a user go to an append-only log on local disk,
+// which backs the prediction history (PREDICTION_LOG_DIR=off disables it)
+const PREDICTION_LOG_DIR = process.env.PREDICTION_LOG_DIR || path.join(__dirname, '../ml/prediction_history');
+if (PREDICTION_LOG_DIR !== 'off') {
+    WORKER_ARGS.push('--log-dir', PREDICTION_LOG_DIR);
+}
+
+// A single long-running `predict.py --worker` process speaking newline-delimited JSON
+class PredictionWorker {
+    constructor(index, onExit) {
+        this.index = index;
+        this.onExit = onExit;
+        this.pending = new Map();
+        this.process = null;
+        this.alive = false;
+    }
+
+    start() {
+        const child = spawn(PYTHON_BIN, [PYTHON_SCRIPT, ...WORKER_ARGS]);
+        this.process = child;
+        this.alive = true;
+
+        readline.createInterface({ input: child.stdout }).on('line', (line) => {
+            let response;
+            try {
+                response = JSON.parse(line);
+            } catch (e) {
+                console.error(`Prediction worker ${this.index} sent invalid JSON:`, line);
+                return;
+            }
+
+            const request = this.pending.get(response.id);
+            if (!request) {
+                return;
+            }
+            this.pending.delete(response.id);
+            clearTimeout(request.timer);
+            request.resolve(response.result);
+        });
+
+        child.stderr.on('data', (data) => {
+            console.error(`Python Error (worker ${this.index}):`, data.toString());
+        });
+
+        child.on('error', (err) => {
+            console.error(`Prediction worker ${this.index} spawn error:`, err);
+        });
+
+        // Writing to a worker that has just died fails with EPIPE; without a listener
+        // that error would be thrown and take the whole server down
+        child.stdin.on('error', (err) => {
+            console.error(`Prediction worker ${this.index} stdin error:`, err.message);
+            this.alive = false;
+            this.failPending(new Error(`Prediction worker is unavailable: ${err.message}`));
+        });
+
+        child.on('close', (code) => {
+            this.alive = false;
+            this.failPending(new Error(`Prediction worker exited with code ${code}`));
+            this.onExit(this, code);
+        });
+    }
+
+    send(id, payload, timeoutMs) {
+        return new Promise((resolve, reject) => {
+            if (!this.alive) {
+                reject(new Error('Prediction worker is not running'));
+                return;
+            }
+
+            const timer = setTimeout(() => {
+                this.pending.delete(id);
+                reject(new Error(`Prediction timed out after ${timeoutMs}ms`));
+            }, timeoutMs);
+
+            this.pending.set(id, { resolve, reject, timer });
+            this.process.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+        });
+    }
+
+    failPending(err) {
+        this.pending.forEach(({ reject, timer }) => {
+            clearTimeout(timer);
+            reject(err);
+        });
+        this.pending.clear();
+    }
+
+    stop() {
+        this.alive = false;
+        if (this.process) {
+            this.process.stdin.end();
+            this.process.kill();
+        }
+    }
+}
+
+// Keeps a fixed number of warm workers and restarts any that crash
+class PredictionWorkerPool {
+    constructor(size = DEFAULT_POOL_SIZE, timeoutMs = DEFAULT_TIMEOUT_MS, deadlineMs = DEFAULT_DEADLINE_MS) {
+        this.size = size;
+        this.timeoutMs = timeoutMs;
+        this.deadlineMs = deadlineMs;
+        this.workers = [];
+        this.nextId = 1;
+        this.closed = false;
+    }
+
+    start() {
+        for (let i = 0; i < this.size; i++) {
+            const worker = new PredictionWorker(i, (w, code) => this.handleExit(w, code));
+            worker.start();
+            this.workers.push(worker);
+        }
+    }
+
+    handleExit(worker, code) {
+        if (this.closed) {
+            return;
+        }
+        console.error(`Prediction worker ${worker.index} exited with code ${code}, restarting`);
+        setTimeout(() => {
+            if (!this.closed) {
+                worker.start();
+            }
+        }, RESTART_DELAY_MS);
+    }
+
+    pickWorker() {
+        // Least outstanding requests among live workers
+        const live = this.workers.filter((w) => w.alive);
+        if (live.length === 0) {
+            return null;
+        }
+        return live.reduce((best, w) => (w.pending.size < best.pending.size ? w : best));
+    }
+
+    request(payload) {
+        if (this.workers.length === 0) {
+            this.start();
+        }
+
+        const worker = this.pickWorker();
+        if (!worker) {
+            return Promise.reject(new Error('No prediction workers available'));
+        }
+
+        const id = this.nextId++;
+        return worker.send(id, payload, this.timeoutMs);
+    }
+
+    predict(data, conditionType, userId) {
+        const payload = { data, condition_type: conditionType, latency_budget_ms: this.deadlineMs };
+        if (userId !== undefined && userId !== null) {
+            payload.user_id = String(userId);
+        }
+        return this.request(payload);
+    }
+
+    // One page of a user's logged predictions, newest first; pass the previous
+    // page's nextCursor to continue
+    history(userId, limit, cursor) {
+        return this.request({ op: 'history', user_id: String(userId), limit, cursor, newest_first: true });
+    }
+
+    close() {
+        this.closed = true;
+        this.workers.forEach((w) => w.stop());
+        this.workers = [];
+    }
+}
+
+const pool = new PredictionWorkerPool();
+
+process.on('exit', () => pool.close());
+
+module.exports = {
+    pool,
+    PredictionWorkerPool
+};